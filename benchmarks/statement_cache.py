@@ -0,0 +1,92 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from loguru import logger
+
+from logic.backends import SqliteBackend, create_backend
+from logic.datasource import DataSource, StatementCache
+from logic.repositories import UserRepository, SELECT_TRANSACTIONS_BY_ACCOUNT_QUERY, GET_USER_BY_ID_QUERY, \
+    GET_CATEGORY_BY_NAME_QUERY
+
+
+def uncached(connection, sql: str, params: tuple) -> list:
+    # What every repository call did before the statement cache: a fresh cursor per operation.
+    cursor = connection.cursor()
+    try:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def cached(cache: StatementCache, sql: str, params: tuple) -> list:
+    return cache.execute(sql, params).fetchall()
+
+
+def measure(run, target, sql: str, params: tuple, repeat: int, rounds: int) -> float:
+    # Best of several rounds, in microseconds per execution.
+    best = float("inf")
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            run(target, sql, params)
+        best = min(best, time.perf_counter() - started)
+    return best / repeat * 1e6
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser(description="Compare hot queries with and without the statement cache.")
+    parser.add_argument("--backend", default="sqlite", choices=["sqlite", "mysql"])
+    parser.add_argument("--transactions", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args(arguments)
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    if args.backend == "sqlite":
+        directory = tempfile.mkdtemp(prefix="budget-statements-")
+        DataSource.configure(SqliteBackend(os.path.join(directory, "statements.sqlite3")))
+    else:
+        DataSource.configure(create_backend(args.backend))
+
+    from logic.services import UserService, AccountService
+
+    user_service = UserService()
+    account_service = AccountService()
+    login = f"statements_{os.getpid()}"
+    user_service.register(login, "password", "password")
+    user = user_service.get_user_by_login(login)
+    account_service.create("Statements", user, "0")
+    account = account_service.get_user_accounts(user)[0]
+    for index in range(args.transactions):
+        account_service.create_transaction(str(index % 97 - 48), "benchmark", account, None)
+
+    repository = UserRepository()
+    workload = [
+        ("SELECT_TRANSACTIONS_BY_ACCOUNT_QUERY", SELECT_TRANSACTIONS_BY_ACCOUNT_QUERY, (account.id,)),
+        ("GET_USER_BY_ID_QUERY", GET_USER_BY_ID_QUERY, (user.id,)),
+        ("GET_CATEGORY_BY_NAME_QUERY", GET_CATEGORY_BY_NAME_QUERY, ("Food",)),
+    ]
+
+    print(f"{'query':<40}{'fresh cursor, us':>18}{'cached, us':>14}{'speedup':>10}")
+    with DataSource.acquire() as connection:
+        cache = StatementCache(connection)
+        for name, query, params in workload:
+            sql = repository.translate(query)
+            baseline = measure(uncached, connection, sql, params, args.repeat, args.rounds)
+            reused = measure(cached, cache, sql, params, args.repeat, args.rounds)
+            print(f"{name:<40}{baseline:>18.1f}{reused:>14.1f}{baseline / reused:>9.2f}x")
+        cache.clear()
+    print(f"benchmark cache: prepared {cache.prepared}, reused {cache.reused}")
+    stats = DataSource.get_statement_stats()
+    print(f"application caches: prepared {stats['prepared']}, reused {stats['reused']}, "
+          f"reuse rate {stats['reuse_rate']:.2%}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
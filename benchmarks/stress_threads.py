@@ -0,0 +1,86 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from loguru import logger
+
+from logic.backends import SqliteBackend, create_backend
+from logic.datasource import DataSource
+
+
+def hammer_account(account_service, user_service, user, transactions: int, seed: int):
+    generator = random.Random(seed)
+    account = account_service.get_user_accounts(user)[0]
+    categories = user_service.get_user_categories(user)
+    opening_balance = expected = account.balance
+    for _ in range(transactions):
+        amount = Decimal(generator.randint(-50000, 50000)).scaleb(-2)
+        category = generator.choice(categories + [None])
+        success, transaction = account_service.create_transaction(str(amount), "stress", account, category)
+        if not success:
+            return [f"{user.login}: {transaction}"]
+        expected += amount
+        # Interleave reads so cursors of different threads are in flight at the same time.
+        user_service.get_user_categories(user)
+
+    errors = []
+    stored = account_service.get_account_by_id(account.id)
+    if stored.balance != expected:
+        errors.append(f"{user.login}: balance {stored.balance} != {expected}")
+    stored_transactions = account_service.get_account_transactions(stored)
+    if len(stored_transactions) != transactions:
+        errors.append(f"{user.login}: {len(stored_transactions)} transactions != {transactions}")
+    if opening_balance + sum(transaction.amount for transaction in stored_transactions) != expected:
+        errors.append(f"{user.login}: transaction sum doesn't match the balance")
+    summary_count = sum(summary.transaction_count for summary in account_service.get_category_month_summary(stored))
+    if summary_count != transactions:
+        errors.append(f"{user.login}: summary counts {summary_count} != {transactions}")
+    return errors
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser(description="Run the services from a thread pool and verify the results.")
+    parser.add_argument("--backend", default="sqlite", choices=["sqlite", "fake", "mysql"])
+    parser.add_argument("--users", type=int, default=16)
+    parser.add_argument("--transactions", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args(arguments)
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    if args.backend == "sqlite":
+        directory = tempfile.mkdtemp(prefix="budget-stress-")
+        DataSource.configure(SqliteBackend(os.path.join(directory, "stress.sqlite3")))
+    else:
+        DataSource.configure(create_backend(args.backend))
+
+    from logic.services import UserService, AccountService
+
+    user_service = UserService()
+    account_service = AccountService()
+    users = []
+    for index in range(args.users):
+        login = f"stress_{os.getpid()}_{index}"
+        user_service.register(login, "password", "password")
+        user = user_service.get_user_by_login(login)
+        account_service.create("Stress", user, "100")
+        users.append(user)
+
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(hammer_account, account_service, user_service, user, args.transactions, index)
+                   for index, user in enumerate(users)]
+        errors = [error for future in futures for error in future.result()]
+
+    for error in errors:
+        logger.error(error)
+    print(f"{args.users} users x {args.transactions} transactions on {args.workers} threads: "
+          f"{'FAILED' if errors else 'OK'}")
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,138 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable
+
+import numpy as np
+from loguru import logger
+
+DEFAULT_SIZES = ["4x2x100", "4x2x1000", "4x2x10000"]
+
+REPORT_VERSION = 1
+
+
+def parse_size(size: str) -> dict:
+    users, accounts, transactions = (int(part) for part in size.lower().split("x"))
+    return {"users": users, "accounts": accounts, "transactions": transactions}
+
+
+def time_call(call: Callable, repeat: int) -> dict:
+    durations = np.empty(repeat)
+    for index in range(repeat):
+        started = time.perf_counter()
+        call()
+        durations[index] = time.perf_counter() - started
+    durations *= 1000
+    return {"runs": repeat, "min_ms": round(float(durations.min()), 4),
+            "median_ms": round(float(np.median(durations)), 4), "mean_ms": round(float(durations.mean()), 4),
+            "p95_ms": round(float(np.percentile(durations, 95)), 4)}
+
+
+def run_size(size: dict, repeat: int, seed: int, backend_name: str, latency_ms: float,
+             result_cache_mb: float = 0) -> dict:
+    # Runs in its own process: the DataSource is a singleton bound to one database. With the result cache
+    # every repeat after the first would time a cache hit, so it is off unless asked for.
+    os.environ["BUDGET_RESULT_CACHE_MB"] = str(result_cache_mb)
+    from logic.fixtures import generate
+    from logic.backends import SqliteBackend, FakeBackend
+    from logic.datasource import DataSource
+
+    directory = tempfile.mkdtemp(prefix="budget-bench-")
+    os.chdir(directory)
+    if backend_name == "fake":
+        # Generate without latency, then add it for the timed calls only.
+        backend = FakeBackend(latency=0)
+    else:
+        backend = SqliteBackend(os.path.join(directory, "bench.sqlite3"))
+    DataSource.configure(backend)
+
+    from logic.querystats import QueryStatistics
+    from logic.services import UserService, AccountService
+
+    started = time.perf_counter()
+    users = generate(size["users"], size["accounts"], size["transactions"], seed=seed)
+    generate_seconds = time.perf_counter() - started
+
+    user_service = UserService()
+    account_service = AccountService()
+    user = users[0]
+    account = account_service.get_user_accounts(user)[0]
+    category = user_service.get_user_categories(user)[0]
+    statistics = QueryStatistics.get_instance()
+    statistics.reset()
+    if backend_name == "fake":
+        backend.database.latency = latency_ms / 1000
+
+    calls = {
+        "get_user_accounts": lambda: account_service.get_user_accounts(user),
+        "get_account_transactions": lambda: account_service.get_account_transactions(account),
+        "create_transaction": lambda: account_service.create_transaction("-1.25", "benchmark", account, category),
+        "create_csv_file": lambda: account_service.create_csv_file(account),
+        "plot_aggregation": lambda: account_service.get_average_by_category(account),
+    }
+    results = {}
+    for name, call in calls.items():
+        executed = sum(timing["count"] for timing in statistics.report())
+        round_trips = getattr(backend, "round_trips", 0)
+        results[name] = time_call(call, repeat)
+        results[name]["queries_per_call"] = \
+            round((sum(timing["count"] for timing in statistics.report()) - executed) / repeat, 2)
+        if backend_name == "fake":
+            results[name]["round_trips_per_call"] = round((backend.round_trips - round_trips) / repeat, 2)
+    return {"size": size, "generate_seconds": round(generate_seconds, 3), "calls": results}
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser(description="Time the hot service calls on generated data of several sizes.")
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES,
+                        help="users x accounts per user x transactions per account, e.g. 4x2x1000")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backend", default="sqlite", choices=["sqlite", "fake"],
+                        help="fake runs on the in-memory stand-in that counts round trips")
+    parser.add_argument("--latency-ms", type=float, default=0.0,
+                        help="latency the fake backend adds to every round trip")
+    parser.add_argument("--result-cache-mb", type=float, default=0,
+                        help="result cache size for the timed calls, 0 (off) times every call against the database")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--single", help=argparse.SUPPRESS)
+    args = parser.parse_args(arguments)
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    if args.single:
+        json.dump(run_size(parse_size(args.single), args.repeat, args.seed, args.backend, args.latency_ms,
+                           args.result_cache_mb), sys.stdout)
+        return 0
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = []
+    for size in args.sizes:
+        logger.warning(f"Benchmarking {size}...")
+        output = subprocess.run([sys.executable, "-m", "benchmarks.suite", "--single", size,
+                                 "--repeat", str(args.repeat), "--seed", str(args.seed),
+                                 "--backend", args.backend, "--latency-ms", str(args.latency_ms),
+                                 "--result-cache-mb", str(args.result_cache_mb)],
+                                cwd=root, env=dict(os.environ, PYTHONPATH=root), check=True,
+                                capture_output=True, text=True).stdout
+        results.append(json.loads(output))
+
+    report = {"version": REPORT_VERSION, "python": platform.python_version(), "platform": platform.platform(),
+              "backend": args.backend, "latency_ms": args.latency_ms, "seed": args.seed, "repeat": args.repeat,
+              "result_cache_mb": args.result_cache_mb,
+              "results": results}
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
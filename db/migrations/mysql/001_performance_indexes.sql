@@ -0,0 +1,13 @@
+-- -----------------------------------------------------
+-- Indexes required by the queries in logic/repositories.py
+-- -----------------------------------------------------
+CREATE INDEX `name_idx` ON `category` (`name` ASC);
+
+ALTER TABLE `account`
+ADD UNIQUE INDEX `user_name_UNIQUE` (`user_id` ASC, `name` ASC);
+
+CREATE INDEX `account_date_idx` ON `transaction` (`account_id` ASC, `date` ASC);
+
+CREATE INDEX `account_category_date_idx` ON `transaction` (`account_id` ASC, `category_id` ASC, `date` ASC);
+
+CREATE INDEX `account_amount_idx` ON `transaction` (`account_id` ASC, `amount` ASC);
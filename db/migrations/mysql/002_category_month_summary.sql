@@ -0,0 +1,23 @@
+-- -----------------------------------------------------
+-- Table `category_month_summary`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `category_month_summary` (
+  `account_id` BIGINT NOT NULL,
+  `category_id` BIGINT NOT NULL DEFAULT 0,
+  `year_month` CHAR(7) NOT NULL,
+  `transaction_count` BIGINT NOT NULL DEFAULT 0,
+  `amount_sum` FLOAT NOT NULL DEFAULT 0,
+  PRIMARY KEY (`account_id`, `category_id`, `year_month`),
+  CONSTRAINT `fk_category_month_summary_account1`
+    FOREIGN KEY (`account_id`)
+    REFERENCES `account` (`id`)
+    ON DELETE CASCADE
+    ON UPDATE CASCADE)
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = utf8mb3;
+
+INSERT IGNORE INTO `category_month_summary`
+  (`account_id`, `category_id`, `year_month`, `transaction_count`, `amount_sum`)
+SELECT `account_id`, COALESCE(`category_id`, 0), DATE_FORMAT(`date`, '%Y-%m'), COUNT(*), SUM(`amount`)
+FROM `transaction`
+GROUP BY `account_id`, COALESCE(`category_id`, 0), DATE_FORMAT(`date`, '%Y-%m');
@@ -0,0 +1,14 @@
+-- -----------------------------------------------------
+-- Store money as exact DECIMAL(19,4) instead of FLOAT
+-- -----------------------------------------------------
+ALTER TABLE `user`
+CHANGE COLUMN `balance` `balance` DECIMAL(19,4) NOT NULL DEFAULT 0;
+
+ALTER TABLE `account`
+CHANGE COLUMN `balance` `balance` DECIMAL(19,4) NOT NULL DEFAULT 0;
+
+ALTER TABLE `transaction`
+CHANGE COLUMN `amount` `amount` DECIMAL(19,4) NOT NULL;
+
+ALTER TABLE `category_month_summary`
+CHANGE COLUMN `amount_sum` `amount_sum` DECIMAL(19,4) NOT NULL DEFAULT 0;
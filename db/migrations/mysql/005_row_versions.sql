@@ -0,0 +1,10 @@
+-- -----------------------------------------------------
+-- Row versions for optimistic locking: every update of an
+-- account or a transaction increments its version and only
+-- applies when the version the writer read is still current
+-- -----------------------------------------------------
+ALTER TABLE `account`
+ADD COLUMN `version` INT NOT NULL DEFAULT 0;
+
+ALTER TABLE `transaction`
+ADD COLUMN `version` INT NOT NULL DEFAULT 0;
@@ -0,0 +1,36 @@
+-- -----------------------------------------------------
+-- Table `category_rule`: categories assigned to new and
+-- imported transactions by description, amount and account;
+-- the lowest priority (then id) of the matching rules wins
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `category_rule` (
+  `id` BIGINT NOT NULL AUTO_INCREMENT,
+  `user_id` BIGINT NOT NULL,
+  `category_id` BIGINT NOT NULL,
+  `account_id` BIGINT NULL DEFAULT NULL,
+  `pattern` VARCHAR(255) NOT NULL DEFAULT '',
+  `is_regex` TINYINT NOT NULL DEFAULT 0,
+  `min_amount` DECIMAL(19,4) NULL DEFAULT NULL,
+  `max_amount` DECIMAL(19,4) NULL DEFAULT NULL,
+  `priority` INT NOT NULL DEFAULT 0,
+  PRIMARY KEY (`id`),
+  INDEX `user_priority_idx` (`user_id` ASC, `priority` ASC),
+  INDEX `fk_category_rule_category1_idx` (`category_id` ASC),
+  INDEX `fk_category_rule_account1_idx` (`account_id` ASC),
+  CONSTRAINT `fk_category_rule_user1`
+    FOREIGN KEY (`user_id`)
+    REFERENCES `user` (`id`)
+    ON DELETE CASCADE
+    ON UPDATE CASCADE,
+  CONSTRAINT `fk_category_rule_category1`
+    FOREIGN KEY (`category_id`)
+    REFERENCES `category` (`id`)
+    ON DELETE CASCADE
+    ON UPDATE CASCADE,
+  CONSTRAINT `fk_category_rule_account1`
+    FOREIGN KEY (`account_id`)
+    REFERENCES `account` (`id`)
+    ON DELETE CASCADE
+    ON UPDATE CASCADE)
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = utf8mb3;
@@ -0,0 +1,74 @@
+-- -----------------------------------------------------
+-- Embedded SQLite schema, equivalent to db/bd.sql with the
+-- MySQL migrations up to 003 applied
+-- -----------------------------------------------------
+
+-- -----------------------------------------------------
+-- Table `user`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `user` (
+  `id` INTEGER PRIMARY KEY AUTOINCREMENT,
+  `login` VARCHAR(45) NOT NULL COLLATE NOCASE UNIQUE,
+  `password` VARCHAR(255) NOT NULL,
+  `balance` DECIMAL(19,4) NOT NULL DEFAULT 0);
+
+-- -----------------------------------------------------
+-- Table `account`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `account` (
+  `id` INTEGER PRIMARY KEY AUTOINCREMENT,
+  `name` VARCHAR(45) NOT NULL COLLATE NOCASE,
+  `description` VARCHAR(45) NULL DEFAULT NULL,
+  `user_id` BIGINT NOT NULL REFERENCES `user` (`id`) ON DELETE CASCADE ON UPDATE CASCADE,
+  `balance` DECIMAL(19,4) NOT NULL DEFAULT 0);
+
+CREATE UNIQUE INDEX `user_name_UNIQUE` ON `account` (`user_id`, `name`);
+
+-- -----------------------------------------------------
+-- Table `category`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `category` (
+  `id` INTEGER PRIMARY KEY AUTOINCREMENT,
+  `name` VARCHAR(45) NOT NULL COLLATE NOCASE);
+
+CREATE INDEX `name_idx` ON `category` (`name`);
+
+-- -----------------------------------------------------
+-- Table `transaction`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `transaction` (
+  `id` INTEGER PRIMARY KEY AUTOINCREMENT,
+  `amount` DECIMAL(19,4) NOT NULL,
+  `description` VARCHAR(45) NULL DEFAULT NULL,
+  `date` DATETIME NOT NULL DEFAULT (datetime('now', 'localtime')),
+  `account_id` BIGINT NOT NULL REFERENCES `account` (`id`) ON DELETE CASCADE ON UPDATE CASCADE,
+  `category_id` BIGINT NULL REFERENCES `category` (`id`) ON DELETE CASCADE ON UPDATE CASCADE);
+
+CREATE INDEX `fk_Spend_Category1_idx` ON `transaction` (`category_id`);
+
+CREATE INDEX `account_date_idx` ON `transaction` (`account_id`, `date`);
+
+CREATE INDEX `account_category_date_idx` ON `transaction` (`account_id`, `category_id`, `date`);
+
+CREATE INDEX `account_amount_idx` ON `transaction` (`account_id`, `amount`);
+
+-- -----------------------------------------------------
+-- Table `user_has_category`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `user_has_category` (
+  `user_id` BIGINT NOT NULL REFERENCES `user` (`id`) ON DELETE CASCADE ON UPDATE CASCADE,
+  `category_id` BIGINT NOT NULL REFERENCES `category` (`id`) ON DELETE CASCADE ON UPDATE CASCADE,
+  PRIMARY KEY (`user_id`, `category_id`));
+
+CREATE INDEX `fk_user_has_category_category1_idx` ON `user_has_category` (`category_id`);
+
+-- -----------------------------------------------------
+-- Table `category_month_summary`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `category_month_summary` (
+  `account_id` BIGINT NOT NULL REFERENCES `account` (`id`) ON DELETE CASCADE ON UPDATE CASCADE,
+  `category_id` BIGINT NOT NULL DEFAULT 0,
+  `year_month` CHAR(7) NOT NULL,
+  `transaction_count` BIGINT NOT NULL DEFAULT 0,
+  `amount_sum` DECIMAL(19,4) NOT NULL DEFAULT 0,
+  PRIMARY KEY (`account_id`, `category_id`, `year_month`));
@@ -0,0 +1,10 @@
+-- -----------------------------------------------------
+-- Keep the balance an account was opened with, so that
+-- balance = opening_balance + SUM(transaction.amount)
+-- -----------------------------------------------------
+ALTER TABLE `account`
+ADD COLUMN `opening_balance` DECIMAL(19,4) NOT NULL DEFAULT 0;
+
+UPDATE `account`
+SET `opening_balance` = `balance` - COALESCE(
+  (SELECT SUM(`amount`) FROM `transaction` WHERE `transaction`.`account_id` = `account`.`id`), 0);
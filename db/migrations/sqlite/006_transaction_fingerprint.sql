@@ -0,0 +1,9 @@
+-- -----------------------------------------------------
+-- Imported transactions carry a hash of account, day, amount
+-- and normalized description, so that overlapping statements
+-- are only imported once; rows entered by hand leave it NULL
+-- -----------------------------------------------------
+ALTER TABLE `transaction`
+ADD COLUMN `fingerprint` CHAR(32) NULL;
+
+CREATE UNIQUE INDEX `fingerprint_UNIQUE` ON `transaction` (`fingerprint`);
@@ -0,0 +1,21 @@
+-- -----------------------------------------------------
+-- Table `category_rule`: categories assigned to new and
+-- imported transactions by description, amount and account;
+-- the lowest priority (then id) of the matching rules wins
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `category_rule` (
+  `id` INTEGER PRIMARY KEY AUTOINCREMENT,
+  `user_id` BIGINT NOT NULL REFERENCES `user` (`id`) ON DELETE CASCADE ON UPDATE CASCADE,
+  `category_id` BIGINT NOT NULL REFERENCES `category` (`id`) ON DELETE CASCADE ON UPDATE CASCADE,
+  `account_id` BIGINT NULL DEFAULT NULL REFERENCES `account` (`id`) ON DELETE CASCADE ON UPDATE CASCADE,
+  `pattern` VARCHAR(255) NOT NULL DEFAULT '',
+  `is_regex` TINYINT NOT NULL DEFAULT 0,
+  `min_amount` DECIMAL(19,4) NULL DEFAULT NULL,
+  `max_amount` DECIMAL(19,4) NULL DEFAULT NULL,
+  `priority` INT NOT NULL DEFAULT 0);
+
+CREATE INDEX `user_priority_idx` ON `category_rule` (`user_id`, `priority`);
+
+CREATE INDEX `fk_category_rule_category1_idx` ON `category_rule` (`category_id`);
+
+CREATE INDEX `fk_category_rule_account1_idx` ON `category_rule` (`account_id`);
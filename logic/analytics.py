@@ -0,0 +1,90 @@
+from decimal import Decimal
+from typing import List, Tuple
+
+import numpy as np
+
+UNCATEGORIZED_NAME = "None"
+
+# Amounts are held as int64 counts of the smallest stored unit, matching DECIMAL(19,4).
+MONEY_SCALE = 4
+
+AMOUNT_DTYPE = np.int64
+DATE_DTYPE = "datetime64[s]"
+
+# Fewest points each method can reduce to: the first, the last and one bucket's worth in between.
+DOWNSAMPLING_MIN_POINTS = {"lttb": 3, "minmax": 4}
+
+
+def to_units(amount: Decimal | float | int) -> int:
+    if isinstance(amount, float):
+        amount = repr(amount)
+    return int(Decimal(amount).scaleb(MONEY_SCALE).to_integral_value())
+
+
+def to_float(units: np.ndarray) -> np.ndarray:
+    return units / 10 ** MONEY_SCALE
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    # Largest-triangle-three-buckets: keeps the first and last point and, from each of threshold - 2 equal
+    # buckets in between, the point forming the largest triangle with the point kept from the previous
+    # bucket and the average of the next one. One NumPy pass per bucket, so the cost grows with the
+    # number of points but the Python overhead only with threshold.
+    count = len(x)
+    if threshold >= count or threshold < 3:
+        return np.arange(count)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = (np.arange(threshold - 1) * ((count - 2) / (threshold - 2))).astype(np.int64) + 1
+    edges[-1] = count - 1
+    sizes = np.diff(edges)
+    averages_x = np.add.reduceat(x[:-1], edges[:-1]) / sizes
+    averages_y = np.add.reduceat(y[:-1], edges[:-1]) / sizes
+    # The bucket after the last one is the last point itself.
+    next_x = np.append(averages_x[1:], x[-1])
+    next_y = np.append(averages_y[1:], y[-1])
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, count - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        areas = np.abs((x[previous] - next_x[bucket]) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (next_y[bucket] - y[previous]))
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+    return selected
+
+
+def minmax_indices(y: np.ndarray, buckets: int) -> np.ndarray:
+    # The lowest and the highest point of each of buckets equal slices (one per pixel column of the chart),
+    # plus the first and last point, in their original order. Fully vectorized.
+    count = len(y)
+    if buckets * 2 + 2 >= count or buckets < 1:
+        return np.arange(count)
+    bucket = np.arange(count) * buckets // count
+    order = np.lexsort((y, bucket))
+    starts = np.searchsorted(bucket[order], np.arange(buckets))
+    ends = np.append(starts[1:], count) - 1
+    return np.unique(np.concatenate(([0, count - 1], order[starts], order[ends])))
+
+
+def downsample(x: np.ndarray, y: np.ndarray, max_points: int, method: str = "lttb") -> Tuple[np.ndarray, np.ndarray]:
+    # Bounds the points handed to a chart. x may hold datetime64 values.
+    if method not in DOWNSAMPLING_MIN_POINTS:
+        raise ValueError(f"Unknown downsampling method {method}")
+    if max_points < DOWNSAMPLING_MIN_POINTS[method]:
+        raise ValueError(f"{method} keeps at least {DOWNSAMPLING_MIN_POINTS[method]} points, not {max_points}")
+    if len(x) <= max_points:
+        return x, y
+    if method == "minmax":
+        selected = minmax_indices(y, (max_points - 2) // 2)
+    else:
+        selected = lttb_indices(x.astype(np.int64) if x.dtype.kind == "M" else x, y, max_points)
+    return x[selected], y[selected]
+
+
+def balance_history_from_rows(rows: List) -> Tuple[np.ndarray, np.ndarray]:
+    # rows: (date or datetime, balance), as returned by the running balance queries.
+    count = len(rows)
+    return (np.fromiter((row[0] for row in rows), dtype=DATE_DTYPE, count=count),
+            np.fromiter((to_units(row[1]) for row in rows), dtype=AMOUNT_DTYPE, count=count))
@@ -0,0 +1,108 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Generic, TypeVar, Any, List
+
+from loguru import logger
+
+from logic.datasource import DataSource
+from logic.entities import User, Account
+from logic.services import UserService, AccountService, CategoryService
+
+T = TypeVar('T')
+
+DEFAULT_MAX_WORKERS = 4
+
+
+class AsyncExecutor:
+    __instance = None
+
+    def __init__(self, max_workers: int = None):
+        # Workers beyond the connection pool size would only wait for a free connection.
+        max_workers = max_workers or int(os.environ.get("BUDGET_DB_WORKERS", DEFAULT_MAX_WORKERS))
+        max_workers = min(max_workers, DataSource.get_instance().pool.max_size)
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db-worker")
+        self.instances = {}
+        self.lock = threading.Lock()
+        logger.info(f"Async executor started with {max_workers} worker(s)")
+
+    @staticmethod
+    def get_instance():
+        if AsyncExecutor.__instance is None:
+            AsyncExecutor.__instance = AsyncExecutor()
+        return AsyncExecutor.__instance
+
+    def instance_of(self, cls):
+        with self.lock:
+            if cls not in self.instances:
+                self.instances[cls] = cls()
+            return self.instances[cls]
+
+    async def run(self, cls, method: str, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor,
+                                          lambda: getattr(self.instance_of(cls), method)(*args, **kwargs))
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=True)
+
+
+class AsyncRepository(Generic[T]):
+    def __init__(self, repository_class: type, executor: AsyncExecutor = None):
+        self.repository_class = repository_class
+        self.executor = executor or AsyncExecutor.get_instance()
+
+    async def create(self, item: T) -> T:
+        return await self.executor.run(self.repository_class, "create", item)
+
+    async def get_by_param(self, item: Any) -> T | List[T]:
+        return await self.executor.run(self.repository_class, "get_by_param", item)
+
+    async def update(self, item: T) -> T:
+        return await self.executor.run(self.repository_class, "update", item)
+
+    async def delete(self, item: T) -> None:
+        return await self.executor.run(self.repository_class, "delete", item)
+
+
+class AAsyncService:
+    service_class = None
+
+    def __init__(self, executor: AsyncExecutor = None):
+        self.executor = executor or AsyncExecutor.get_instance()
+
+    def __getattr__(self, method: str):
+        if method.startswith("_") or not callable(getattr(self.service_class, method, None)):
+            raise AttributeError(method)
+
+        async def call(*args, **kwargs):
+            return await self.executor.run(self.service_class, method, *args, **kwargs)
+
+        return call
+
+
+class AsyncUserService(AAsyncService):
+    service_class = UserService
+
+
+class AsyncAccountService(AAsyncService):
+    service_class = AccountService
+
+
+class AsyncCategoryService(AAsyncService):
+    service_class = CategoryService
+
+
+async def load_main_page(user: User, account: Account = None):
+    user_service = AsyncUserService()
+    account_service = AsyncAccountService()
+    if account is None:
+        accounts, categories = await asyncio.gather(account_service.get_user_accounts(user),
+                                                    user_service.get_user_categories(user))
+        return accounts, categories, []
+    return await asyncio.gather(account_service.get_user_accounts(user),
+                                user_service.get_user_categories(user),
+                                account_service.get_account_transactions(account))
+
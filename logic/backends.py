@@ -0,0 +1,198 @@
+import datetime
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+from decimal import Decimal
+from typing import List
+
+from logic.fakedb import FakeDatabase, FakeConnection
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MIGRATIONS_PATH = os.path.join(ROOT_PATH, "db", "migrations")
+
+
+class ABackend(ABC):
+    dialect = None
+    auto_migrate = False
+    max_connections = None
+    # Whether other processes may write to the same database behind our back.
+    shared = False
+    # Whether schema changes roll back with the transaction they ran in.
+    transactional_ddl = True
+
+    @abstractmethod
+    def connect(self):
+        pass
+
+    @property
+    def migrations_path(self) -> str:
+        return os.path.join(MIGRATIONS_PATH, self.dialect)
+
+    @abstractmethod
+    def in_transaction(self, connection) -> bool:
+        pass
+
+    @abstractmethod
+    def begin(self, connection) -> None:
+        pass
+
+    @abstractmethod
+    def commit(self, connection) -> None:
+        pass
+
+    @abstractmethod
+    def rollback(self, connection) -> None:
+        pass
+
+    @staticmethod
+    def already_applied(error: Exception) -> bool:
+        return False
+
+    @abstractmethod
+    def explain(self, cursor, query: str, params: tuple) -> List[str]:
+        pass
+
+
+class MySqlBackend(ABackend):
+    dialect = "mysql"
+    shared = True
+    # Every CREATE/ALTER commits on its own.
+    transactional_ddl = False
+
+    def __init__(self, server: str = None, user: str = None, password: str = None, database: str = None,
+                 driver: str = None):
+        self.server = server or os.environ.get("SERVER_PATH")
+        self.user = user or os.environ.get("DB_USER", "root")
+        self.password = password or os.environ.get("DB_PASSWORD", "root")
+        self.database = database or os.environ.get("DB_NAME", "mydb")
+        self.driver = driver or os.environ.get("DB_DRIVER", "{MySQL ODBC 8.0 ANSI Driver}")
+
+    def connect(self):
+        import pyodbc
+
+        return pyodbc.connect(
+            driver=self.driver,
+            server=self.server,
+            user=self.user,
+            password=self.password,
+            database=self.database,
+            autocommit=True
+        )
+
+    def in_transaction(self, connection) -> bool:
+        return not connection.autocommit
+
+    def begin(self, connection) -> None:
+        connection.autocommit = False
+
+    def commit(self, connection) -> None:
+        connection.commit()
+        connection.autocommit = True
+
+    def rollback(self, connection) -> None:
+        connection.rollback()
+        connection.autocommit = True
+
+    @staticmethod
+    def already_applied(error: Exception) -> bool:
+        # The object a DDL statement creates is there already: 1050 table, 1060 column, 1061 index,
+        # 1826 foreign key.
+        return any(f"({code})" in str(error) for code in (1050, 1060, 1061, 1826))
+
+    def explain(self, cursor, query: str, params: tuple) -> List[str]:
+        # Tables read with a full scan that no index could have served.
+        cursor.execute(f"EXPLAIN {query}", params)
+        columns = [column[0].lower() for column in cursor.description]
+        steps = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        return [step["table"] for step in steps
+                if step.get("table") and step.get("type") == "ALL" and not step.get("possible_keys")]
+
+
+class SqliteBackend(ABackend):
+    dialect = "sqlite"
+    auto_migrate = True
+
+    def __init__(self, path: str = None):
+        self.path = path or os.environ.get("SQLITE_PATH", os.path.join(ROOT_PATH, "db", "budget.sqlite3"))
+        # The CLI jobs, the daemon and the desktop clients may all write to one database file.
+        self.shared = self.path != ":memory:"
+        if self.path == ":memory:":
+            # Every connection to :memory: is a separate database.
+            self.max_connections = 1
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False,
+                                     detect_types=sqlite3.PARSE_DECLTYPES, timeout=30)
+        connection.execute("PRAGMA foreign_keys = ON")
+        if self.path != ":memory:":
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+        return connection
+
+    def in_transaction(self, connection) -> bool:
+        return connection.in_transaction
+
+    def begin(self, connection) -> None:
+        # Take the write lock up front so concurrent writers queue instead of failing to upgrade.
+        connection.execute("BEGIN IMMEDIATE")
+
+    def commit(self, connection) -> None:
+        connection.execute("COMMIT")
+
+    def rollback(self, connection) -> None:
+        connection.execute("ROLLBACK")
+
+    def explain(self, cursor, query: str, params: tuple) -> List[str]:
+        cursor.execute(f"EXPLAIN QUERY PLAN {query}", params)
+        # (subquery-N) is an intermediate result, e.g. the rows a window function runs over.
+        return [row[3].split()[1] for row in cursor.fetchall()
+                if row[3].startswith("SCAN ") and " USING " not in row[3] and not row[3].startswith("SCAN (")]
+
+
+class FakeBackend(SqliteBackend):
+    # In-memory stand-in for the MySQL server that counts round trips and can add latency to each,
+    # for load tests without a database. Speaks the SQLite dialect.
+    def __init__(self, latency: float = None):
+        super().__init__(":memory:")
+        self.max_connections = None
+        if latency is None:
+            latency = float(os.environ.get("BUDGET_FAKE_LATENCY_MS", 0)) / 1000
+        self.database = FakeDatabase(super().connect(), latency)
+
+    def connect(self):
+        return FakeConnection(self.database)
+
+    @property
+    def round_trips(self) -> int:
+        return self.database.round_trips
+
+    def in_transaction(self, connection) -> bool:
+        return connection.in_transaction
+
+    def begin(self, connection) -> None:
+        connection.begin()
+
+    def commit(self, connection) -> None:
+        connection.commit()
+
+    def rollback(self, connection) -> None:
+        connection.rollback()
+
+
+sqlite3.register_adapter(Decimal, str)
+sqlite3.register_adapter(datetime.datetime, lambda value: value.isoformat(" ", "seconds"))
+sqlite3.register_converter("DATETIME", lambda value: datetime.datetime.fromisoformat(value.decode()))
+
+BACKENDS = {
+    MySqlBackend.dialect: MySqlBackend,
+    SqliteBackend.dialect: SqliteBackend,
+    "fake": FakeBackend,
+}
+
+
+def create_backend(dialect: str = None) -> ABackend:
+    dialect = dialect or os.environ.get("BUDGET_BACKEND", MySqlBackend.dialect)
+    if dialect not in BACKENDS:
+        raise ValueError(f"Unknown storage backend {dialect}")
+    return BACKENDS[dialect]()
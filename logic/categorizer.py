@@ -0,0 +1,189 @@
+import re
+import threading
+import time
+from decimal import Decimal
+from typing import Callable, Dict, List, Tuple
+
+from loguru import logger
+
+from logic.entities import Category, CategoryRule
+
+# Rules that can't join the combined pattern run on their own: backreferences count groups, which shift there,
+# and a group name may only appear once in it.
+SEPARATE_PATTERN = re.compile(r"\\[1-9]|\(\?P[=<]")
+
+# Compiled matchers kept, one per user.
+MAX_CACHED_MATCHERS = 64
+
+# Rule writes of this process drop the user's matcher at once, the ones of other processes (the CLI, the
+# daemon) show up within this time.
+MATCHER_TTL_SECONDS = 60
+
+
+def validate_pattern(pattern: str, is_regex: bool) -> str | None:
+    # Error message for a pattern that can't be compiled into the combined matcher, None when it's fine.
+    if not is_regex:
+        return None
+    try:
+        # On its own, and wrapped the way the combined pattern wraps it ("a)|(b" only fails the first way).
+        for wrapped in (pattern, f"(?=(?:{pattern}))"):
+            re.compile(wrapped, re.IGNORECASE)
+    except re.error as error:
+        return f"Wrong regular expression: {error}"
+    return None
+
+
+def trie_pattern(literals: List[str]) -> str:
+    # One regex for many literals, shaped like their prefix tree: "car(?:d|ds|wash)?" rather than
+    # "car|card|cards|carwash", so each position costs at most the longest literal, whatever their number.
+    root = {}
+    for literal in literals:
+        node = root
+        for character in literal:
+            node = node.setdefault(character, {})
+        node[""] = None
+
+    def build(node: dict) -> str:
+        branches = [re.escape(character) + build(child) for character, child in sorted(node.items()) if character]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        return f"(?:{body})?" if "" in node else body
+
+    return build(root)
+
+
+class RuleMatcher:
+    # A user's rules compiled once. Literals (matched case-insensitively) go into one prefix-tree regex and the
+    # regex patterns into one pattern with a named group per rule, each tried at every position with a
+    # lookahead, so a description is scanned once per kind however many rules there are. Of the rules whose
+    # pattern, amount range and account fit, the first in (priority, id) order wins.
+    def __init__(self, rules: List[CategoryRule]):
+        self.rules = sorted(rules, key=lambda rule: (rule.priority, rule.id or 0))
+        self.unconditional: List[int] = []
+        self.literal_rules: Dict[str, List[int]] = {}
+        self.regex_rules: List[int] = []
+        self.separate_rules: List[int] = []
+        self.patterns: Dict[int, re.Pattern] = {}
+        for index, rule in enumerate(self.rules):
+            if not rule.pattern:
+                self.unconditional.append(index)
+            elif not rule.is_regex:
+                self.literal_rules.setdefault(rule.pattern.lower(), []).append(index)
+            else:
+                self.patterns[index] = re.compile(rule.pattern, re.IGNORECASE)
+                if SEPARATE_PATTERN.search(rule.pattern):
+                    self.separate_rules.append(index)
+                else:
+                    self.regex_rules.append(index)
+
+        # The lookahead reports the longest literal starting at each position; the shorter ones it contains
+        # as prefixes match there as well.
+        self.literal_prefixes = {literal: [literal[:length] for length in range(1, len(literal) + 1)
+                                           if literal[:length] in self.literal_rules]
+                                 for literal in self.literal_rules}
+        self.literal_pattern = re.compile(f"(?=({trie_pattern(list(self.literal_rules))}))") \
+            if self.literal_rules else None
+        # The scan has no groups: they make the engine save state at every attempt and keep it from factoring
+        # the alternatives. Only at the positions it finds, the same alternation with a named group per rule, in
+        # (priority, id) order, names the best rule matching there in one go.
+        self.regex_pattern = None
+        self.rule_pattern = None
+        if self.regex_rules:
+            try:
+                self.regex_pattern = re.compile(
+                    "(?=" + "|".join(f"(?:{self.rules[index].pattern})" for index in self.regex_rules) + ")",
+                    re.IGNORECASE)
+                self.rule_pattern = re.compile(
+                    "|".join(f"(?P<r{index}>{self.rules[index].pattern})" for index in self.regex_rules),
+                    re.IGNORECASE)
+            except re.error as error:
+                logger.warning(f"Regular expression rules searched one by one, they don't combine: {error}")
+                self.separate_rules = sorted(self.regex_rules + self.separate_rules)
+                self.regex_rules = []
+        self.rule_index = {f"r{index}": index for index in self.regex_rules}
+
+    def fits(self, index: int, amount: Decimal, account_id: int = None) -> bool:
+        rule = self.rules[index]
+        return (rule.min_amount is None or amount >= rule.min_amount) and \
+            (rule.max_amount is None or amount <= rule.max_amount) and \
+            (rule.account is None or rule.account.id == account_id)
+
+    def match(self, description: str, amount: Decimal, account_id: int = None) -> Category | None:
+        rule = self.match_rule(description, amount, account_id)
+        return rule.category if rule else None
+
+    def match_rule(self, description: str, amount: Decimal, account_id: int = None) -> CategoryRule | None:
+        description = description or ""
+        candidates = list(self.unconditional)
+        if self.literal_pattern is not None:
+            for literal in self.literal_pattern.findall(description.lower()):
+                for prefix in self.literal_prefixes[literal]:
+                    candidates.extend(self.literal_rules[prefix])
+        best = min((index for index in candidates if self.fits(index, amount, account_id)), default=None)
+        if self.regex_pattern is not None and (best is None or self.regex_rules[0] < best):
+            for position in self.regex_pattern.finditer(description):
+                position = position.start()
+                index = self.rule_index[self.rule_pattern.match(description, position).lastgroup]
+                if best is not None and index > best:
+                    continue
+                if self.fits(index, amount, account_id):
+                    best = index
+                    continue
+                # The best rule here doesn't fit the amount or the account; the rules after it may still match.
+                for later in self.regex_rules:
+                    if best is not None and later > best:
+                        break
+                    if later > index and self.fits(later, amount, account_id) and \
+                            self.patterns[later].match(description, position):
+                        best = later
+                        break
+        # Rules with backreferences or named groups aren't in the scan and are searched on their own.
+        for index in self.separate_rules:
+            if best is not None and index > best:
+                break
+            if self.fits(index, amount, account_id) and self.patterns[index].search(description):
+                best = index
+                break
+        return self.rules[best] if best is not None else None
+
+
+# user id -> (time it was built, matcher)
+matchers: Dict[int, Tuple[float, RuleMatcher]] = {}
+matchers_lock = threading.Lock()
+# Bumped by forget_matchers, so a matcher built from rules read before a write isn't kept.
+matchers_generation = 0
+
+
+def get_matcher(user_id: int, load_rules: Callable[[], List[CategoryRule]]) -> RuleMatcher:
+    # The user's rules are read and compiled again only after forget_matchers or MATCHER_TTL_SECONDS.
+    now = time.monotonic()
+    with matchers_lock:
+        cached = matchers.get(user_id)
+        if cached is not None and now - cached[0] < MATCHER_TTL_SECONDS:
+            return cached[1]
+        generation = matchers_generation
+    rules = load_rules()
+    try:
+        matcher = RuleMatcher(rules)
+    except re.error as error:
+        # A stored expression that doesn't compile (validate_pattern keeps them out) disables the expressions only.
+        logger.warning(f"Regular expression rules of user {user_id} skipped: {error}")
+        matcher = RuleMatcher([rule for rule in rules if not rule.is_regex])
+    with matchers_lock:
+        if generation == matchers_generation:
+            if len(matchers) >= MAX_CACHED_MATCHERS and user_id not in matchers:
+                matchers.pop(next(iter(matchers)))
+            matchers[user_id] = (now, matcher)
+    return matcher
+
+
+def forget_matchers(user_id: int = None) -> None:
+    # After a write to the rules of one user, or of anyone's (a deleted category takes its rules along).
+    global matchers_generation
+    with matchers_lock:
+        matchers_generation += 1
+        if user_id is None:
+            matchers.clear()
+        else:
+            matchers.pop(user_id, None)
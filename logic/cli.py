@@ -0,0 +1,302 @@
+import argparse
+import json
+import sys
+from collections import defaultdict
+from decimal import Decimal
+
+from loguru import logger
+
+from logic.backends import BACKENDS, create_backend
+from logic.datasource import DataSource
+from logic.importer import IMPORT_FORMATS
+
+EXPORT_FORMATS = ("csv", "parquet")
+
+
+def find_account(login: str, account_name: str):
+    from logic.services import UserService, AccountService
+
+    user = UserService().get_user_by_login(login)
+    if user is None:
+        raise SystemExit(f"User {login} doesn't exist")
+    accounts = AccountService().get_user_accounts(user)
+    if account_name is None:
+        return accounts
+    for account in accounts:
+        if account.name.lower() == account_name.lower():
+            return [account]
+    raise SystemExit(f"Account {account_name} doesn't exist")
+
+
+def export(args) -> int:
+    from logic.services import AccountService
+
+    [account] = find_account(args.login, args.account)
+    file_path = args.output or f"{account.name}_transactions.{args.format}"
+    service = AccountService()
+    if args.format == "parquet":
+        success, message = service.write_transactions_parquet(account, file_path)
+    else:
+        success, message = service.write_transactions_csv(account, file_path)
+    print(message, file=sys.stdout if success else sys.stderr)
+    return 0 if success else 1
+
+
+def report(args) -> int:
+    from logic.services import AccountService
+
+    service = AccountService()
+    result = []
+    # Served from the monthly rollup, no transaction rows are read.
+    for account in find_account(args.login, args.account):
+        by_category = defaultdict(lambda: [0, Decimal(0)])
+        by_month = defaultdict(lambda: [0, Decimal(0)])
+        for summary in service.get_category_month_summary(account):
+            if args.date_from and summary.year_month < args.date_from or \
+                    args.date_to and summary.year_month > args.date_to:
+                continue
+            for totals in (by_category[summary.category.name if summary.category else "None"],
+                           by_month[summary.year_month]):
+                totals[0] += summary.transaction_count
+                totals[1] += summary.amount_sum
+        result.append({
+            "account": account.name, "balance": str(account.balance),
+            "categories": [{"category": name, "count": count, "total": str(total),
+                            "average": str((total / count).quantize(Decimal("0.01")))}
+                           for name, (count, total) in sorted(by_category.items(), key=lambda item: item[1][1])],
+            "months": [{"month": month, "count": count, "total": str(total)}
+                       for month, (count, total) in sorted(by_month.items())],
+        })
+    if args.json:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+        return 0
+    for account in result:
+        print(f"{account['account']}: balance {account['balance']}")
+        for line in account["categories"]:
+            print(f"  {line['category']:<20}{line['count']:>8}{line['total']:>16}{line['average']:>14}")
+        for line in account["months"]:
+            print(f"  {line['month']:<20}{line['count']:>8}{line['total']:>16}")
+    return 0
+
+
+def recompute_balances(args) -> int:
+    from logic.services import AccountService
+
+    service = AccountService()
+    print(f"{service.recompute_balances()} account balance(s) recomputed")
+    if args.summary:
+        service.rebuild_category_month_summary()
+        print("Category month summary rebuilt")
+    return 0
+
+
+def reconcile(args) -> int:
+    from logic.services import AccountService
+
+    report = AccountService().reconcile_balances(fix=args.fix, workers=args.workers, chunk_size=args.chunk_size)
+    if args.json:
+        json.dump(report, sys.stdout, indent=2, default=str)
+        print()
+    else:
+        for drift in report["drifted"]:
+            print(f"account {drift['account_id']}: balance {drift['balance']}, ledger {drift['expected']}, "
+                  f"drift {drift['drift']}{' (fixed)' if drift['fixed'] else ''}")
+        print(f"{report['accounts']} account(s), {report['transactions']} transaction(s) checked, "
+              f"{len(report['drifted'])} drifted, {report['fixed']} fixed")
+    # Non-zero while some drift is left, for scheduled runs.
+    return 1 if len(report["drifted"]) > report["fixed"] else 0
+
+
+def import_statement(args) -> int:
+    from logic.services import AccountService
+
+    [account] = find_account(args.login, args.account)
+    mapping = {field: value for field, value in (
+        ("date", args.date_column), ("amount", args.amount_column), ("debit", args.debit_column),
+        ("credit", args.credit_column), ("description", args.description_column),
+        ("category", args.category_column), ("date_format", args.date_format), ("delimiter", args.delimiter),
+        ("encoding", args.encoding)) if value is not None}
+    if args.decimal_comma:
+        mapping["decimal_comma"] = True
+    if args.debit_column or args.credit_column:
+        mapping.setdefault("amount", None)
+    success, result = AccountService().import_statement(account, args.file, args.format, mapping)
+    if not success:
+        print(result, file=sys.stderr)
+        return 1
+    if args.json:
+        json.dump(result, sys.stdout, indent=2, default=str)
+        print()
+    else:
+        for reject in result["rejects"]:
+            print(f"line {reject['line']}: {reject['reason']}")
+        for name, count in result["unknown_categories"].items():
+            print(f"unknown category {name}: {count} transaction(s) left uncategorized")
+        print(f"{result['imported']} of {result['parsed']} transaction(s) imported in {result['seconds']} s, "
+              f"{result['categorized_by_rules']} categorized by rules, "
+              f"{result['duplicates']} already present, {result['rejected']} rejected, balance {account.balance}")
+    return 0
+
+
+def find_category(user, name: str):
+    from logic.services import UserService
+
+    for category in UserService().get_user_categories(user):
+        if category.name.lower() == name.lower():
+            return category
+    raise SystemExit(f"Category {name} doesn't exist")
+
+
+def rules(args) -> int:
+    from logic.services import UserService, CategoryService
+
+    user = UserService().get_user_by_login(args.login)
+    if user is None:
+        raise SystemExit(f"User {args.login} doesn't exist")
+    result = [{"id": rule.id, "priority": rule.priority, "category": rule.category.name, "pattern": rule.pattern,
+               "regex": rule.is_regex, "min_amount": rule.min_amount, "max_amount": rule.max_amount,
+               "account": rule.account.name if rule.account else None} for rule in CategoryService().get_rules(user)]
+    if args.json:
+        json.dump(result, sys.stdout, indent=2, default=str)
+        print()
+        return 0
+    for rule in result:
+        amounts = f" {rule['min_amount'] or ''}..{rule['max_amount'] or ''}" \
+            if rule["min_amount"] is not None or rule["max_amount"] is not None else ""
+        print(f"{rule['id']:>6} {rule['priority']:>4} {rule['category']:<20}"
+              f"{'/' + rule['pattern'] + '/' if rule['regex'] else repr(rule['pattern'])}{amounts}"
+              f"{' in ' + rule['account'] if rule['account'] else ''}")
+    return 0
+
+
+def add_rule(args) -> int:
+    from logic.services import UserService, CategoryService
+
+    user = UserService().get_user_by_login(args.login)
+    if user is None:
+        raise SystemExit(f"User {args.login} doesn't exist")
+    [account] = find_account(args.login, args.account) if args.account else [None]
+    success, result = CategoryService().add_rule(user, find_category(user, args.category), args.pattern or "",
+                                                 args.regex, args.min_amount, args.max_amount, account, args.priority)
+    print(f"Rule {result.id} added" if success else result, file=sys.stdout if success else sys.stderr)
+    return 0 if success else 1
+
+
+def delete_rule(args) -> int:
+    from logic.services import UserService, CategoryService
+
+    user = UserService().get_user_by_login(args.login)
+    if user is None:
+        raise SystemExit(f"User {args.login} doesn't exist")
+    service = CategoryService()
+    for rule in service.get_rules(user):
+        if rule.id == args.id:
+            print(service.delete_rule(rule)[1])
+            return 0
+    print(f"Rule {args.id} doesn't exist", file=sys.stderr)
+    return 1
+
+
+def generate_fixtures(args) -> int:
+    from logic.fixtures import generate
+
+    users = generate(args.users, args.accounts, args.transactions, seed=args.seed, prefix=args.prefix)
+    print(f"{len(users)} user(s) with {args.accounts} account(s) of {args.transactions} transaction(s) generated, "
+          f"password 'password'; {args.users - len(users)} existing login(s) skipped")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m logic.cli",
+                                     description="Batch reports and exports without the user interface.")
+    parser.add_argument("--backend", choices=list(BACKENDS), help="storage backend, BUDGET_BACKEND by default")
+    parser.add_argument("--verbose", action="store_true", help="log progress to stderr")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("export", help="write the transactions of an account to a file")
+    command.add_argument("login")
+    command.add_argument("account")
+    command.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    command.add_argument("--output", help="file to write, <account>_transactions.<format> by default")
+    command.set_defaults(handler=export)
+
+    command = commands.add_parser("report", help="totals by category and by month")
+    command.add_argument("login")
+    command.add_argument("account", nargs="?", help="every account of the user by default")
+    command.add_argument("--from", dest="date_from", metavar="YYYY-MM", help="first month to include")
+    command.add_argument("--to", dest="date_to", metavar="YYYY-MM", help="last month to include")
+    command.add_argument("--json", action="store_true")
+    command.set_defaults(handler=report)
+
+    command = commands.add_parser("recompute-balances",
+                                  help="set every account balance to its opening balance plus its transactions")
+    command.add_argument("--summary", action="store_true", help="rebuild the monthly category summary as well")
+    command.set_defaults(handler=recompute_balances)
+
+    command = commands.add_parser("reconcile",
+                                  help="compare every balance with its opening balance plus its transactions")
+    command.add_argument("--fix", action="store_true", help="recompute the balances that drifted")
+    command.add_argument("--workers", type=int, default=4, help="account ranges checked in parallel")
+    command.add_argument("--chunk-size", type=int, default=1000, help="accounts per grouped query")
+    command.add_argument("--json", action="store_true")
+    command.set_defaults(handler=reconcile)
+
+    command = commands.add_parser("import", help="add the transactions of a CSV, OFX or QIF statement to an account")
+    command.add_argument("login")
+    command.add_argument("account")
+    command.add_argument("file")
+    command.add_argument("--format", choices=IMPORT_FORMATS, help="from the file extension by default")
+    group = command.add_argument_group("CSV columns", "header names, case-insensitive; our export by default")
+    for field in ("date", "amount", "debit", "credit", "description", "category"):
+        group.add_argument(f"--{field}-column", dest=f"{field}_column", metavar="NAME")
+    group.add_argument("--date-format", help="strptime format, ISO 8601 by default (QIF: %%m/%%d/%%Y)")
+    group.add_argument("--delimiter")
+    group.add_argument("--decimal-comma", action="store_true", help="amounts are written 1.234,56")
+    command.add_argument("--encoding")
+    command.add_argument("--json", action="store_true")
+    command.set_defaults(handler=import_statement)
+
+    command = commands.add_parser("rules", help="list the categorization rules of a user in the order they apply")
+    command.add_argument("login")
+    command.add_argument("--json", action="store_true")
+    command.set_defaults(handler=rules)
+
+    command = commands.add_parser("add-rule", help="categorize new and imported transactions that match")
+    command.add_argument("login")
+    command.add_argument("category")
+    command.add_argument("--pattern", help="text the description contains, case-insensitive")
+    command.add_argument("--regex", action="store_true", help="the pattern is a regular expression")
+    command.add_argument("--min-amount", help="smallest amount, expenses are negative")
+    command.add_argument("--max-amount", help="largest amount")
+    command.add_argument("--account", help="only for transactions of this account")
+    command.add_argument("--priority", type=int, default=0, help="lower applies first, then older rules")
+    command.set_defaults(handler=add_rule)
+
+    command = commands.add_parser("delete-rule", help="remove a categorization rule")
+    command.add_argument("login")
+    command.add_argument("id", type=int)
+    command.set_defaults(handler=delete_rule)
+
+    command = commands.add_parser("generate-fixtures", help="create users, accounts and transactions for testing")
+    command.add_argument("--users", type=int, default=1)
+    command.add_argument("--accounts", type=int, default=2)
+    command.add_argument("--transactions", type=int, default=1000)
+    command.add_argument("--seed", type=int, default=0)
+    command.add_argument("--prefix", default="fixture",
+                         help="logins are <prefix>_<n>; logins that already exist are skipped")
+    command.set_defaults(handler=generate_fixtures)
+    return parser
+
+
+def main(arguments=None) -> int:
+    args = build_parser().parse_args(arguments)
+    logger.remove()
+    logger.add(sys.stderr, level="INFO" if args.verbose else "WARNING")
+    if args.backend:
+        DataSource.configure(create_backend(args.backend))
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,308 @@
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import socket
+import sys
+import threading
+
+from loguru import logger
+
+from logic.entities import User, Category, UserCategory, Account, Transaction, CategoryMonthSummary, \
+    TransactionFilter, CategoryRule
+from logic.protocol import LOCAL_METHODS, daemon_address, is_loopback, encode, decode, dumps
+from logic.repositories import AccountRepository, TransactionRepository, UserHasCategoryRepository, \
+    CategoryRuleRepository
+from logic.resultcache import DEFAULT_CACHE_MB, ResultCache
+from logic.services import UserService, AccountService, CategoryService, DiagnosticsService
+
+SERVICES = {
+    "user": UserService,
+    "account": AccountService,
+    "category": CategoryService,
+    "diagnostics": DiagnosticsService,
+}
+
+
+# The only requests served before a login.
+PUBLIC_METHODS = {("user", "register"), ("user", "login")}
+
+# Jobs over every user's data or over files on the daemon's host: they run from the CLI, not through the daemon.
+MAINTENANCE_METHODS = {"recompute_balances", "reconcile_balances", "reconcile_range",
+                       "rebuild_category_month_summary", "import_statement"}
+
+
+class DaemonError(Exception):
+    pass
+
+
+class Session:
+    # One client connection and the user it logged in as. Every entity a request names is checked against the
+    # database, not against the user the client put in it.
+    def __init__(self):
+        self.user = None
+
+    def owns_account(self, account_id: int) -> bool:
+        return AccountRepository().get_owner_id(account_id) == self.user.id
+
+    def allowed(self, value) -> bool:
+        if isinstance(value, (list, tuple)):
+            return all(self.allowed(item) for item in value)
+        if isinstance(value, dict):
+            return all(self.allowed(item) for item in value.values())
+        if isinstance(value, User):
+            return value.id == self.user.id
+        if isinstance(value, Account):
+            if value.id is None:
+                return value.user is not None and value.user.id == self.user.id
+            return self.owns_account(value.id)
+        if isinstance(value, Transaction):
+            if value.id is not None:
+                account_id = TransactionRepository().get_account_id(value.id)
+                if account_id is None or not self.owns_account(account_id):
+                    return False
+            return self.allowed([value.account, value.category])
+        if isinstance(value, Category):
+            return value.id is None or UserService().is_user_has_category(self.user, value)
+        if isinstance(value, CategoryRule):
+            if value.id is not None and value.id not in {rule.id for rule in
+                                                         CategoryRuleRepository().get_by_param(self.user)}:
+                return False
+            return self.allowed([value.user, value.account, value.category])
+        if isinstance(value, UserCategory):
+            return self.allowed([value.user, value.category])
+        if isinstance(value, (CategoryMonthSummary, TransactionFilter)):
+            return self.allowed(value.account)
+        return True
+
+    def authorize(self, args: list, kwargs: dict) -> list:
+        # The client's users carry no password hash, the services get the logged in one.
+        if not (self.allowed(args) and self.allowed(kwargs)):
+            raise DaemonError("The request names data of another user")
+        for name, value in kwargs.items():
+            if isinstance(value, User):
+                kwargs[name] = self.user
+        return [self.user if isinstance(arg, User) else arg for arg in args]
+
+
+class ServiceDaemon:
+    # Serves the services to local clients as newline-delimited JSON: requests are
+    # {"id", "service", "method", "args", "kwargs"}, answers {"id", "result"} or {"id", "error"}.
+    # Every client shares the executor, its service instances and the connection pool. A connection logs in
+    # with user.login first and can then only reach its user's data.
+    def __init__(self, address: str = None, executor=None):
+        from logic.asyncservices import AsyncExecutor
+
+        self.host, self.port = daemon_address(address)
+        if not is_loopback(self.host):
+            raise DaemonError(f"The daemon only listens on a loopback address, not {self.host}")
+        self.executor = executor or AsyncExecutor.get_instance()
+        self.clients = 0
+        self.requests = 0
+
+    async def call(self, request: dict, session: Session):
+        service, method = request["service"], request["method"]
+        if session.user is None and (service, method) not in PUBLIC_METHODS:
+            raise DaemonError("Log in first")
+        if service == "daemon" and method == "stats":
+            return self.stats()
+        cls = SERVICES.get(service)
+        if cls is None:
+            raise DaemonError(f"Unknown service {service}")
+        if method.startswith("_") or method in LOCAL_METHODS or method in MAINTENANCE_METHODS or \
+                not callable(getattr(cls, method, None)):
+            raise DaemonError(f"{service} has no remote method {method}")
+        args = decode(request.get("args", []))
+        kwargs = {name: decode(value) for name, value in request.get("kwargs", {}).items()}
+        if (service, method) in PUBLIC_METHODS:
+            result = await self.executor.run(cls, method, *args, **kwargs)
+            if method == "login" and isinstance(result[0], User):
+                session.user = result[0]
+            return result
+        loop = asyncio.get_running_loop()
+        args = await loop.run_in_executor(self.executor.executor, session.authorize, args, kwargs)
+        result = await self.executor.run(cls, method, *args, **kwargs)
+        # Lookups by id or login name their result only.
+        if isinstance(result, (User, Account)) and \
+                not await loop.run_in_executor(self.executor.executor, session.allowed, result):
+            raise DaemonError("The request names data of another user")
+        return result
+
+    async def respond(self, line: bytes, writer: asyncio.StreamWriter, lock: asyncio.Lock, session: Session) -> None:
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            message = {"id": request_id, "result": encode(await self.call(request, session))}
+        except Exception as error:
+            logger.warning(f"Request {request_id} failed: {error}")
+            message = {"id": request_id, "error": f"{type(error).__name__}: {error}"}
+        self.requests += 1
+        async with lock:
+            writer.write(dumps(message))
+            await writer.drain()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        # Requests of one client run concurrently; answers carry the request id.
+        self.clients += 1
+        lock = asyncio.Lock()
+        session = Session()
+        pending = set()
+        try:
+            while line := await reader.readline():
+                task = asyncio.ensure_future(self.respond(line, writer, lock, session))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.gather(*pending)
+        except ConnectionError:
+            pass
+        finally:
+            self.clients -= 1
+            writer.close()
+
+    def stats(self) -> dict:
+        from logic.datasource import DataSource
+
+        return {"clients": self.clients, "requests": self.requests, "workers": self.executor.max_workers,
+                "statements": DataSource.get_statement_stats(), "results": ResultCache.get_instance().stats()}
+
+    async def serve(self) -> None:
+        server = await asyncio.start_server(self.handle, self.host, self.port)
+        logger.info(f"Service daemon listening on {self.host}:{self.port}")
+        async with server:
+            await server.serve_forever()
+
+
+class DaemonClient:
+    # One connection per process, shared by its threads one request at a time. The credentials of the last
+    # successful user.login are kept to log in again when the connection has to be reopened.
+    __instance = None
+
+    def __init__(self, address: str = None, timeout: float = 30):
+        self.address = daemon_address(address)
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.file = None
+        self.last_id = 0
+        self.credentials = None
+
+    @staticmethod
+    def get_instance():
+        if DaemonClient.__instance is None:
+            DaemonClient.__instance = DaemonClient()
+        return DaemonClient.__instance
+
+    def call(self, service: str, method: str, *args, **kwargs):
+        with self.lock:
+            try:
+                if self.file is None:
+                    self.connect()
+                response = self.request(service, method, list(args), kwargs)
+            except (OSError, ConnectionError):
+                self.close()
+                raise
+            if "error" in response:
+                raise DaemonError(response["error"])
+            result = decode(response["result"])
+            if (service, method) == ("user", "login") and isinstance(result[0], User):
+                self.credentials = args
+            elif (service, method) == ("user", "update") and result[0] is True and self.credentials is not None:
+                changed = inspect.signature(UserService.update).bind(None, *args, **kwargs).arguments
+                self.credentials = (changed.get("login") or self.credentials[0],
+                                    changed.get("password") or self.credentials[1])
+        return result
+
+    def connect(self) -> None:
+        self.file = socket.create_connection(self.address, timeout=self.timeout).makefile("rwb")
+        if self.credentials is not None:
+            response = self.request("user", "login", list(self.credentials), {})
+            if "error" in response or not isinstance(decode(response["result"])[0], User):
+                self.credentials = None
+                raise ConnectionError("Logging in to the service daemon again failed")
+
+    def request(self, service: str, method: str, args: list, kwargs: dict) -> dict:
+        self.last_id += 1
+        self.file.write(dumps({"id": self.last_id, "service": service, "method": method, "args": encode(args),
+                               "kwargs": {name: encode(value) for name, value in kwargs.items()}}))
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError("The service daemon closed the connection")
+        return json.loads(line)
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class RemoteService:
+    # Stands in for a service class, forwarding its methods to the daemon.
+    service_name = None
+
+    def __init__(self, client: DaemonClient = None):
+        self.client = client or DaemonClient.get_instance()
+
+    def __getattr__(self, method: str):
+        service_class = SERVICES[self.service_name]
+        if method.startswith("_") or not callable(getattr(service_class, method, None)):
+            raise AttributeError(method)
+        if method in LOCAL_METHODS:
+            return getattr(service_class, method).__get__(self)
+
+        def call(*args, **kwargs):
+            return self.client.call(self.service_name, method, *args, **kwargs)
+
+        return call
+
+
+class RemoteUserService(RemoteService):
+    service_name = "user"
+
+
+class RemoteAccountService(RemoteService):
+    service_name = "account"
+
+
+class RemoteCategoryService(RemoteService):
+    service_name = "category"
+
+
+class RemoteDiagnosticsService(RemoteService):
+    service_name = "diagnostics"
+
+
+def main(arguments=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m logic.daemon",
+                                     description="Host the services for local clients over a JSON socket.")
+    parser.add_argument("--address", help="host:port, BUDGET_DAEMON_ADDRESS or 127.0.0.1:8765 by default")
+    parser.add_argument("--backend", help="storage backend, BUDGET_BACKEND by default")
+    parser.add_argument("--result-cache-mb", type=float,
+                        default=float(os.environ.get("BUDGET_RESULT_CACHE_MB", DEFAULT_CACHE_MB)),
+                        help="result cache size in MB, BUDGET_RESULT_CACHE_MB or %d by default; the daemon is "
+                             "the single writer it fronts, so pass 0 while CLI jobs write to the same "
+                             "database" % DEFAULT_CACHE_MB)
+    args = parser.parse_args(arguments)
+    # The result cache reads the size when it is first used, which is after this point.
+    os.environ["BUDGET_RESULT_CACHE_MB"] = str(args.result_cache_mb)
+    if args.backend:
+        from logic.backends import create_backend
+        from logic.datasource import DataSource
+
+        DataSource.configure(create_backend(args.backend))
+    try:
+        daemon = ServiceDaemon(args.address)
+    except DaemonError as error:
+        logger.error(str(error))
+        return 2
+    try:
+        asyncio.run(daemon.serve())
+    except KeyboardInterrupt:
+        logger.info("Service daemon stopped")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
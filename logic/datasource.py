@@ -1,25 +1,122 @@
 import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 
-import pyodbc
 from loguru import logger
 
+from logic.backends import ABackend, create_backend
+from logic.querystats import is_application_record
+
+DEFAULT_POOL_SIZE = 8
+
+DEFAULT_STATEMENT_CACHE_SIZE = 64
+
+
+class StatementCache:
+    # Keeps one cursor per SQL text, so the driver reuses the statement it prepared for it
+    # instead of parsing the text again. Used by a single thread at a time, like its connection.
+    def __init__(self, connection, max_size: int = DEFAULT_STATEMENT_CACHE_SIZE):
+        self.connection = connection
+        self.max_size = max_size
+        self.statements = OrderedDict()
+        self.prepared = 0
+        self.reused = 0
+
+    def execute(self, sql: str, params: tuple = ()):
+        entry = self.statements.get(sql)
+        if entry is None:
+            entry = (sql, self.connection.cursor())
+            self.statements[sql] = entry
+            self.prepared += 1
+            if len(self.statements) > self.max_size:
+                _, (_, evicted) = self.statements.popitem(last=False)
+                evicted.close()
+        else:
+            self.statements.move_to_end(sql)
+            self.reused += 1
+        # Passing the cached string object lets pyodbc skip SQLPrepare on a repeated statement.
+        sql, cursor = entry
+        cursor.execute(sql, params)
+        return cursor
+
+    def clear(self) -> None:
+        for _, cursor in self.statements.values():
+            cursor.close()
+        self.statements.clear()
+
+
+class ConnectionPool:
+    def __init__(self, backend: ABackend, connection, max_size: int, cache_statements: bool = False):
+        self.backend = backend
+        self.max_size = max_size
+        self.cache_statements = cache_statements
+        self.idle = [connection]
+        self.size = 1
+        self.condition = threading.Condition()
+        self.statement_caches = {connection: StatementCache(connection)} if cache_statements else {}
+
+    def take(self):
+        with self.condition:
+            while not self.idle and self.size >= self.max_size:
+                self.condition.wait()
+            if self.idle:
+                return self.idle.pop()
+            self.size += 1
+        try:
+            connection = self.backend.connect()
+        except Exception:
+            with self.condition:
+                self.size -= 1
+                self.condition.notify()
+            raise
+        if self.cache_statements:
+            with self.condition:
+                self.statement_caches[connection] = StatementCache(connection)
+        return connection
+
+    def give_back(self, connection) -> None:
+        with self.condition:
+            self.idle.append(connection)
+            self.condition.notify()
+
+    def statement_cache(self, connection) -> StatementCache:
+        with self.condition:
+            if connection not in self.statement_caches:
+                self.statement_caches[connection] = StatementCache(connection)
+            return self.statement_caches[connection]
+
+    def statement_stats(self) -> dict:
+        with self.condition:
+            caches = list(self.statement_caches.values())
+        prepared = sum(cache.prepared for cache in caches)
+        reused = sum(cache.reused for cache in caches)
+        executed = prepared + reused
+        return {"prepared": prepared, "reused": reused, "cached": sum(len(cache.statements) for cache in caches),
+                "reuse_rate": reused / executed if executed else 0.0}
+
 
 class DataSource:
     __instance = None
+    __local = threading.local()
 
-    def __init__(self):
-        logger.add("logs/application.log", rotation="500 MB", level="INFO")
+    def __init__(self, backend: ABackend = None):
+        logger.add("logs/application.log", rotation="500 MB", level="INFO", filter=is_application_record)
         if DataSource.__instance is not None:
             raise Exception("Singleton class, use get_instance() to obtain an instance.")
-        self.connection = pyodbc.connect(
-            driver="{MySQL ODBC 8.0 ANSI Driver}",
-            server=os.environ.get("SERVER_PATH"),
-            user="root",
-            password="root",
-            database="mydb",
-            autocommit=True
-        )
-        logger.info("DataSource created, connection made.")
+        self.backend = backend or create_backend()
+        self.connection = self.backend.connect()
+        logger.info(f"DataSource created, {self.backend.dialect} connection made.")
+        if self.backend.auto_migrate:
+            from logic.migrations import MigrationRunner
+
+            MigrationRunner(connection=self.connection, backend=self.backend).migrate()
+        pool_size = int(os.environ.get("BUDGET_DB_POOL_SIZE", DEFAULT_POOL_SIZE))
+        if self.backend.max_connections:
+            pool_size = min(pool_size, self.backend.max_connections)
+        # benchmarks/statement_cache.py shows no gain on SQLite, so the cache stays off until it shows one.
+        cache_statements = os.environ.get("BUDGET_STATEMENT_CACHE") == "1"
+        self.pool = ConnectionPool(self.backend, self.connection, pool_size, cache_statements)
 
     @staticmethod
     def get_instance():
@@ -27,6 +124,54 @@ class DataSource:
             DataSource.__instance = DataSource()
         return DataSource.__instance
 
+    @staticmethod
+    def configure(backend: ABackend):
+        if DataSource.__instance is not None:
+            raise Exception("DataSource is already initialized.")
+        DataSource.__instance = DataSource(backend)
+        return DataSource.__instance
+
+    @staticmethod
+    @contextmanager
+    def acquire():
+        # The first acquire on a thread takes a pooled connection, nested ones reuse it
+        # until the outermost scope releases it back to the pool.
+        local = DataSource.__local
+        if getattr(local, "connection", None) is not None:
+            yield local.connection
+            return
+        pool = DataSource.get_instance().pool
+        local.connection = pool.take()
+        try:
+            yield local.connection
+        finally:
+            connection, local.connection = local.connection, None
+            pool.give_back(connection)
+
+    @staticmethod
+    def execute_statement(connection, sql: str, params: tuple, consume):
+        # A fresh cursor for the duration of one operation, or the connection's cached one for the SQL text.
+        pool = DataSource.get_instance().pool
+        if pool.cache_statements:
+            return consume(pool.statement_cache(connection).execute(sql, params))
+        cursor = connection.cursor()
+        try:
+            cursor.execute(sql, params)
+            return consume(cursor)
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def get_statement_stats() -> dict:
+        return DataSource.get_instance().pool.statement_stats()
+
     @staticmethod
     def get_connection():
+        connection = getattr(DataSource.__local, "connection", None)
+        if connection is not None:
+            return connection
         return DataSource.get_instance().connection
+
+    @staticmethod
+    def get_backend() -> ABackend:
+        return DataSource.get_instance().backend
@@ -1,4 +1,25 @@
+import datetime
 import hashlib
+import re
+from decimal import Decimal, InvalidOperation
+from typing import Iterable, List
+
+MONEY_QUANTUM = Decimal("0.0001")
+
+# DECIMAL(19,4) holds 15 integer digits.
+MAX_AMOUNT = Decimal("1e15")
+
+# What fits DECIMAL(19,4), once currency symbols and thousands separators are gone.
+AMOUNT_PATTERN = re.compile(r"[+-]?\d{1,15}(?:\.\d{1,4})?")
+
+# Commas only separate whole groups of three digits ("1,234.50"); "12,50" or "1,2,3" are not amounts.
+THOUSANDS_GROUPS_PATTERN = re.compile(r"[+-]?\d{1,3}(?:,\d{3})+(?:\.\d+)?")
+
+# Swaps the separators of "1.234,50" so it reads as "1,234.50".
+DECIMAL_COMMA_TABLE = str.maketrans(".,", ",.")
+
+# Spaces, currency signs and codes, apostrophe thousands separators.
+AMOUNT_NOISE_PATTERN = re.compile(r"[\s'\u00a0$\u20ac\u00a3\u00a5]|^[A-Z]{3}|[A-Z]{3}$")
 
 
 class DataValidation:
@@ -27,4 +48,43 @@ class DataValidation:
             float(num)
             return True
         except ValueError:
-            return False
\ No newline at end of file
+            return False
+
+    @staticmethod
+    def isdecimal(num):
+        try:
+            # Exponents are allowed as long as the value fits the money columns once quantized.
+            value = Decimal(num)
+            return value.is_finite() and abs(value.quantize(MONEY_QUANTUM)) < MAX_AMOUNT
+        except (InvalidOperation, TypeError, ValueError):
+            return False
+
+    @staticmethod
+    def parse_amounts(texts: Iterable[str], decimal_comma: bool = False) -> List[Decimal | None]:
+        # Validates a whole batch against one compiled pattern instead of trying Decimal() on every value;
+        # None marks an invalid amount. "(12.50)" is negative, as bank statements write it.
+        amounts = []
+        for text in texts:
+            text = AMOUNT_NOISE_PATTERN.sub("", text or "")
+            if text.startswith("(") and text.endswith(")"):
+                text = "-" + text[1:-1]
+            if decimal_comma:
+                text = text.translate(DECIMAL_COMMA_TABLE)
+            if "," in text:
+                text = text.replace(",", "") if THOUSANDS_GROUPS_PATTERN.fullmatch(text) else ""
+            amounts.append(Decimal(text).quantize(MONEY_QUANTUM) if AMOUNT_PATTERN.fullmatch(text) else None)
+        return amounts
+
+    @staticmethod
+    def to_decimal(num):
+        if isinstance(num, float):
+            num = repr(num)
+        return Decimal(num).quantize(MONEY_QUANTUM)
+
+    @staticmethod
+    def isdate(text):
+        try:
+            datetime.datetime.strptime(text, "%Y-%m-%d")
+            return True
+        except ValueError:
+            return False
@@ -1,8 +1,11 @@
 import datetime
+from decimal import Decimal
+from enum import Enum
+from typing import List
 
 
 class User:
-    def __init__(self, login: str, password: str, id: int = None, balance: float = 0.0) -> None:
+    def __init__(self, login: str, password: str = None, id: int = None, balance: Decimal = Decimal(0)) -> None:
         self._id = id
         self._login = login
         self._password = password
@@ -33,11 +36,11 @@ class User:
         self._password = new_password
 
     @property
-    def balance(self) -> float:
+    def balance(self) -> Decimal:
         return self._balance
 
     @balance.setter
-    def balance(self, new_balance: float) -> None:
+    def balance(self, new_balance: Decimal) -> None:
         self._balance = new_balance
 
 
@@ -78,12 +81,15 @@ class UserCategory:
 
 
 class Account:
-    def __init__(self, name: str, user: User, balance: float = 0.0, id: int = None, description: str = None) -> None:
+    def __init__(self, name: str, user: User, balance: Decimal = Decimal(0), id: int = None, description: str = None,
+                 opening_balance: Decimal = None, version: int = 0) -> None:
         self._id = id
         self._name = name
         self._description = description
         self._user = user
         self._balance = balance
+        self._opening_balance = balance if opening_balance is None else opening_balance
+        self._version = version
 
     @property
     def id(self) -> int:
@@ -118,26 +124,39 @@ class Account:
         self._user = new_user
 
     @property
-    def balance(self) -> float:
+    def balance(self) -> Decimal:
         return self._balance
 
     @balance.setter
-    def balance(self, new_balance: float) -> None:
+    def balance(self, new_balance: Decimal) -> None:
         self._balance = new_balance
 
+    @property
+    def opening_balance(self) -> Decimal:
+        return self._opening_balance
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    @version.setter
+    def version(self, new_version: int) -> None:
+        self._version = new_version
+
     def __eq__(self, other):
         return self.id == other.id
 
 
 class Transaction:
-    def __init__(self, amount: float, account: Account, id: int = None, description: str = None,
-                 date: datetime = datetime.datetime.now(), category: Category = None) -> None:
+    def __init__(self, amount: Decimal, account: Account, id: int = None, description: str = None,
+                 date: datetime = datetime.datetime.now(), category: Category = None, version: int = 0) -> None:
         self._id = id
         self._account = account
         self._amount = amount
         self._date = date
         self._category = category
         self._description = description
+        self._version = version
 
     @property
     def id(self) -> int:
@@ -148,11 +167,11 @@ class Transaction:
         self._id = new_id
 
     @property
-    def amount(self) -> float:
+    def amount(self) -> Decimal:
         return self._amount
 
     @amount.setter
-    def amount(self, new_amount: float) -> None:
+    def amount(self, new_amount: Decimal) -> None:
         self._amount = new_amount
 
     @property
@@ -187,6 +206,168 @@ class Transaction:
     def category(self, new_category: Category) -> None:
         self._category = new_category
 
+    @property
+    def version(self) -> int:
+        return self._version
+
+    @version.setter
+    def version(self, new_version: int) -> None:
+        self._version = new_version
+
     @property
     def user(self):
         return self._account.user
+
+
+class CategoryMonthSummary:
+    def __init__(self, account: Account, year_month: str, transaction_count: int = 0, amount_sum: Decimal = Decimal(0),
+                 category: Category = None) -> None:
+        self._account = account
+        self._category = category
+        self._year_month = year_month
+        self._transaction_count = transaction_count
+        self._amount_sum = amount_sum
+
+    @property
+    def account(self) -> Account:
+        return self._account
+
+    @account.setter
+    def account(self, new_account: Account) -> None:
+        self._account = new_account
+
+    @property
+    def category(self) -> Category:
+        return self._category
+
+    @property
+    def year_month(self) -> str:
+        return self._year_month
+
+    @property
+    def transaction_count(self) -> int:
+        return self._transaction_count
+
+    @property
+    def amount_sum(self) -> Decimal:
+        return self._amount_sum
+
+
+class CategoryRule:
+    def __init__(self, user: User, category: Category, pattern: str = "", is_regex: bool = False,
+                 min_amount: Decimal = None, max_amount: Decimal = None, account: Account = None, priority: int = 0,
+                 id: int = None) -> None:
+        self._id = id
+        self._user = user
+        self._category = category
+        self._pattern = pattern
+        self._is_regex = is_regex
+        self._min_amount = min_amount
+        self._max_amount = max_amount
+        self._account = account
+        self._priority = priority
+
+    @property
+    def id(self) -> int:
+        return self._id
+
+    @id.setter
+    def id(self, new_id: int) -> None:
+        self._id = new_id
+
+    @property
+    def user(self) -> User:
+        return self._user
+
+    @user.setter
+    def user(self, new_user: User) -> None:
+        self._user = new_user
+
+    @property
+    def category(self) -> Category:
+        return self._category
+
+    @category.setter
+    def category(self, new_category: Category) -> None:
+        self._category = new_category
+
+    @property
+    def pattern(self) -> str:
+        return self._pattern
+
+    @property
+    def is_regex(self) -> bool:
+        return self._is_regex
+
+    @property
+    def min_amount(self) -> Decimal:
+        return self._min_amount
+
+    @property
+    def max_amount(self) -> Decimal:
+        return self._max_amount
+
+    @property
+    def account(self) -> Account:
+        return self._account
+
+    @account.setter
+    def account(self, new_account: Account) -> None:
+        self._account = new_account
+
+    @property
+    def priority(self) -> int:
+        return self._priority
+
+
+class SortOrder(Enum):
+    DATE_DESC = 1
+    DATE_ASC = 2
+    AMOUNT_DESC = 3
+    AMOUNT_ASC = 4
+
+
+class TransactionFilter:
+    def __init__(self, account: Account, date_from: datetime = None, date_to: datetime = None,
+                 categories: List[Category] = None, min_amount: Decimal = None, max_amount: Decimal = None,
+                 text: str = None, sort_order: SortOrder = SortOrder.DATE_DESC) -> None:
+        self._account = account
+        self._date_from = date_from
+        self._date_to = date_to
+        self._categories = categories
+        self._min_amount = min_amount
+        self._max_amount = max_amount
+        self._text = text
+        self._sort_order = sort_order
+
+    @property
+    def account(self) -> Account:
+        return self._account
+
+    @property
+    def date_from(self) -> datetime:
+        return self._date_from
+
+    @property
+    def date_to(self) -> datetime:
+        return self._date_to
+
+    @property
+    def categories(self) -> List[Category]:
+        return self._categories
+
+    @property
+    def min_amount(self) -> Decimal:
+        return self._min_amount
+
+    @property
+    def max_amount(self) -> Decimal:
+        return self._max_amount
+
+    @property
+    def text(self) -> str:
+        return self._text
+
+    @property
+    def sort_order(self) -> SortOrder:
+        return self._sort_order
@@ -0,0 +1,121 @@
+import threading
+from typing import Callable, Dict, List
+
+from loguru import logger
+
+from logic.entities import User, Account, Category, Transaction
+
+CREATED = "created"
+UPDATED = "updated"
+DELETED = "deleted"
+
+
+class Event:
+    pass
+
+
+class TransactionCreated(Event):
+    def __init__(self, transaction: Transaction):
+        self.transaction = transaction
+
+
+class TransactionUpdated(Event):
+    def __init__(self, transaction: Transaction):
+        self.transaction = transaction
+
+
+class TransactionDeleted(Event):
+    def __init__(self, transaction: Transaction):
+        self.transaction = transaction
+
+
+class TransactionsImported(Event):
+    # One event for a whole statement; pages reload the account's list instead of adding rows one by one.
+    def __init__(self, account: Account, count: int):
+        self.account = account
+        self.count = count
+
+
+class AccountChanged(Event):
+    # Also published after a transaction moved the balance, with the account as it is now stored.
+    def __init__(self, account: Account, change: str = UPDATED):
+        self.account = account
+        self.change = change
+
+
+class CategoryChanged(Event):
+    # user is None when the category itself was renamed or removed for everybody.
+    def __init__(self, category: Category, change: str = UPDATED, user: User = None):
+        self.category = category
+        self.change = change
+        self.user = user
+
+
+class Subscription:
+    def __init__(self, bus, event_type: type, handler: Callable):
+        self.bus = bus
+        self.event_type = event_type
+        self.handler = handler
+
+    def cancel(self, *args) -> None:
+        self.bus.unsubscribe(self)
+
+
+class EventBus:
+    # In-process publish/subscribe between the services and the pages. Handlers run synchronously on the
+    # publishing thread unless the subscription passes a dispatch callable (e.g. one posting to the GUI
+    # thread); a failing handler is logged and never fails the write that published the event.
+    __instance = None
+
+    def __init__(self):
+        if EventBus.__instance is not None:
+            raise Exception("Singleton class, use get_instance() to obtain an instance.")
+        self.subscriptions: Dict[type, List[Subscription]] = {}
+        self.dispatchers: Dict[Subscription, Callable] = {}
+        self.lock = threading.Lock()
+        self.published = 0
+
+    @staticmethod
+    def get_instance():
+        if EventBus.__instance is None:
+            EventBus.__instance = EventBus()
+        return EventBus.__instance
+
+    def subscribe(self, event_type: type, handler: Callable, dispatch: Callable = None) -> Subscription:
+        subscription = Subscription(self, event_type, handler)
+        with self.lock:
+            self.subscriptions.setdefault(event_type, []).append(subscription)
+            if dispatch is not None:
+                self.dispatchers[subscription] = dispatch
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self.lock:
+            subscriptions = self.subscriptions.get(subscription.event_type, [])
+            if subscription in subscriptions:
+                subscriptions.remove(subscription)
+            self.dispatchers.pop(subscription, None)
+
+    def publish(self, event: Event) -> None:
+        # Subscribers of a base class (Event included) receive its subclasses too.
+        with self.lock:
+            self.published += 1
+            targets = [(subscription, self.dispatchers.get(subscription))
+                       for event_type in type(event).__mro__
+                       for subscription in self.subscriptions.get(event_type, ())]
+        for subscription, dispatch in targets:
+            if dispatch is None:
+                self.deliver(subscription, event)
+            else:
+                dispatch(lambda subscription=subscription: self.deliver(subscription, event))
+
+    @staticmethod
+    def deliver(subscription: Subscription, event: Event) -> None:
+        try:
+            subscription.handler(event)
+        except Exception:
+            logger.exception(f"{type(event).__name__} handler {subscription.handler} failed")
+
+
+def publish(event: Event) -> None:
+    EventBus.get_instance().publish(event)
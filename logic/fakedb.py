@@ -0,0 +1,123 @@
+import threading
+import time
+from typing import List
+
+
+class FakeDatabase:
+    # One in-memory SQLite database shared by every fake connection. Statements run one at a time
+    # under the lock; a transaction keeps the lock until it ends, so connections stay isolated.
+    def __init__(self, connection, latency: float = 0.0):
+        self.connection = connection
+        self.latency = latency
+        self.lock = threading.RLock()
+        self.round_trips = 0
+        self.counter_lock = threading.Lock()
+
+    def round_trip(self, count: int = 1) -> None:
+        with self.counter_lock:
+            self.round_trips += count
+        if self.latency:
+            time.sleep(self.latency * count)
+
+    def reset(self) -> None:
+        with self.counter_lock:
+            self.round_trips = 0
+
+
+class FakeCursor:
+    # The part of the pyodbc cursor the repositories use. Results are buffered on execute,
+    # the way the MySQL ODBC driver buffers them on the client.
+    def __init__(self, connection: "FakeConnection"):
+        self.connection = connection
+        self.fast_executemany = False
+        self.description = None
+        self.rowcount = -1
+        self.lastrowid = None
+        self.rows = []
+        self.position = 0
+
+    def execute(self, sql: str, params: tuple = ()):
+        database = self.connection.database
+        with database.lock:
+            cursor = database.connection.execute(sql, params)
+            self.description = cursor.description
+            self.rows = cursor.fetchall() if cursor.description else []
+            self.rowcount = len(self.rows) if cursor.description else cursor.rowcount
+            self.lastrowid = cursor.lastrowid
+        self.position = 0
+        database.round_trip()
+        return self
+
+    def executemany(self, sql: str, params: List[tuple]):
+        params = list(params)
+        database = self.connection.database
+        with database.lock:
+            cursor = database.connection.executemany(sql, params)
+            self.rowcount = cursor.rowcount
+        self.description = None
+        self.rows = []
+        self.position = 0
+        # Without fast_executemany pyodbc sends every parameter set on its own.
+        database.round_trip(1 if self.fast_executemany else max(len(params), 1))
+        return self
+
+    def fetchone(self):
+        if self.position >= len(self.rows):
+            return None
+        self.position += 1
+        return self.rows[self.position - 1]
+
+    def fetchmany(self, size: int = 1) -> List:
+        rows = self.rows[self.position:self.position + size]
+        self.position += len(rows)
+        return rows
+
+    def fetchall(self) -> List:
+        rows = self.rows[self.position:]
+        self.position = len(self.rows)
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self) -> None:
+        self.rows = []
+
+
+class FakeConnection:
+    def __init__(self, database: FakeDatabase):
+        self.database = database
+        self.in_transaction = False
+
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self)
+
+    def execute(self, sql: str, params: tuple = ()) -> FakeCursor:
+        return self.cursor().execute(sql, params)
+
+    def begin(self) -> None:
+        self.database.lock.acquire()
+        try:
+            self.execute("BEGIN")
+        except Exception:
+            self.database.lock.release()
+            raise
+        self.in_transaction = True
+
+    def end(self, statement: str) -> None:
+        try:
+            self.execute(statement)
+        finally:
+            self.in_transaction = False
+            self.database.lock.release()
+
+    def commit(self) -> None:
+        if self.in_transaction:
+            self.end("COMMIT")
+
+    def rollback(self) -> None:
+        if self.in_transaction:
+            self.end("ROLLBACK")
+
+    def close(self) -> None:
+        self.rollback()
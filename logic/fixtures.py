@@ -0,0 +1,101 @@
+import datetime
+import random
+from decimal import Decimal
+from typing import List, Tuple
+
+from logic.datasource import DataSource
+from logic.resultcache import ResultCache
+from logic.entities import User, Account
+
+INSERT_GENERATED_TRANSACTION_QUERY = "INSERT INTO `transaction` (amount, description, date, account_id, category_id) " \
+                                     "VALUES (?, ?, ?, ?, ?)"
+
+# Fixed anchor so that the same seed gives the same rows on every run.
+GENERATION_END = datetime.datetime(2024, 1, 1)
+
+GENERATION_DAYS = 365
+
+INSERT_CHUNK_SIZE = 1000
+
+# name: (weight, smallest amount, largest amount, descriptions); None is an uncategorized transaction.
+CATEGORY_PROFILES = {
+    "Food": (35, -80, -3, ["groceries", "lunch", "coffee", "bakery", "dinner"]),
+    "Transport": (15, -60, -2, ["bus", "taxi", "fuel", "train ticket"]),
+    "Other": (10, -150, -5, ["gift", "stationery", "repair"]),
+    "Rent": (3, -1200, -600, ["monthly rent"]),
+    "Entertainment": (12, -90, -8, ["cinema", "concert", "streaming", "books"]),
+    "Health": (5, -200, -10, ["pharmacy", "dentist"]),
+    "Salary": (4, 1500, 4000, ["salary"]),
+    None: (16, -100, 100, ["transfer", "cash", "refund"]),
+}
+
+
+def generate_amount(generator: random.Random, smallest: int, largest: int) -> Decimal:
+    # Skewed towards the cheaper end of the range, like real spending.
+    low, high = sorted((abs(smallest), abs(largest)))
+    value = low + (high - low) * generator.random() ** 2
+    sign = -1 if smallest < 0 and (largest <= 0 or generator.random() < 0.5) else 1
+    return Decimal(sign * value).quantize(Decimal("0.01"))
+
+
+def generate_transactions(generator: random.Random, account: Account, categories: dict, count: int) -> List[Tuple]:
+    names = list(CATEGORY_PROFILES)
+    weights = [CATEGORY_PROFILES[name][0] for name in names]
+    rows = []
+    for name in generator.choices(names, weights=weights, k=count):
+        _, smallest, largest, descriptions = CATEGORY_PROFILES[name]
+        date = GENERATION_END - datetime.timedelta(seconds=generator.randrange(GENERATION_DAYS * 24 * 3600))
+        rows.append((generate_amount(generator, smallest, largest), generator.choice(descriptions), date,
+                     account.id, categories[name].id if name else None))
+    return rows
+
+
+def insert_transactions(rows: List[Tuple]) -> None:
+    backend = DataSource.get_backend()
+    with DataSource.acquire() as connection:
+        cursor = connection.cursor()
+        backend.begin(connection)
+        try:
+            for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+                cursor.executemany(INSERT_GENERATED_TRANSACTION_QUERY, rows[start:start + INSERT_CHUNK_SIZE])
+            backend.commit(connection)
+        except Exception:
+            backend.rollback(connection)
+            raise
+        finally:
+            cursor.close()
+            # Written past the repositories, so cached reads of the table have to be dropped here.
+            ResultCache.get_instance().bump("transaction")
+
+
+def generate(users: int, accounts: int, transactions: int, seed: int = 0, prefix: str = "bench") -> List[User]:
+    # Creates users with their accounts and transactions, the same ones for the same arguments. Logins that
+    # already exist are skipped, so a rerun with the same prefix only adds the missing users; each user has
+    # its own generator, so skipping one doesn't change the data of the others.
+    from logic.services import UserService, AccountService
+
+    user_service = UserService()
+    account_service = AccountService()
+    created = []
+    for user_index in range(users):
+        login = f"{prefix}_{user_index}"
+        if user_service.get_user_by_login(login) is not None:
+            continue
+        generator = random.Random(f"{seed}_{user_index}")
+        success, message = user_service.register(login, "password", "password")
+        if not success:
+            raise ValueError(message)
+        user = user_service.get_user_by_login(login)
+        for name in CATEGORY_PROFILES:
+            if name is not None:
+                user_service.add_category_user(user, name)
+        categories = {category.name: category for category in user_service.get_user_categories(user)}
+        for account_index in range(accounts):
+            _, account = account_service.create(f"Account {account_index}", user,
+                                                str(generator.randrange(0, 5000)))
+            rows = generate_transactions(generator, account, categories, transactions)
+            insert_transactions(rows)
+            account_service.update_balance(account, account.balance + sum(row[0] for row in rows))
+        created.append(user)
+    account_service.rebuild_category_month_summary()
+    return created
@@ -0,0 +1,281 @@
+import csv
+import datetime
+import hashlib
+import os
+import re
+import time
+from collections import defaultdict
+from decimal import Decimal
+from typing import Dict, Iterator, List, Tuple
+
+from loguru import logger
+
+from logic.categorizer import RuleMatcher
+from logic.datavalidation import DataValidation
+from logic.entities import Account, Category, CategoryMonthSummary
+from logic.repositories import AccountRepository, TransactionRepository, CategoryMonthSummaryRepository
+
+IMPORT_FORMATS = ("csv", "ofx", "qif")
+
+IMPORT_CHUNK_SIZE = 1000
+
+# Rejected rows listed in the report; the count covers all of them.
+MAX_REPORTED_REJECTS = 100
+
+# Width of `transaction`.description.
+DESCRIPTION_LENGTH = 45
+
+# Statement field: column name (matched case-insensitively) or 0-based index. Our own CSV export reads as is.
+DEFAULT_CSV_MAPPING = {
+    "date": "date",
+    "amount": "amount",
+    "debit": None,
+    "credit": None,
+    "description": "description",
+    "category": "category",
+    "date_format": None,
+    "delimiter": ",",
+    "decimal_comma": False,
+    "encoding": "utf-8-sig",
+}
+
+DEFAULT_QIF_DATE_FORMAT = "%m/%d/%Y"
+
+OFX_TAG_PATTERN = re.compile(r"<(/?\w+)>([^<\r\n]*)")
+
+# Case, punctuation and spacing differ between the CSV, OFX and QIF exports of one bank.
+DESCRIPTION_NOISE_PATTERN = re.compile(r"[^0-9a-z]+")
+
+# (line number, date or None, amount text, description, category name or None)
+StatementRecord = Tuple[int, datetime.datetime | None, str, str, str | None]
+
+
+def transaction_fingerprint(account_id: int, date: datetime.datetime, amount: Decimal, description: str,
+                            occurrence: int = 1) -> str:
+    # Statements disagree on the time of day, so the day is what identifies a statement line. Two coffees of
+    # the same price on one day are still two lines: the n-th identical line of a file gets occurrence n, so
+    # both go in and an overlapping statement repeats both fingerprints.
+    normalized = DESCRIPTION_NOISE_PATTERN.sub(" ", description.lower()).strip()
+    key = f"{account_id}|{date:%Y-%m-%d}|{amount}|{normalized}"
+    if occurrence > 1:
+        key = f"{key}|{occurrence}"
+    return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+
+class DateParser:
+    # Statements repeat the same few hundred dates, so each distinct text is parsed once.
+    def __init__(self, date_format: str = None, fallback_format: str = None):
+        self.date_format = date_format
+        self.fallback_format = fallback_format
+        self.parsed: Dict[str, datetime.datetime | None] = {}
+
+    def __call__(self, text: str) -> datetime.datetime | None:
+        text = (text or "").strip()
+        if text not in self.parsed:
+            self.parsed[text] = self.parse(text)
+        return self.parsed[text]
+
+    def parse(self, text: str) -> datetime.datetime | None:
+        for date_format in (self.date_format, self.fallback_format):
+            try:
+                if date_format is None:
+                    return datetime.datetime.fromisoformat(text)
+                return datetime.datetime.strptime(text, date_format)
+            except ValueError:
+                continue
+        return None
+
+
+def detect_format(file_path: str) -> str:
+    extension = os.path.splitext(file_path)[1].lower().lstrip(".")
+    if extension in ("ofx", "qfx"):
+        return "ofx"
+    return extension if extension in IMPORT_FORMATS else "csv"
+
+
+def parse_csv(file, mapping: dict = None) -> Iterator[StatementRecord]:
+    mapping = {**DEFAULT_CSV_MAPPING, **(mapping or {})}
+    reader = csv.reader(file, delimiter=mapping["delimiter"])
+    header = [name.strip().lower() for name in next(reader, [])]
+
+    def column(field):
+        key = mapping[field]
+        if key is None or isinstance(key, int):
+            return key
+        key = key.lower()
+        return header.index(key) if key in header else None
+
+    date_column, amount_column, description_column, category_column, debit_column, credit_column = (
+        column(field) for field in ("date", "amount", "description", "category", "debit", "credit"))
+    if date_column is None or amount_column is None and debit_column is None and credit_column is None:
+        raise ValueError("The statement needs a date column and an amount or debit/credit columns")
+    parse_date = DateParser(mapping["date_format"])
+
+    def cell(row, index):
+        return row[index].strip() if index is not None and index < len(row) else ""
+
+    for row in reader:
+        if not any(row):
+            continue
+        if amount_column is not None:
+            amount = cell(row, amount_column)
+        else:
+            # Kept as text for the batch validation; a credit wins over an empty debit.
+            credit, debit = cell(row, credit_column), cell(row, debit_column)
+            amount = credit or (f"-{debit.lstrip('-')}" if debit else "")
+        # Our export writes uncategorized transactions as None.
+        category = cell(row, category_column)
+        yield (reader.line_num, parse_date(cell(row, date_column)), amount, cell(row, description_column),
+               category if category and category != "None" else None)
+
+
+def parse_ofx(file) -> Iterator[StatementRecord]:
+    # Works for SGML OFX 1.x (unclosed leaf tags) and XML OFX 2.x, one STMTTRN aggregate at a time.
+    parse_date = DateParser("%Y%m%d%H%M%S", "%Y%m%d")
+    record, start = None, 0
+    for line_number, line in enumerate(file, 1):
+        for tag, value in OFX_TAG_PATTERN.findall(line):
+            tag = tag.upper()
+            if tag == "STMTTRN":
+                record, start = {}, line_number
+            elif tag == "/STMTTRN" and record is not None:
+                description = " ".join(part for part in (record.get("NAME"), record.get("MEMO")) if part)
+                # DTPOSTED may carry milliseconds and a time zone, e.g. 20240105120000.000[-5:EST].
+                posted = record.get("DTPOSTED", "")
+                yield (start, parse_date(posted[:14] if len(posted) >= 14 else posted[:8]),
+                       record.get("TRNAMT", ""), description, None)
+                record = None
+            elif record is not None and not tag.startswith("/"):
+                record[tag] = value.strip()
+
+
+def parse_qif(file, date_format: str = None) -> Iterator[StatementRecord]:
+    parse_date = DateParser(date_format or DEFAULT_QIF_DATE_FORMAT, "%m/%d/%y")
+    record, start = {}, 1
+    for line_number, line in enumerate(file, 1):
+        line = line.rstrip("\r\n")
+        if not line or line.startswith("!"):
+            continue
+        code, value = line[0], line[1:].strip()
+        if code == "^":
+            if record:
+                description = " ".join(part for part in (record.get("P"), record.get("M")) if part)
+                # Quicken writes 1/ 5'24 for 01/05/2024.
+                date = record.get("D", "").replace("'", "/").replace(" ", "")
+                yield start, parse_date(date), record.get("T", record.get("U", "")), description, \
+                    record.get("L", "").split(":")[0] or None
+            record, start = {}, line_number + 1
+        elif code not in record:
+            record[code] = value
+
+
+class StatementImporter:
+    # Streams a statement into one account: records are parsed lazily, validated and inserted a chunk at a
+    # time, all in one database transaction, so memory stays bounded by the chunk size.
+    def __init__(self, account: Account, categories: List[Category], matcher: RuleMatcher = None,
+                 chunk_size: int = IMPORT_CHUNK_SIZE):
+        self.account = account
+        self.matcher = matcher
+        self.chunk_size = chunk_size
+        self.categories = {category.name.lower(): category for category in categories}
+        self.categories_by_id = {category.id: category for category in categories}
+        self.decimal_comma = False
+        self.occurrences = defaultdict(int)
+        self.account_repository = AccountRepository()
+        self.transaction_repository = TransactionRepository()
+        self.summary_repository = CategoryMonthSummaryRepository()
+
+    def records(self, file, file_format: str, mapping: dict = None) -> Iterator[StatementRecord]:
+        if file_format == "csv":
+            return parse_csv(file, mapping)
+        if file_format == "ofx":
+            return parse_ofx(file)
+        if file_format == "qif":
+            return parse_qif(file, (mapping or {}).get("date_format"))
+        raise ValueError(f"Unknown statement format {file_format}")
+
+    def import_file(self, file_path: str, file_format: str = None, mapping: dict = None) -> dict:
+        file_format = file_format or detect_format(file_path)
+        encoding = (mapping or {}).get("encoding", DEFAULT_CSV_MAPPING["encoding"])
+        self.decimal_comma = bool((mapping or {}).get("decimal_comma"))
+        self.occurrences = defaultdict(int)
+        report = {"file": file_path, "format": file_format, "parsed": 0, "imported": 0, "duplicates": 0,
+                  "categorized_by_rules": 0, "rejected": 0, "rejects": [], "unknown_categories": {}}
+        started = time.perf_counter()
+        total = Decimal(0)
+        # (category id, year-month) -> [count, sum], applied to the monthly summary once at the end.
+        summary = defaultdict(lambda: [0, Decimal(0)])
+        with open(file_path, newline="", encoding=encoding) as file, self.transaction_repository.transaction():
+            chunk = []
+            for record in self.records(file, file_format, mapping):
+                chunk.append(record)
+                if len(chunk) == self.chunk_size:
+                    total += self.import_chunk(chunk, report, summary)
+                    chunk = []
+            total += self.import_chunk(chunk, report, summary)
+            if report["imported"]:
+                self.account = self.account_repository.adjust_balance(self.account, total)
+                for (category_id, year_month), (count, amount_sum) in summary.items():
+                    self.summary_repository.create(CategoryMonthSummary(
+                        account=self.account, year_month=year_month, transaction_count=count, amount_sum=amount_sum,
+                        category=self.categories_by_id.get(category_id)))
+        report["seconds"] = round(time.perf_counter() - started, 3)
+        report["rows_per_second"] = round(report["parsed"] / report["seconds"]) if report["seconds"] else 0
+        logger.info(f"Imported {report['imported']} of {report['parsed']} row(s) from {file_path} in "
+                    f"{report['seconds']} s, {report['duplicates']} already present, {report['rejected']} rejected")
+        return report
+
+    def categorize(self, row: tuple, report: dict) -> tuple:
+        amount, description, date, _, fingerprint = row
+        category = self.matcher.match(description, amount, self.account.id)
+        if category is None:
+            return row
+        report["categorized_by_rules"] += 1
+        self.categories_by_id.setdefault(category.id, category)
+        return amount, description, date, category.id, fingerprint
+
+    def reject(self, report: dict, line: int, reason: str) -> None:
+        report["rejected"] += 1
+        if len(report["rejects"]) < MAX_REPORTED_REJECTS:
+            report["rejects"].append({"line": line, "reason": reason})
+
+    def import_chunk(self, chunk: List[StatementRecord], report: dict, summary: dict) -> Decimal:
+        report["parsed"] += len(chunk)
+        amounts = DataValidation.parse_amounts((record[2] for record in chunk), self.decimal_comma)
+        rows = []
+        for (line, date, amount_text, description, category_name), amount in zip(chunk, amounts):
+            if amount is None:
+                self.reject(report, line, f"Amount {amount_text!r} isn't a number")
+                continue
+            if date is None:
+                self.reject(report, line, "Date can't be read")
+                continue
+            description = description[:DESCRIPTION_LENGTH]
+            fingerprint = transaction_fingerprint(self.account.id, date, amount, description)
+            # Counted by the first occurrence's fingerprint; only repeated lines are hashed again.
+            self.occurrences[fingerprint] += 1
+            if self.occurrences[fingerprint] > 1:
+                fingerprint = transaction_fingerprint(self.account.id, date, amount, description,
+                                                      self.occurrences[fingerprint])
+            category = None
+            if category_name:
+                category = self.categories.get(category_name.lower())
+                if category is None:
+                    unknown = report["unknown_categories"]
+                    unknown[category_name] = unknown.get(category_name, 0) + 1
+            rows.append((amount, description, date, category.id if category else None, fingerprint))
+        if rows:
+            existing = self.transaction_repository.get_existing_fingerprints([row[4] for row in rows])
+            if existing:
+                report["duplicates"] += len(existing)
+                rows = [row for row in rows if row[4] not in existing]
+        if self.matcher is not None:
+            rows = [self.categorize(row, report) if row[3] is None else row for row in rows]
+        total = Decimal(0)
+        for amount, _, date, category_id, _ in rows:
+            entry = summary[(category_id, date.strftime("%Y-%m"))]
+            entry[0] += 1
+            entry[1] += amount
+            total += amount
+        report["imported"] += self.transaction_repository.insert_many(self.account, rows)
+        return total
@@ -0,0 +1,64 @@
+from bisect import bisect_left
+from typing import Callable, Hashable, List, Sequence, Tuple
+
+from logic.entities import Transaction
+
+INSERT = "insert"
+REMOVE = "remove"
+CHANGE = "change"
+
+MISSING = object()
+
+
+def transaction_key(transaction: Transaction) -> int:
+    return transaction.id
+
+
+def transaction_version(transaction: Transaction) -> Hashable:
+    # The row version moves with every update of the row; renaming its category doesn't touch the row.
+    category = transaction.category
+    return transaction.version, category.name if category else None
+
+
+def longest_increasing(positions: Sequence[int]) -> set:
+    # Indexes into positions of one longest strictly increasing subsequence, O(n log n).
+    tails, tail_indexes, previous = [], [], [None] * len(positions)
+    for index, position in enumerate(positions):
+        slot = bisect_left(tails, position)
+        if slot == len(tails):
+            tails.append(position)
+            tail_indexes.append(index)
+        else:
+            tails[slot] = position
+            tail_indexes[slot] = index
+        previous[index] = tail_indexes[slot - 1] if slot else None
+    result = set()
+    index = tail_indexes[-1] if tail_indexes else None
+    while index is not None:
+        result.add(index)
+        index = previous[index]
+    return result
+
+
+def diff_rows(old: Sequence, new: Sequence, key: Callable = transaction_key,
+              version: Callable = transaction_version) -> List[Tuple[str, int, object]]:
+    # Edit script turning old into new: (REMOVE, index, None), then (INSERT, index, row) and
+    # (CHANGE, index, row) in ascending order, indexes valid at the moment the operation is applied.
+    # Rows are matched by key; of the rows present in both, the longest run already in the new order
+    # stays in place and the others are moved (removed and inserted again).
+    new_positions = {key(row): position for position, row in enumerate(new)}
+    kept = [(index, new_positions[key(row)]) for index, row in enumerate(old) if key(row) in new_positions]
+    staying = {kept[index][0] for index in longest_increasing([position for _, position in kept])}
+
+    operations = []
+    for index in range(len(old) - 1, -1, -1):
+        if index not in staying:
+            operations.append((REMOVE, index, None))
+    old_versions = {key(old[index]): version(old[index]) for index in staying}
+    for position, row in enumerate(new):
+        previous_version = old_versions.get(key(row), MISSING)
+        if previous_version is MISSING:
+            operations.append((INSERT, position, row))
+        elif previous_version != version(row):
+            operations.append((CHANGE, position, row))
+    return operations
@@ -0,0 +1,162 @@
+import datetime
+import os
+import re
+from typing import List
+
+from loguru import logger
+
+from logic import repositories
+from logic.backends import ABackend
+from logic.datasource import DataSource
+from logic.querystats import is_application_record
+
+MIGRATION_FILE_PATTERN = re.compile(r"^(\d+)_(\w+)\.sql$")
+
+CREATE_SCHEMA_MIGRATION_TABLE_QUERY = "CREATE TABLE IF NOT EXISTS schema_migration (" \
+                                      "version INT NOT NULL PRIMARY KEY, name VARCHAR(255) NOT NULL, " \
+                                      "applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+
+SELECT_APPLIED_MIGRATIONS_QUERY = "SELECT version FROM schema_migration"
+
+INSERT_MIGRATION_QUERY = "INSERT INTO schema_migration (version, name) VALUES (?, ?)"
+
+# Queries that read or rewrite a whole table on purpose (deleting a category is rare, the summary small).
+FULL_SCAN_QUERIES = {"CLEAR_CATEGORY_MONTH_SUMMARY_QUERY", "REBUILD_CATEGORY_MONTH_SUMMARY_QUERY",
+                     "RECOMPUTE_ACCOUNT_BALANCES_QUERY", "DELETE_CATEGORY_MONTH_SUMMARY_BY_CATEGORY_QUERY"}
+
+# Sample values for templated queries, so that they can be explained as written.
+QUERY_TEMPLATE_ARGUMENTS = {
+    "LAST_ROW_QUERY": ("account",),
+    "SELECT_TRANSACTION_FINGERPRINTS_QUERY": ("?",),
+    "SELECT_FILTERED_TRANSACTIONS_QUERY": ("".join(repositories.TRANSACTION_FILTER_CONDITIONS.values())
+                                           .format("?"),
+                                           repositories.TRANSACTION_SORT_ORDERS[repositories.SortOrder.DATE_DESC]),
+}
+
+PARAMETER_COLUMN_PATTERN = re.compile(r"(\w+)`?\s*(?:=|>=|<=|<|>|LIKE|IN\s*\()\s*\?$", re.IGNORECASE)
+
+TEXT_COLUMNS = {"login", "password", "name", "description", "year_month", "fingerprint"}
+
+
+class Migration:
+    def __init__(self, version: int, name: str, path: str) -> None:
+        self._version = version
+        self._name = name
+        self._path = path
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def statements(self) -> List[str]:
+        with open(self._path) as file:
+            lines = [line for line in file if not line.lstrip().startswith("--")]
+        return [statement.strip() for statement in "".join(lines).split(";") if statement.strip()]
+
+
+class MigrationRunner:
+    def __init__(self, connection=None, backend: ABackend = None, path: str = None):
+        logger.add("logs/application.log", rotation="500 MB", level="INFO", filter=is_application_record)
+        self.backend = backend or DataSource.get_backend()
+        self.connection = connection or DataSource.get_connection()
+        self.cursor = self.connection.cursor()
+        self.path = path or self.backend.migrations_path
+
+    def discover(self) -> List[Migration]:
+        migrations = []
+        for filename in sorted(os.listdir(self.path)):
+            match = MIGRATION_FILE_PATTERN.match(filename)
+            if match:
+                migrations.append(Migration(version=int(match.group(1)), name=match.group(2),
+                                            path=os.path.join(self.path, filename)))
+        return sorted(migrations, key=lambda migration: migration.version)
+
+    def applied_versions(self) -> set:
+        self.cursor.execute(CREATE_SCHEMA_MIGRATION_TABLE_QUERY)
+        self.cursor.execute(SELECT_APPLIED_MIGRATIONS_QUERY)
+        return {int(row[0]) for row in self.cursor.fetchall()}
+
+    def pending(self) -> List[Migration]:
+        applied = self.applied_versions()
+        return [migration for migration in self.discover() if migration.version not in applied]
+
+    def migrate(self) -> List[Migration]:
+        # On MySQL every DDL statement commits on its own, so a migration that fails halfway stays half applied.
+        # Running it again skips the statements whose table, column, index or key exists already; data
+        # statements in the MySQL migrations are written to be safe to run twice.
+        applied = []
+        for migration in self.pending():
+            logger.info(f"Applying migration {migration.version} {migration.name}...")
+            self.backend.begin(self.connection)
+            try:
+                for statement in migration.statements():
+                    self.execute(statement)
+                self.cursor.execute(INSERT_MIGRATION_QUERY, (migration.version, migration.name))
+                self.backend.commit(self.connection)
+            except Exception:
+                self.backend.rollback(self.connection)
+                logger.error(f"Migration {migration.version} {migration.name} failed")
+                raise
+            applied.append(migration)
+        logger.info(f"{len(applied)} migration(s) applied")
+        return applied
+
+
+    def execute(self, statement: str) -> None:
+        try:
+            self.cursor.execute(statement)
+        except Exception as error:
+            if self.backend.transactional_ddl or not self.backend.already_applied(error):
+                raise
+            logger.warning(f"Skipping a statement applied by an earlier attempt: {error}")
+
+
+class QueryPlanChecker:
+    def __init__(self):
+        self.backend = DataSource.get_backend()
+        self.connection = DataSource.get_connection()
+        self.cursor = self.connection.cursor()
+
+    @staticmethod
+    def queries(dialect: str = "mysql") -> dict:
+        queries = {}
+        dialect_queries = repositories.DIALECT_QUERIES[dialect]
+        for name, value in vars(repositories).items():
+            if not name.endswith("_QUERY") or not isinstance(value, str) or name in FULL_SCAN_QUERIES:
+                continue
+            if value.lstrip().upper().startswith("INSERT"):
+                continue
+            query = dialect_queries.get(value, value)
+            queries[name] = query.format(*QUERY_TEMPLATE_ARGUMENTS.get(name, ()))
+        return queries
+
+    @staticmethod
+    def sample_parameters(query: str) -> tuple:
+        parameters = []
+        for placeholder in re.finditer(r"\?", query):
+            match = PARAMETER_COLUMN_PATTERN.search(query[:placeholder.end()])
+            column = match.group(1).lower() if match else None
+            if column in TEXT_COLUMNS:
+                parameters.append("sample")
+            elif column == "date":
+                parameters.append(datetime.datetime.now())
+            else:
+                parameters.append(1)
+        return tuple(parameters)
+
+    def check(self) -> List[str]:
+        unindexed = []
+        for name, query in self.queries(self.backend.dialect).items():
+            tables = self.backend.explain(self.cursor, query, self.sample_parameters(query))
+            if tables:
+                logger.warning(f"{name} scans {', '.join(tables)} without an index")
+                unindexed.append(name)
+        return unindexed
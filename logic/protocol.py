@@ -0,0 +1,103 @@
+import datetime
+import ipaddress
+import json
+import os
+import socket
+from decimal import Decimal
+
+import numpy as np
+
+from logic.entities import User, Category, UserCategory, Account, Transaction, CategoryMonthSummary, SortOrder, \
+    TransactionFilter, CategoryRule
+
+DEFAULT_DAEMON_ADDRESS = "127.0.0.1:8765"
+
+# Entities cross the socket as {"$": class name, constructor argument: value}. Password hashes never do.
+ENTITY_FIELDS = {
+    User: ("login", "id", "balance"),
+    Category: ("name", "id"),
+    UserCategory: ("user", "category"),
+    Account: ("name", "user", "balance", "id", "description", "opening_balance", "version"),
+    Transaction: ("amount", "account", "id", "description", "date", "category", "version"),
+    CategoryMonthSummary: ("account", "year_month", "transaction_count", "amount_sum", "category"),
+    CategoryRule: ("user", "category", "pattern", "is_regex", "min_amount", "max_amount", "account", "priority", "id"),
+    TransactionFilter: ("account", "date_from", "date_to", "categories", "min_amount", "max_amount", "text",
+                        "sort_order"),
+}
+
+ENTITY_CLASSES = {cls.__name__: cls for cls in ENTITY_FIELDS}
+
+# Service methods that touch local files or windows: clients run them in their own process.
+LOCAL_METHODS = {"generate_average_transactions_plot", "generate_balance_history_plot", "create_csv_file",
+                 "write_transactions_csv", "write_transactions_parquet"}
+
+
+def daemon_address(address: str = None) -> tuple:
+    host, port = (address or os.environ.get("BUDGET_DAEMON_ADDRESS", DEFAULT_DAEMON_ADDRESS)).rsplit(":", 1)
+    return host, int(port)
+
+
+def is_loopback(host: str) -> bool:
+    # Every address the name resolves to has to be local, the daemon has no transport security.
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host.strip("[]"), None)}
+    except socket.gaierror:
+        return False
+    return bool(addresses) and all(ipaddress.ip_address(address.split("%")[0]).is_loopback for address in addresses)
+
+
+def encode(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, Decimal):
+        return {"$": "Decimal", "value": str(value)}
+    if isinstance(value, datetime.datetime):
+        return {"$": "datetime", "value": value.isoformat()}
+    if isinstance(value, SortOrder):
+        return {"$": "SortOrder", "value": value.name}
+    if isinstance(value, tuple):
+        return {"$": "tuple", "value": [encode(item) for item in value]}
+    if isinstance(value, list):
+        return [encode(item) for item in value]
+    if isinstance(value, np.ndarray):
+        # Dates go as their int64 ticks, the dtype string keeps the unit.
+        values = value.view(np.int64) if value.dtype.kind == "M" else value
+        return {"$": "ndarray", "dtype": value.dtype.str, "value": values.tolist()}
+    if isinstance(value, dict):
+        return {"$": "dict", "value": {str(key): encode(item) for key, item in value.items()}}
+    fields = ENTITY_FIELDS.get(type(value))
+    if fields is None:
+        raise TypeError(f"{type(value).__name__} can't be sent to or from the daemon")
+    entity = {"$": type(value).__name__}
+    for field in fields:
+        entity[field] = encode(getattr(value, field))
+    return entity
+
+
+def decode(value):
+    if isinstance(value, list):
+        return [decode(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    kind = value["$"]
+    if kind == "Decimal":
+        return Decimal(value["value"])
+    if kind == "datetime":
+        return datetime.datetime.fromisoformat(value["value"])
+    if kind == "SortOrder":
+        return SortOrder[value["value"]]
+    if kind == "tuple":
+        return tuple(decode(item) for item in value["value"])
+    if kind == "ndarray":
+        dtype = np.dtype(value["dtype"])
+        if dtype.kind == "M":
+            return np.array(value["value"], dtype=np.int64).view(dtype)
+        return np.array(value["value"], dtype=dtype)
+    if kind == "dict":
+        return {key: decode(item) for key, item in value["value"].items()}
+    cls = ENTITY_CLASSES[kind]
+    return cls(**{field: decode(value[field]) for field in ENTITY_FIELDS[cls]})
+
+
+def dumps(message: dict) -> bytes:
+    return json.dumps(message, separators=(",", ":")).encode() + b"\n"
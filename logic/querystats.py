@@ -0,0 +1,112 @@
+import atexit
+import json
+import os
+import threading
+from typing import Dict, List
+
+import numpy as np
+from loguru import logger
+
+# Latencies kept per query for the percentiles; older samples are overwritten.
+SAMPLE_SIZE = 1024
+
+DEFAULT_SLOW_QUERY_MS = 200
+
+SLOW_QUERY_LOG_PATH = "logs/slow_queries.log"
+
+ADHOC_QUERY_ID = "ADHOC_QUERY"
+
+
+def is_application_record(record) -> bool:
+    # Filter for the application.log sinks: slow queries have their own log.
+    return "slow_query" not in record["extra"]
+
+
+class QueryTiming:
+    def __init__(self, query_id: str) -> None:
+        self.query_id = query_id
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.slow = 0
+        self.samples = np.zeros(SAMPLE_SIZE)
+
+    def add(self, seconds: float, rows: int, slow: bool) -> None:
+        self.samples[self.count % SAMPLE_SIZE] = seconds
+        self.count += 1
+        self.total += seconds
+        self.rows += rows
+        if seconds > self.max:
+            self.max = seconds
+        if slow:
+            self.slow += 1
+
+    def summary(self) -> dict:
+        samples = self.samples[:min(self.count, SAMPLE_SIZE)] * 1000
+        p50, p95, p99 = np.percentile(samples, [50, 95, 99]) if len(samples) else (0.0, 0.0, 0.0)
+        # The percentiles cover only the latest SAMPLE_SIZE executions, count, total and max all of them.
+        return {"query": self.query_id, "count": self.count, "total_ms": round(self.total * 1000, 3),
+                "mean_ms": round(self.total * 1000 / self.count, 3) if self.count else 0.0,
+                "p50_ms": round(float(p50), 3), "p95_ms": round(float(p95), 3), "p99_ms": round(float(p99), 3),
+                "max_ms": round(self.max * 1000, 3), "rows": self.rows, "slow": self.slow,
+                "percentile_samples": len(samples)}
+
+
+class QueryStatistics:
+    __instance = None
+
+    def __init__(self):
+        if QueryStatistics.__instance is not None:
+            raise Exception("Singleton class, use get_instance() to obtain an instance.")
+        self.enabled = os.environ.get("BUDGET_QUERY_STATS", "1") != "0"
+        self.slow_query_seconds = float(os.environ.get("BUDGET_SLOW_QUERY_MS", DEFAULT_SLOW_QUERY_MS)) / 1000
+        self.timings: Dict[str, QueryTiming] = {}
+        self.lock = threading.Lock()
+        logger.add(SLOW_QUERY_LOG_PATH, rotation="100 MB", level="WARNING",
+                   filter=lambda record: "slow_query" in record["extra"])
+        self.slow_logger = logger.bind(slow_query=True)
+        report_path = os.environ.get("BUDGET_QUERY_REPORT")
+        if report_path:
+            atexit.register(self.dump, report_path)
+
+    @staticmethod
+    def get_instance():
+        if QueryStatistics.__instance is None:
+            QueryStatistics.__instance = QueryStatistics()
+        return QueryStatistics.__instance
+
+    def record(self, query_id: str, seconds: float, rows: int, sql: str = None) -> None:
+        slow = seconds >= self.slow_query_seconds
+        with self.lock:
+            timing = self.timings.get(query_id)
+            if timing is None:
+                timing = self.timings[query_id] = QueryTiming(query_id)
+            timing.add(seconds, rows, slow)
+        if slow:
+            # Parameters are left out, they may hold credentials.
+            self.slow_logger.warning(f"{query_id} took {seconds * 1000:.1f} ms, {rows} row(s): {sql}")
+
+    def report(self) -> List[dict]:
+        # Most expensive queries first.
+        with self.lock:
+            summaries = [timing.summary() for timing in self.timings.values()]
+        return sorted(summaries, key=lambda summary: summary["total_ms"], reverse=True)
+
+    def format_report(self) -> str:
+        lines = [f"{'query':<48}{'count':>8}{'total ms':>11}{'p50':>9}{'p95':>9}{'p99':>9}{'rows':>9}{'slow':>6}"]
+        for summary in self.report():
+            lines.append(f"{summary['query']:<48}{summary['count']:>8}{summary['total_ms']:>11.1f}"
+                         f"{summary['p50_ms']:>9.3f}{summary['p95_ms']:>9.3f}{summary['p99_ms']:>9.3f}"
+                         f"{summary['rows']:>9}{summary['slow']:>6}")
+        lines.append(f"p50/p95/p99 cover the last {SAMPLE_SIZE} executions of each query.")
+        return "\n".join(lines)
+
+    def dump(self, path: str) -> None:
+        with open(path, "w") as file:
+            json.dump(self.report(), file, indent=2)
+        logger.info(f"Query report written to {path}")
+
+    def reset(self) -> None:
+        with self.lock:
+            self.timings.clear()
@@ -1,11 +1,19 @@
+import datetime
+import time
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
 from enum import Enum
 from typing import TypeVar, Generic, Any, List
 
 from logic.datasource import DataSource
+from logic.datavalidation import DataValidation
+from logic.querystats import QueryStatistics, ADHOC_QUERY_ID
+from logic.resultcache import ResultCache
+from logic.workload import WorkloadRecorder
 from loguru import logger
 
-from logic.entities import User, Account, Category, Transaction, UserCategory
+from logic.entities import User, Account, Category, Transaction, UserCategory, CategoryMonthSummary, \
+    TransactionFilter, SortOrder, CategoryRule
 
 IS_USER_HAS_CATEGORY_QUERY = "select count(*) from user_has_category as u join category as c on u.category_id = c.id where user_id = ? and  c.id =? and c.name =?"
 
@@ -17,29 +25,73 @@ SELECT_CATEGORY_COUNT_QUERY = "select count(*) from user_has_category where cate
 
 DELETE_USER_HAS_CATEGORY_QUERY = "delete from user_has_category where user_id = ? and category_id =?"
 
-DELETE_TRANSACTION_QUERY = "DELETE FROM transaction WHERE id = ?"
+DELETE_TRANSACTION_QUERY = "DELETE FROM `transaction` WHERE id = ?"
 
-UPDATE_TRANSACTION_QUERY = "UPDATE transaction SET amount = ?, description = ?," \
-                           "date = CURRENT_TIMESTAMP, category_id = ? WHERE id = ?"
+UPDATE_TRANSACTION_QUERY = "UPDATE `transaction` SET amount = ?, description = ?," \
+                           "date = CURRENT_TIMESTAMP, category_id = ?, version = version + 1 " \
+                           "WHERE id = ? AND version = ?"
 
 UPDATE_CATEGORY_QUERY = "UPDATE category SET name = ? WHERE id = ?"
 
 DELETE_CATEGORY_QUERY = "DELETE FROM category  WHERE id = ?"
 
+DELETE_CATEGORY_MONTH_SUMMARY_BY_CATEGORY_QUERY = "DELETE FROM category_month_summary WHERE category_id = ?"
+
+SUBTRACT_CATEGORY_FROM_BALANCES_QUERY = "UPDATE account SET balance = balance - (SELECT SUM(amount) FROM `transaction` " \
+                                        "WHERE account_id = account.id AND category_id = ?), version = version + 1 " \
+                                        "WHERE id IN (SELECT account_id FROM `transaction` WHERE category_id = ?)"
+
 DELETE_ACCOUNT_QUERY = "DELETE FROM account WHERE id=? "
 
 UPDATE_USER_QUERY = "UPDATE user SET login = ?, password = ? WHERE id = ?"
 
-SELECT_TRANSACTIONS_BY_ACCOUNT_QUERY = "SELECT t.id,t.amount,t.description,t.date,t.account_id,c.id,c.name FROM transaction as t left join category as c on c.id = t.category_id WHERE account_id = ?"
+SELECT_TRANSACTIONS_BY_ACCOUNT_QUERY = "SELECT t.id,t.amount,t.description,t.date,t.account_id,c.id,c.name,t.version FROM `transaction` as t left join category as c on c.id = t.category_id WHERE account_id = ?"
+
+SELECT_FILTERED_TRANSACTIONS_QUERY = "SELECT t.id,t.amount,t.description,t.date,t.account_id,c.id,c.name,t.version FROM `transaction` as t left join category as c on c.id = t.category_id WHERE t.account_id = ?{} ORDER BY {}"
+
+# Balance before the first transaction in the date range: (account id, range start, account id). It doesn't
+# depend on the row, so it's evaluated once.
+BALANCE_BEFORE_SUBQUERY = "(SELECT opening_balance + COALESCE((SELECT SUM(amount) FROM `transaction` " \
+                          "WHERE account_id = ? AND date < ?), 0) FROM account WHERE id = ?)"
+
+SELECT_RUNNING_BALANCE_QUERY = "SELECT t.date, " + BALANCE_BEFORE_SUBQUERY + " + SUM(t.amount) OVER (" \
+                               "PARTITION BY t.account_id ORDER BY t.date, t.id) FROM `transaction` as t " \
+                               "WHERE t.account_id = ? AND t.date >= ? AND t.date <= ? ORDER BY t.date, t.id"
 
-SELECT_TRANSACTION_BY_ID_QUERY = "SELECT t.id,t.amount,t.description,t.date,t.account_id,c.id,c.name FROM transaction as t left join category as c on c.id = t.category_id WHERE t.id = ?"
+SELECT_DAILY_BALANCE_QUERY = "SELECT DATE(t.date), " + BALANCE_BEFORE_SUBQUERY + " + SUM(SUM(t.amount)) OVER (" \
+                             "PARTITION BY t.account_id ORDER BY DATE(t.date)) FROM `transaction` as t " \
+                             "WHERE t.account_id = ? AND t.date >= ? AND t.date <= ? " \
+                             "GROUP BY t.account_id, DATE(t.date) ORDER BY DATE(t.date)"
 
-CREATE_TRANSACTION_QUERY = "INSERT INTO transaction" \
+TRANSACTION_FILTER_CONDITIONS = {
+    "date_from": " AND t.date >= ?",
+    "date_to": " AND t.date <= ?",
+    "categories": " AND t.category_id IN ({})",
+    "min_amount": " AND t.amount >= ?",
+    "max_amount": " AND t.amount <= ?",
+    "text": " AND t.description LIKE ? ESCAPE '!'",
+}
+
+TRANSACTION_SORT_ORDERS = {
+    SortOrder.DATE_DESC: "t.date DESC, t.id DESC",
+    SortOrder.DATE_ASC: "t.date ASC, t.id ASC",
+    SortOrder.AMOUNT_DESC: "t.amount DESC, t.id DESC",
+    SortOrder.AMOUNT_ASC: "t.amount ASC, t.id ASC",
+}
+
+SELECT_TRANSACTION_BY_ID_QUERY = "SELECT t.id,t.amount,t.description,t.date,t.account_id,c.id,c.name,t.version FROM `transaction` as t left join category as c on c.id = t.category_id WHERE t.id = ?"
+
+CREATE_TRANSACTION_QUERY = "INSERT INTO `transaction`" \
                            " (amount, description, account_id,category_id) VALUES (?,?,?,?)"
 
-CREATE_TRANSACTION_WITHOUT_CATEGORY_QUERY = "INSERT INTO transaction" \
+CREATE_TRANSACTION_WITHOUT_CATEGORY_QUERY = "INSERT INTO `transaction`" \
                                             " (amount, description, account_id) VALUES (?,?,?)"
 
+IMPORT_TRANSACTIONS_QUERY = "INSERT INTO `transaction` (amount, description, date, account_id, category_id, " \
+                            "fingerprint) VALUES (?, ?, ?, ?, ?, ?)"
+
+SELECT_TRANSACTION_FINGERPRINTS_QUERY = "SELECT fingerprint FROM `transaction` WHERE fingerprint IN ({})"
+
 GET_CATEGORY_BY_ID_QUERY = "SELECT * FROM category WHERE id = ?  "
 GET_CATEGORY_BY_NAME_QUERY = "SELECT * FROM category WHERE name = ?  "
 CREATE_CATEGORY_QUERY = "INSERT INTO category (name) VALUES (?)"
@@ -50,23 +102,127 @@ DELETE_USER_QUERY = "DELETE FROM user WHERE login = ?"
 
 GET_USER_BY_ID_QUERY = "SELECT * FROM user WHERE id = ?"
 
-GET_USER_BY_LOGIN_SENSITIVE_QUERY = "SELECT * FROM user WHERE BINARY login = ?"
+GET_USER_BY_LOGIN_SENSITIVE_QUERY = "SELECT * FROM user WHERE login = ? AND BINARY login = ?"
 GET_USER_BY_LOGIN_QUERY = "SELECT * FROM user WHERE  login = ?"
 
 CREATE_USER_QUERY = "INSERT INTO user (login, password) VALUES (?, ?)"
 
-CREATE_ACCOUNT_QUERY = "INSERT INTO account (name,description, balance, user_id) VALUES (?, ?, ?, ?)"
+CREATE_ACCOUNT_QUERY = "INSERT INTO account (name,description, balance, opening_balance, user_id) VALUES (?, ?, ?, ?, ?)"
 
 GET_ACCOUNTS_BY_USER_QUERY = "SELECT * FROM account where user_id = ?"
 
 GET_ACCOUNT_BY_ID_QUERY = "SELECT * FROM account WHERE id = ?"
 
-UPDATE_ACCOUNT_QUERY = "UPDATE account SET name = ?, description = ?, user_id = ?, balance = ? WHERE  id = ?"
+RECOMPUTE_ACCOUNT_BALANCES_QUERY = "UPDATE account SET balance = opening_balance + COALESCE(" \
+                                   "(SELECT SUM(amount) FROM `transaction` WHERE account_id = account.id), 0), " \
+                                   "version = version + 1"
+
+UPDATE_ACCOUNT_QUERY = "UPDATE account SET name = ?, description = ?, user_id = ?, balance = ?, " \
+                       "version = version + 1 WHERE id = ? AND version = ?"
+
+ACCOUNT_ID_RANGE_QUERY = "SELECT MIN(id), MAX(id) FROM account"
+
+RECONCILE_ACCOUNT_BALANCES_QUERY = "SELECT a.id,a.balance,a.opening_balance,COALESCE(SUM(t.amount), 0),COUNT(t.id) " \
+                                   "FROM account as a left join `transaction` as t on t.account_id = a.id " \
+                                   "WHERE a.id BETWEEN ? AND ? GROUP BY a.id, a.balance, a.opening_balance"
+
+FIX_ACCOUNT_BALANCE_QUERY = "UPDATE account SET balance = opening_balance + COALESCE(" \
+                            "(SELECT SUM(amount) FROM `transaction` WHERE account_id = ?), 0), " \
+                            "version = version + 1 WHERE id = ?"
+
+ADJUST_ACCOUNT_BALANCE_QUERY = "UPDATE account SET balance = balance + ?, version = version + 1 WHERE id = ?"
+
+UPSERT_CATEGORY_MONTH_SUMMARY_QUERY = "INSERT INTO category_month_summary " \
+                                     "(account_id, category_id, `year_month`, transaction_count, amount_sum) " \
+                                     "VALUES (?, ?, ?, ?, ?) ON DUPLICATE KEY UPDATE " \
+                                     "transaction_count = transaction_count + VALUES(transaction_count), " \
+                                     "amount_sum = amount_sum + VALUES(amount_sum)"
+
+DELETE_EMPTY_CATEGORY_MONTH_SUMMARY_QUERY = "DELETE FROM category_month_summary WHERE account_id = ? " \
+                                            "AND category_id = ? AND `year_month` = ? AND transaction_count = 0"
+
+SELECT_CATEGORY_MONTH_SUMMARY_BY_ACCOUNT_QUERY = "SELECT s.`year_month`,s.transaction_count,s.amount_sum,c.id,c.name " \
+                                                 "FROM category_month_summary as s left join category as c " \
+                                                 "on c.id = s.category_id WHERE s.account_id = ? " \
+                                                 "ORDER BY s.`year_month`"
+
+CLEAR_CATEGORY_MONTH_SUMMARY_QUERY = "DELETE FROM category_month_summary"
+
+REBUILD_CATEGORY_MONTH_SUMMARY_QUERY = "INSERT INTO category_month_summary " \
+                                       "(account_id, category_id, `year_month`, transaction_count, amount_sum) " \
+                                       "SELECT account_id, COALESCE(category_id, 0), DATE_FORMAT(date, '%Y-%m'), " \
+                                       "COUNT(*), SUM(amount) FROM `transaction` " \
+                                       "GROUP BY account_id, COALESCE(category_id, 0), DATE_FORMAT(date, '%Y-%m')"
+
+CREATE_CATEGORY_RULE_QUERY = "INSERT INTO category_rule (user_id, category_id, account_id, pattern, is_regex, " \
+                             "min_amount, max_amount, priority) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+
+SELECT_CATEGORY_RULES_BY_USER_QUERY = "SELECT r.id, r.user_id, r.category_id, r.account_id, r.pattern, r.is_regex, " \
+                                      "r.min_amount, r.max_amount, r.priority, c.name FROM category_rule AS r " \
+                                      "JOIN category AS c ON c.id = r.category_id WHERE r.user_id = ? " \
+                                      "ORDER BY r.priority, r.id"
 
-LAST_ROW_QUERY = "SELECT * FROM {} ORDER BY id DESC LIMIT 1"
+UPDATE_CATEGORY_RULE_QUERY = "UPDATE category_rule SET category_id = ?, account_id = ?, pattern = ?, is_regex = ?, " \
+                             "min_amount = ?, max_amount = ?, priority = ? WHERE id = ?"
 
-LAST_ROW_FOR_TRANSACTION_QUERY = "SELECT t.id,t.amount,t.description,t.date,t.account_id,c.id,c.name FROM transaction " \
-                                 "as t left join category as c on c.id = t.category_id ORDER BY t.id DESC LIMIT 1"
+DELETE_CATEGORY_RULE_QUERY = "DELETE FROM category_rule WHERE id = ?"
+
+LAST_ROW_QUERY = "SELECT * FROM {} WHERE id = LAST_INSERT_ID()"
+
+LAST_ROW_FOR_TRANSACTION_QUERY = "SELECT t.id,t.amount,t.description,t.date,t.account_id,c.id,c.name,t.version FROM `transaction` " \
+                                 "as t left join category as c on c.id = t.category_id WHERE t.id = LAST_INSERT_ID()"
+
+SQLITE_QUERIES = {
+    GET_USER_BY_LOGIN_SENSITIVE_QUERY: "SELECT * FROM user WHERE login = ? AND login = ? COLLATE BINARY",
+    UPDATE_TRANSACTION_QUERY: "UPDATE `transaction` SET amount = ?, description = ?,"
+                              "date = datetime('now', 'localtime'), category_id = ?, version = version + 1 "
+                              "WHERE id = ? AND version = ?",
+    UPSERT_CATEGORY_MONTH_SUMMARY_QUERY: "INSERT INTO category_month_summary "
+                                         "(account_id, category_id, `year_month`, transaction_count, amount_sum) "
+                                         "VALUES (?, ?, ?, ?, ?) "
+                                         "ON CONFLICT (account_id, category_id, `year_month`) DO UPDATE SET "
+                                         "transaction_count = transaction_count + excluded.transaction_count, "
+                                         "amount_sum = amount_sum + excluded.amount_sum",
+    REBUILD_CATEGORY_MONTH_SUMMARY_QUERY: "INSERT INTO category_month_summary "
+                                          "(account_id, category_id, `year_month`, transaction_count, amount_sum) "
+                                          "SELECT account_id, COALESCE(category_id, 0), strftime('%Y-%m', date), "
+                                          "COUNT(*), SUM(amount) FROM `transaction` "
+                                          "GROUP BY account_id, COALESCE(category_id, 0), strftime('%Y-%m', date)",
+    LAST_ROW_QUERY: "SELECT * FROM {} WHERE id = last_insert_rowid()",
+    LAST_ROW_FOR_TRANSACTION_QUERY: "SELECT t.id,t.amount,t.description,t.date,t.account_id,c.id,c.name,t.version "
+                                    "FROM `transaction` as t left join category as c on c.id = t.category_id "
+                                    "WHERE t.id = last_insert_rowid()",
+}
+
+DIALECT_QUERIES = {
+    "mysql": {},
+    "sqlite": SQLITE_QUERIES,
+}
+
+# Open ends of a date range, within what DATETIME columns hold on every backend.
+HISTORY_START = datetime.datetime(1000, 1, 1)
+HISTORY_END = datetime.datetime(9999, 12, 31, 23, 59, 59)
+
+# Constant name of every query, used as its id in the query statistics.
+QUERY_IDS = {value: name for name, value in list(globals().items())
+             if name.endswith("_QUERY") and isinstance(value, str)}
+
+# Reads whose first parameter is the account id, cached per account.
+ACCOUNT_SCOPED_QUERIES = {"SELECT_TRANSACTIONS_BY_ACCOUNT_QUERY", "SELECT_FILTERED_TRANSACTIONS_QUERY", "SELECT_CATEGORY_MONTH_SUMMARY_BY_ACCOUNT_QUERY",
+                          "SELECT_RUNNING_BALANCE_QUERY", "SELECT_DAILY_BALANCE_QUERY"}
+
+# Last-row reads depend on the connection; reconciliation and import probes read rows once and shouldn't
+# evict the rest.
+UNCACHED_QUERIES = {"LAST_ROW_QUERY", "LAST_ROW_FOR_TRANSACTION_QUERY", "RECONCILE_ACCOUNT_BALANCES_QUERY",
+                    "SELECT_TRANSACTION_FINGERPRINTS_QUERY"}
+
+# Fingerprints per IN probe, under SQLite's 999 parameters of older versions.
+FINGERPRINT_PROBE_SIZE = 500
+
+
+class ConflictError(Exception):
+    # An update found the row at another version than the one it was read at, or gone.
+    pass
 
 
 class ParamType(Enum):
@@ -81,9 +237,8 @@ T = TypeVar('T')
 class ARepository(Generic[T], ABC):
 
     def __init__(self):
-        logger.add("logs/application.log", rotation="500 MB", level="INFO")
-        self.connection = DataSource.get_connection()
-        self.cursor = self.connection.cursor()
+        self.backend = DataSource.get_backend()
+        self.queries = DIALECT_QUERIES[self.backend.dialect]
 
     @abstractmethod
     def create(self, item: T) -> T:
@@ -101,12 +256,131 @@ class ARepository(Generic[T], ABC):
     def delete(self, item: T) -> None:
         pass
 
+    def translate(self, query: str) -> str:
+        return self.queries.get(query, query)
+
+    def run(self, query: str, params: tuple, consume, query_id: str = None, reading: bool = False,
+            scope: int = None):
+        # consume(cursor) returns (result, row count). Reads go through the result cache, writes bump the
+        # versions of the tables they change; scope is the account a transaction table write belongs to.
+        cache = ResultCache.get_instance()
+        sql = self.translate(query)
+        query_id = query_id or QUERY_IDS.get(query, ADHOC_QUERY_ID)
+        with DataSource.acquire() as connection:
+            if not cache.enabled:
+                return self.run_statement(connection, sql, params, consume, query_id)
+            in_transaction = self.backend.in_transaction(connection)
+            if not reading:
+                result = self.run_statement(connection, sql, params, consume, query_id)
+                cache.written(sql, scope, in_transaction)
+                return result
+            # Inside a transaction a read may see uncommitted rows; see UNCACHED_QUERIES for the others.
+            if in_transaction or query_id in UNCACHED_QUERIES:
+                return self.run_statement(connection, sql, params, consume, query_id)
+            key = (sql, params)
+            entry = cache.get(key)
+            if entry is not None:
+                return list(entry[0]) if isinstance(entry[0], list) else entry[0]
+            dependencies = cache.dependencies(sql, params[0] if query_id in ACCOUNT_SCOPED_QUERIES else None)
+            result = self.run_statement(connection, sql, params, consume, query_id)
+            cache.put(key, result, dependencies)
+            return list(result) if isinstance(result, list) else result
+
+    @staticmethod
+    def run_statement(connection, sql: str, params: tuple, consume, query_id: str):
+        # The cursor belongs to the calling thread's connection and is only used for the duration of one operation.
+        statistics = QueryStatistics.get_instance()
+        recorder = WorkloadRecorder.get_instance()
+        if not (statistics.enabled or recorder.enabled):
+            return DataSource.execute_statement(connection, sql, params, consume)[0]
+        started = time.perf_counter()
+        result, rows = DataSource.execute_statement(connection, sql, params, consume)
+        elapsed = time.perf_counter() - started
+        if statistics.enabled:
+            statistics.record(query_id, elapsed, rows, sql)
+        if recorder.enabled:
+            recorder.record(query_id, sql, params, started, elapsed, rows)
+        return result
+
+    def execute(self, query: str, params: tuple = (), query_id: str = None, scope: int = None) -> int:
+        return self.run(query, params, lambda cursor: (cursor.rowcount, max(cursor.rowcount, 0)), query_id,
+                        scope=scope)
+
+    def execute_many(self, query: str, rows: List[tuple], query_id: str = None, scope: int = None) -> int:
+        # One executemany per batch; pyodbc's fast_executemany sends it as a single parameter array.
+        if not rows:
+            return 0
+        sql = self.translate(query)
+        query_id = query_id or QUERY_IDS.get(query, ADHOC_QUERY_ID)
+        statistics = QueryStatistics.get_instance()
+        recorder = WorkloadRecorder.get_instance()
+        with DataSource.acquire() as connection:
+            cursor = connection.cursor()
+            if hasattr(cursor, "fast_executemany"):
+                cursor.fast_executemany = True
+            try:
+                started = time.perf_counter()
+                cursor.executemany(sql, rows)
+                elapsed = time.perf_counter() - started
+            finally:
+                cursor.close()
+            if statistics.enabled:
+                statistics.record(query_id, elapsed, len(rows), sql)
+            if recorder.enabled:
+                # Replayed row by row, each with its share of the batch time.
+                for row in rows:
+                    recorder.record(query_id, sql, row, started, elapsed / len(rows), 1)
+            cache = ResultCache.get_instance()
+            if cache.enabled:
+                cache.written(sql, scope, self.backend.in_transaction(connection))
+        return len(rows)
+
+    def fetch_one(self, query: str, params: tuple = (), query_id: str = None):
+        def consume(cursor):
+            result = cursor.fetchone()
+            # Finish the statement so it doesn't hold a read snapshot open.
+            cursor.fetchall()
+            return result, 0 if result is None else 1
+
+        return self.run(query, params, consume, query_id, reading=True)
+
+    def fetch_all(self, query: str, params: tuple = (), query_id: str = None) -> List:
+        def consume(cursor):
+            result = cursor.fetchall()
+            return result, len(result)
+
+        return self.run(query, params, consume, query_id, reading=True)
+
+    @contextmanager
+    def transaction(self):
+        with DataSource.acquire() as connection:
+            if self.backend.in_transaction(connection):
+                yield
+                return
+            recorder = WorkloadRecorder.get_instance()
+            self.backend.begin(connection)
+            if recorder.enabled:
+                recorder.mark("BEGIN")
+            cache = ResultCache.get_instance()
+            try:
+                yield
+                self.backend.commit(connection)
+                if recorder.enabled:
+                    recorder.mark("COMMIT")
+            except Exception:
+                self.backend.rollback(connection)
+                if recorder.enabled:
+                    recorder.mark("ROLLBACK")
+                raise
+            finally:
+                if cache.enabled:
+                    cache.transaction_ended()
+
     def get_last_row(self, table) -> T:
         if table == "transaction":
-            self.cursor.execute(LAST_ROW_FOR_TRANSACTION_QUERY)
+            result = self.fetch_one(LAST_ROW_FOR_TRANSACTION_QUERY)
         else:
-            self.cursor.execute(LAST_ROW_QUERY.format(table))
-        result = self.cursor.fetchone()
+            result = self.fetch_one(self.translate(LAST_ROW_QUERY).format(table), query_id="LAST_ROW_QUERY")
         item = self.parse(result)
         return item
 
@@ -119,73 +393,99 @@ class ARepository(Generic[T], ABC):
 class UserRepository(ARepository[User]):
 
     def create(self, user: User) -> User:
-        self.cursor.execute(CREATE_USER_QUERY, (user.login, user.password))
-        return self.get_last_row("user")
+        with self.transaction():
+            self.execute(CREATE_USER_QUERY, (user.login, user.password))
+            return self.get_last_row("user")
 
     def get_by_param(self, param: str | int, case_sensitive:bool = False) -> User | None:
 
         if isinstance(param, int):
-            self.cursor.execute(GET_USER_BY_ID_QUERY, (param,))
+            result = self.fetch_one(GET_USER_BY_ID_QUERY, (param,))
         elif isinstance(param, str):
             if case_sensitive:
-                self.cursor.execute(GET_USER_BY_LOGIN_SENSITIVE_QUERY, (param,))
+                result = self.fetch_one(GET_USER_BY_LOGIN_SENSITIVE_QUERY, (param, param))
             else:
-                self.cursor.execute(GET_USER_BY_LOGIN_QUERY, (param,))
+                result = self.fetch_one(GET_USER_BY_LOGIN_QUERY, (param,))
         else:
             logger.error(f"There is no  such option for this type")
             return None
-        result = self.cursor.fetchone()
         user = self.parse(result)
         return user
 
     def update(self, user: User) -> User:
-        self.cursor.execute(UPDATE_USER_QUERY, (user.login, user.password
+        self.execute(UPDATE_USER_QUERY, (user.login, user.password
                                                 , user.id,))
         return self.get_by_param(user.id)
 
     def delete(self, user: User) -> None:
-        self.cursor.execute(DELETE_USER_QUERY, (user.login,))
+        self.execute(DELETE_USER_QUERY, (user.login,))
 
     @staticmethod
     def parse(user: str) -> User | None:
         if user is None:
             return None
-        return User(id=int(user[0]), login=user[1], password=user[2], balance=float(user[3]))
+        return User(id=int(user[0]), login=user[1], password=user[2], balance=DataValidation.to_decimal(user[3]))
 
 
 class AccountRepository(ARepository[Account]):
 
     def create(self, account: Account) -> Account:
-        self.cursor.execute(CREATE_ACCOUNT_QUERY,
-                            (account.name, account.description, account.balance, account.user.id))
+        with self.transaction():
+            self.execute(CREATE_ACCOUNT_QUERY,
+                         (account.name, account.description, account.balance, account.opening_balance,
+                          account.user.id))
 
-        return self.get_last_row("account")
+            return self.get_last_row("account")
 
     def get_by_param(self, item: User | int) -> Account | List[Account] | None:
         if isinstance(item, User):
-            self.cursor.execute(GET_ACCOUNTS_BY_USER_QUERY, (item.id,))
-            result = self.cursor.fetchall()
+            result = self.fetch_all(GET_ACCOUNTS_BY_USER_QUERY, (item.id,))
             accounts = []
 
             for account in result:
                 accounts.append(self.parse(account))
             return accounts
         elif isinstance(item, int):
-            self.cursor.execute(GET_ACCOUNT_BY_ID_QUERY, (item,))
+            result = self.fetch_one(GET_ACCOUNT_BY_ID_QUERY, (item,))
         else:
             logger.error(f"There is no such option for this type")
             return None
-        result = self.cursor.fetchone()
         account = self.parse(result)
         return account
 
+    def get_owner_id(self, account_id: int) -> int | None:
+        # The id of the user an account belongs to, without reading the user.
+        result = self.fetch_one(GET_ACCOUNT_BY_ID_QUERY, (account_id,))
+        return int(result[3]) if result else None
+
     def update(self, account: Account) -> Account:
-        self.cursor.execute(UPDATE_ACCOUNT_QUERY, (
-            account.name, account.description, account.user.id, account.balance, account.id,))
+        updated = self.execute(UPDATE_ACCOUNT_QUERY, (
+            account.name, account.description, account.user.id, account.balance, account.id, account.version))
+        if updated == 0:
+            raise ConflictError(f"Account {account.name} was changed or deleted meanwhile, reload it and try again")
+        return self.get_by_param(account.id)
+
+    def adjust_balance(self, account: Account, amount) -> Account:
+        # Applied in the database, so concurrent transactions on one account never lose each other's amounts.
+        if self.execute(ADJUST_ACCOUNT_BALANCE_QUERY, (amount, account.id)) == 0:
+            raise ConflictError(f"Account {account.name} was deleted meanwhile")
         return self.get_by_param(account.id)
 
     def delete(self, account: Account) -> None:
-        self.cursor.execute(DELETE_ACCOUNT_QUERY, (account.id,))
+        self.execute(DELETE_ACCOUNT_QUERY, (account.id,))
+
+    def recompute_balances(self) -> int:
+        return self.execute(RECOMPUTE_ACCOUNT_BALANCES_QUERY)
+
+    def get_id_range(self) -> tuple:
+        return tuple(self.fetch_one(ACCOUNT_ID_RANGE_QUERY))
+
+    def get_ledger_sums(self, first_id: int, last_id: int) -> List[tuple]:
+        # (account id, balance, opening balance, sum of the transactions, transaction count) per account.
+        return self.fetch_all(RECONCILE_ACCOUNT_BALANCES_QUERY, (first_id, last_id))
+
+    def fix_balance(self, account_id: int) -> int:
+        return self.execute(FIX_ACCOUNT_BALANCE_QUERY, (account_id, account_id))
 
     @staticmethod
     def parse(account: str) -> Account | None:
@@ -194,33 +494,40 @@ class AccountRepository(ARepository[Account]):
         user_repository = UserRepository()
         user = user_repository.get_by_param(int(account[3]))
         return Account(id=int(account[0]), name=account[1], description=account[2], user=user,
-                       balance=float(account[4]))
+                       balance=DataValidation.to_decimal(account[4]),
+                       opening_balance=DataValidation.to_decimal(account[5]), version=int(account[6]))
 
 
 class CategoryRepository(ARepository[Category]):
 
     def create(self, category: Category) -> Category:
-        self.cursor.execute(CREATE_CATEGORY_QUERY, (category.name,))
-        return self.get_last_row("category")
+        with self.transaction():
+            self.execute(CREATE_CATEGORY_QUERY, (category.name,))
+            return self.get_last_row("category")
 
     def get_by_param(self, item: int | str) -> Category | None:
+        result = None
         if isinstance(item, int):
-            self.cursor.execute(GET_CATEGORY_BY_ID_QUERY, (item,))
+            result = self.fetch_one(GET_CATEGORY_BY_ID_QUERY, (item,))
         elif isinstance(item, str):
-            self.cursor.execute(GET_CATEGORY_BY_NAME_QUERY, (item,))
+            result = self.fetch_one(GET_CATEGORY_BY_NAME_QUERY, (item,))
         else:
             logger.error(f"There is no such option for this type")
-        result = self.cursor.fetchone()
         category = self.parse(result)
         logger.info(result)
         return category
 
     def update(self, category: Category) -> Category:
-        self.cursor.execute(UPDATE_CATEGORY_QUERY, (category.name, category.id,))
+        self.execute(UPDATE_CATEGORY_QUERY, (category.name, category.id,))
         return self.get_by_param(category.id)
 
     def delete(self, category: Category) -> None:
-        self.cursor.execute(DELETE_CATEGORY_QUERY, (category.id,))
+        # ON DELETE CASCADE takes the category's transactions along, so the balances lose their amounts and
+        # the monthly summary its rows.
+        with self.transaction():
+            self.execute(SUBTRACT_CATEGORY_FROM_BALANCES_QUERY, (category.id, category.id))
+            self.execute(DELETE_CATEGORY_QUERY, (category.id,))
+            self.execute(DELETE_CATEGORY_MONTH_SUMMARY_BY_CATEGORY_QUERY, (category.id,))
 
     @staticmethod
     def parse(category: str) -> Category | None:
@@ -232,26 +539,23 @@ class CategoryRepository(ARepository[Category]):
 class UserHasCategoryRepository(ARepository[UserCategory]):
 
     def create(self, user_category: UserCategory) -> bool:
-        self.cursor.execute(CREATE_NEW_CATEGORY_QUERY,
+        self.execute(CREATE_NEW_CATEGORY_QUERY,
                             (user_category.user.id, user_category.category.id))
         return True
 
     def get_by_param(self, item: User | Category | List) -> List[Category]:
         if isinstance(item, User):
-            self.cursor.execute(SELECT_USERS_CATEGORIES_QUERY, (item.id,))
-            result = self.cursor.fetchall()
+            result = self.fetch_all(SELECT_USERS_CATEGORIES_QUERY, (item.id,))
             categories = []
             for category in result:
                 categories.append(self.parse(category))
             return categories
         elif isinstance(item, Category):
-            self.cursor.execute(SELECT_CATEGORY_COUNT_QUERY, (item.id,))
-            return self.cursor.fetchone()
+            return self.fetch_one(SELECT_CATEGORY_COUNT_QUERY, (item.id,))
         elif isinstance(item, List):
-            self.cursor.execute(
+            return self.fetch_one(
                 IS_USER_HAS_CATEGORY_QUERY,
                 (item[0].id, item[1].id, item[1].name))
-            return self.cursor.fetchone()
 
         else:
             logger.error(f"There is no such option for this type")
@@ -261,7 +565,7 @@ class UserHasCategoryRepository(ARepository[UserCategory]):
         return None
 
     def delete(self, user_category: UserCategory) -> None:
-        self.cursor.execute(DELETE_USER_HAS_CATEGORY_QUERY,
+        self.execute(DELETE_USER_HAS_CATEGORY_QUERY,
                             (user_category.user.id, user_category.category.id))
 
     @staticmethod
@@ -269,32 +573,139 @@ class UserHasCategoryRepository(ARepository[UserCategory]):
         return CategoryRepository.parse(item_representation)
 
 
+class CategoryRuleRepository(ARepository[CategoryRule]):
+
+    def create(self, rule: CategoryRule) -> CategoryRule:
+        with self.transaction():
+            self.execute(CREATE_CATEGORY_RULE_QUERY, self.values(rule))
+            created = self.get_last_row("category_rule")
+        created.user, created.category, created.account = rule.user, rule.category, rule.account
+        return created
+
+    def get_by_param(self, user: User) -> List[CategoryRule]:
+        # In the order they apply; the accounts are the user's, read once.
+        accounts = {account.id: account for account in AccountRepository().get_by_param(user)}
+        rules = []
+        for row in self.fetch_all(SELECT_CATEGORY_RULES_BY_USER_QUERY, (user.id,)):
+            rule = self.parse(row)
+            rule.user = user
+            rule.account = accounts.get(rule.account.id) if rule.account else None
+            rules.append(rule)
+        return rules
+
+    def update(self, rule: CategoryRule) -> CategoryRule:
+        self.execute(UPDATE_CATEGORY_RULE_QUERY, self.values(rule)[1:] + (rule.id,))
+        return rule
+
+    def delete(self, rule: CategoryRule) -> None:
+        self.execute(DELETE_CATEGORY_RULE_QUERY, (rule.id,))
+
+    @staticmethod
+    def values(rule: CategoryRule) -> tuple:
+        return (rule.user.id, rule.category.id, rule.account.id if rule.account else None, rule.pattern,
+                int(rule.is_regex), rule.min_amount, rule.max_amount, rule.priority)
+
+    @staticmethod
+    def parse(rule: str) -> CategoryRule | None:
+        # The last-row read has the table's columns, the listing adds the category name.
+        if rule is None:
+            return None
+        amounts = [None if value is None else DataValidation.to_decimal(value) for value in (rule[6], rule[7])]
+        return CategoryRule(id=int(rule[0]), user=None,
+                            category=Category(id=int(rule[2]), name=rule[9] if len(rule) > 9 else None),
+                            account=Account(id=int(rule[3]), name=None, user=None) if rule[3] is not None else None,
+                            pattern=rule[4], is_regex=bool(rule[5]), min_amount=amounts[0], max_amount=amounts[1],
+                            priority=int(rule[8]))
+
+
+class CategoryMonthSummaryRepository(ARepository[CategoryMonthSummary]):
+    UNCATEGORIZED_ID = 0
+
+    def create(self, summary: CategoryMonthSummary) -> CategoryMonthSummary:
+        category_id = summary.category.id if summary.category else self.UNCATEGORIZED_ID
+        self.execute(UPSERT_CATEGORY_MONTH_SUMMARY_QUERY,
+                            (summary.account.id, category_id, summary.year_month,
+                             summary.transaction_count, summary.amount_sum), scope=summary.account.id)
+        if summary.transaction_count < 0:
+            self.execute(DELETE_EMPTY_CATEGORY_MONTH_SUMMARY_QUERY,
+                                (summary.account.id, category_id, summary.year_month), scope=summary.account.id)
+        return summary
+
+    def apply(self, transaction: Transaction, sign: int) -> CategoryMonthSummary:
+        return self.create(CategoryMonthSummary(account=transaction.account, category=transaction.category,
+                                                year_month=transaction.date.strftime("%Y-%m"),
+                                                transaction_count=sign, amount_sum=sign * transaction.amount))
+
+    def get_by_param(self, account: Account) -> List[CategoryMonthSummary]:
+        summaries = []
+        for row in self.fetch_all(SELECT_CATEGORY_MONTH_SUMMARY_BY_ACCOUNT_QUERY, (account.id,)):
+            summary = self.parse(row)
+            summary.account = account
+            summaries.append(summary)
+        return summaries
+
+    def update(self, item: T) -> T:
+        logger.error(f"There is no such option for this type")
+        return None
+
+    def delete(self, item: T) -> None:
+        logger.error(f"There is no such option for this type")
+
+    def rebuild(self) -> None:
+        with self.transaction():
+            self.execute(CLEAR_CATEGORY_MONTH_SUMMARY_QUERY)
+            self.execute(REBUILD_CATEGORY_MONTH_SUMMARY_QUERY)
+        logger.info("Category month summary rebuilt")
+
+    @staticmethod
+    def parse(summary: str) -> CategoryMonthSummary | None:
+        if summary is None:
+            return None
+        category = Category(id=int(summary[3]), name=summary[4]) if summary[3] is not None else None
+        return CategoryMonthSummary(account=None, year_month=summary[0], transaction_count=int(summary[1]),
+                                    amount_sum=DataValidation.to_decimal(summary[2]), category=category)
+
+
 class TransactionRepository(ARepository[Transaction]):
+    def __init__(self):
+        super().__init__()
+        self.summary_repository = CategoryMonthSummaryRepository()
+
     def create(self, transaction: Transaction) -> Transaction:
-        if transaction.category is None:
-            self.cursor.execute(
-                CREATE_TRANSACTION_WITHOUT_CATEGORY_QUERY, (transaction.amount,
-                                                            transaction.description,
-                                                            transaction.account.id
-                                                            ))
-        else:
-            self.cursor.execute(
-                CREATE_TRANSACTION_QUERY, (transaction.amount,
-                                           transaction.description,
-                                           transaction.account.id,
-                                           transaction.category.id
-                                           ))
-        return self.get_last_row("transaction")
-
-    def get_by_param(self, item: int | Account) -> Transaction | List[Transaction]:
-        if isinstance(item, int):
-            self.cursor.execute(SELECT_TRANSACTION_BY_ID_QUERY, (item,))
-            result = self.cursor.fetchone()
+        with self.transaction():
+            if transaction.category is None:
+                self.execute(
+                    CREATE_TRANSACTION_WITHOUT_CATEGORY_QUERY, (transaction.amount,
+                                                                transaction.description,
+                                                                transaction.account.id
+                                                                ), scope=transaction.account.id)
+            else:
+                self.execute(
+                    CREATE_TRANSACTION_QUERY, (transaction.amount,
+                                               transaction.description,
+                                               transaction.account.id,
+                                               transaction.category.id
+                                               ), scope=transaction.account.id)
+            transactiondb = self.get_last_row("transaction")
+            transactiondb.account = transaction.account
+            self.summary_repository.apply(transactiondb, 1)
+        return transactiondb
+
+    def get_by_param(self, item: int | Account | TransactionFilter) -> Transaction | List[Transaction]:
+        if isinstance(item, TransactionFilter):
+            query, params = self.build_filter_query(item)
+            transactions = []
+            for transaction in self.fetch_all(query, params, query_id="SELECT_FILTERED_TRANSACTIONS_QUERY"):
+                parsed_transaction = self.parse(transaction)
+                parsed_transaction.account = item.account
+                transactions.append(parsed_transaction)
+            return transactions
+        elif isinstance(item, int):
+            result = self.fetch_one(SELECT_TRANSACTION_BY_ID_QUERY, (item,))
             transaction = self.parse(result)
             return transaction
         elif isinstance(item, Account):
-            self.cursor.execute(SELECT_TRANSACTIONS_BY_ACCOUNT_QUERY, (item.id,))
-            result = self.cursor.fetchall()
+            result = self.fetch_all(SELECT_TRANSACTIONS_BY_ACCOUNT_QUERY, (item.id,))
             transactions = []
 
             for transaction in result:
@@ -303,14 +714,97 @@ class TransactionRepository(ARepository[Transaction]):
                 transactions.append(parsed_transaction)
             return transactions
 
-    def update(self, transaction: Transaction) -> Transaction:
-        self.cursor.execute(UPDATE_TRANSACTION_QUERY, (transaction.amount,
-                                                       transaction.description,
-                                                       transaction.category.id,transaction.id))
-        return self.get_by_param(transaction.id)
+    @staticmethod
+    def build_filter_query(transaction_filter: TransactionFilter) -> tuple:
+        conditions = ""
+        params = [transaction_filter.account.id]
+        if transaction_filter.date_from is not None:
+            conditions += TRANSACTION_FILTER_CONDITIONS["date_from"]
+            params.append(transaction_filter.date_from)
+        if transaction_filter.date_to is not None:
+            conditions += TRANSACTION_FILTER_CONDITIONS["date_to"]
+            params.append(transaction_filter.date_to)
+        if transaction_filter.categories:
+            conditions += TRANSACTION_FILTER_CONDITIONS["categories"].format(
+                ",".join("?" * len(transaction_filter.categories)))
+            params.extend(category.id for category in transaction_filter.categories)
+        if transaction_filter.min_amount is not None:
+            conditions += TRANSACTION_FILTER_CONDITIONS["min_amount"]
+            params.append(transaction_filter.min_amount)
+        if transaction_filter.max_amount is not None:
+            conditions += TRANSACTION_FILTER_CONDITIONS["max_amount"]
+            params.append(transaction_filter.max_amount)
+        if transaction_filter.text:
+            conditions += TRANSACTION_FILTER_CONDITIONS["text"]
+            escaped = transaction_filter.text.replace("!", "!!").replace("%", "!%").replace("_", "!_")
+            params.append(f"%{escaped}%")
+        order = TRANSACTION_SORT_ORDERS[transaction_filter.sort_order]
+        return SELECT_FILTERED_TRANSACTIONS_QUERY.format(conditions, order), tuple(params)
+
+    def insert_many(self, account: Account, rows: List[tuple]) -> int:
+        # rows: (amount, description, date, category id, fingerprint); the caller updates the balance and
+        # the summary.
+        return self.execute_many(IMPORT_TRANSACTIONS_QUERY,
+                                 [(amount, description, date, account.id, category_id, fingerprint)
+                                  for amount, description, date, category_id, fingerprint in rows],
+                                 scope=account.id)
+
+    def get_existing_fingerprints(self, fingerprints: List[str]) -> set:
+        # One unique-index probe per batch. The last fingerprint pads the final batch, so every probe has
+        # the same text and reuses one prepared statement.
+        existing = set()
+        query = SELECT_TRANSACTION_FINGERPRINTS_QUERY.format(", ".join("?" * FINGERPRINT_PROBE_SIZE))
+        for start in range(0, len(fingerprints), FINGERPRINT_PROBE_SIZE):
+            batch = fingerprints[start:start + FINGERPRINT_PROBE_SIZE]
+            batch += batch[-1:] * (FINGERPRINT_PROBE_SIZE - len(batch))
+            existing.update(row[0] for row in self.fetch_all(query, tuple(batch),
+                                                             query_id="SELECT_TRANSACTION_FINGERPRINTS_QUERY"))
+        return existing
+
+    def get_balance_history(self, account: Account, date_from: datetime.datetime = None,
+                            date_to: datetime.datetime = None, by_day: bool = False) -> List[tuple]:
+        # (date, balance) after every transaction, or at the end of every day with transactions. The window
+        # runs over the date range only, starting from the balance the account had before it.
+        date_from = date_from or HISTORY_START
+        date_to = date_to or HISTORY_END
+        query = SELECT_DAILY_BALANCE_QUERY if by_day else SELECT_RUNNING_BALANCE_QUERY
+        return self.fetch_all(query, (account.id, date_from, account.id, account.id, date_from, date_to))
+
+    def get_account_id(self, transaction_id: int) -> int | None:
+        result = self.fetch_one(SELECT_TRANSACTION_BY_ID_QUERY, (transaction_id,))
+        return int(result[4]) if result else None
 
-    def delete(self, transaction: Transaction) -> None:
-        self.cursor.execute(DELETE_TRANSACTION_QUERY, (transaction.id,))
+    def update(self, transaction: Transaction) -> Transaction:
+        with self.transaction():
+            previous = self.get_by_param(transaction.id)
+            if previous is None:
+                raise ConflictError("The transaction was deleted meanwhile, reload it and try again")
+            previous.account = transaction.account
+            updated = self.execute(UPDATE_TRANSACTION_QUERY, (transaction.amount,
+                                                              transaction.description,
+                                                              transaction.category.id
+                                                              if transaction.category else None,
+                                                              transaction.id,
+                                                              transaction.version),
+                                   scope=transaction.account.id)
+            if updated == 0:
+                raise ConflictError("The transaction was changed or deleted meanwhile, reload it and try again")
+            transactiondb = self.get_by_param(transaction.id)
+            transactiondb.account = transaction.account
+            self.summary_repository.apply(previous, -1)
+            self.summary_repository.apply(transactiondb, 1)
+        return transactiondb
+
+    def delete(self, transaction: Transaction) -> Transaction | None:
+        # Returns the row as it was stored, None if it was already gone.
+        with self.transaction():
+            previous = self.get_by_param(transaction.id)
+            self.execute(DELETE_TRANSACTION_QUERY, (transaction.id,),
+                         scope=transaction.account.id if transaction.account else None)
+            if previous:
+                previous.account = transaction.account
+                self.summary_repository.apply(previous, -1)
+        return previous
 
     @staticmethod
     def parse(transaction: str) -> Transaction | None:
@@ -318,9 +812,10 @@ class TransactionRepository(ARepository[Transaction]):
             return None
 
         if not (transaction[5] and transaction[6]):
-            return Transaction(id=int(transaction[0]), account=None, amount=float(transaction[1]),
-                               description=transaction[2],
-                               date=transaction[3])
+            return Transaction(id=int(transaction[0]), account=None,
+                               amount=DataValidation.to_decimal(transaction[1]), description=transaction[2],
+                               date=transaction[3], version=int(transaction[7]))
         category = Category(id=int(transaction[5]), name=transaction[6])
-        return Transaction(id=int(transaction[0]), amount=float(transaction[1]), description=transaction[2],
-                           date=transaction[3], account=None, category=category)
+        return Transaction(id=int(transaction[0]), amount=DataValidation.to_decimal(transaction[1]),
+                           description=transaction[2], date=transaction[3], account=None, category=category,
+                           version=int(transaction[7]))
@@ -0,0 +1,166 @@
+import os
+import re
+import sys
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+from loguru import logger
+
+# Per-table scopes: reads of these tables filtered by one account depend only on that account's writes.
+SCOPED_TABLES = {"transaction", "category_month_summary"}
+
+# Deleting a row of the key table removes rows of these tables through ON DELETE CASCADE.
+CASCADE_TABLES = {
+    "user": ("account", "user_has_category", "transaction", "category_month_summary", "category_rule"),
+    "account": ("transaction", "category_month_summary", "category_rule"),
+    "category": ("user_has_category", "transaction", "category_rule"),
+}
+
+READ_TABLES_PATTERN = re.compile(r"\b(?:FROM|JOIN)\s+`?(\w+)`?", re.IGNORECASE)
+
+WRITE_TABLE_PATTERN = re.compile(r"^\s*(INSERT\s+INTO|UPDATE|DELETE\s+FROM)\s+`?(\w+)`?", re.IGNORECASE)
+
+DEFAULT_CACHE_MB = 32
+
+
+def result_size(result) -> int:
+    # Rough footprint of fetched rows, good enough to bound the cache.
+    if isinstance(result, list):
+        return sys.getsizeof(result) + sum(result_size(row) for row in result)
+    if result is None:
+        return 0
+    try:
+        return sys.getsizeof(result) + sum(sys.getsizeof(value) for value in result)
+    except TypeError:
+        return sys.getsizeof(result)
+
+
+class ResultCache:
+    # Read-through cache of fetched rows keyed by SQL and parameters. Every entry remembers the version
+    # of each table (or account scope of a table) it was read from; writes bump those versions, and an
+    # entry whose versions moved on is dropped when it is next looked up.
+    __instance = None
+
+    def __init__(self, max_bytes: int = None):
+        if ResultCache.__instance is not None:
+            raise Exception("Singleton class, use get_instance() to obtain an instance.")
+        from logic.datasource import DataSource
+
+        if max_bytes is None:
+            # Other processes writing to a server or a database file would go unnoticed, so it's opt-in there.
+            default = 0 if DataSource.get_backend().shared else DEFAULT_CACHE_MB
+            max_bytes = int(float(os.environ.get("BUDGET_RESULT_CACHE_MB", default)) * 1024 * 1024)
+        self.max_bytes = max_bytes
+        self.enabled = max_bytes > 0
+        self.entries = OrderedDict()
+        self.size = 0
+        self.versions: Dict[tuple, int] = {}
+        self.table_cache: Dict[str, Tuple] = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+        if self.enabled:
+            logger.info(f"Query result cache enabled, {max_bytes // 1024} KB")
+
+    @staticmethod
+    def get_instance():
+        if ResultCache.__instance is None:
+            ResultCache.__instance = ResultCache()
+        return ResultCache.__instance
+
+    def read_tables(self, sql: str) -> Tuple:
+        tables = self.table_cache.get(sql)
+        if tables is None:
+            tables = self.table_cache[sql] = tuple(sorted(set(READ_TABLES_PATTERN.findall(sql))))
+        return tables
+
+    def dependencies(self, sql: str, scope: int = None) -> Tuple:
+        # Unscoped writes bump the table epoch, which invalidates every scope of the table at once.
+        keys = []
+        for table in self.read_tables(sql):
+            if scope is not None and table in SCOPED_TABLES:
+                keys.append((table, "epoch"))
+                keys.append((table, scope))
+            else:
+                keys.append((table, None))
+        with self.lock:
+            return tuple((key, self.versions.get(key, 0)) for key in keys)
+
+    def get(self, key: tuple):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            result, dependencies, size = entry
+            if any(self.versions.get(dependency, 0) != version for dependency, version in dependencies):
+                del self.entries[key]
+                self.size -= size
+                self.stale += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: tuple, result, dependencies: Tuple) -> None:
+        size = result_size(result)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous[2]
+            self.entries[key] = (result, dependencies, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, _, evicted) = self.entries.popitem(last=False)
+                self.size -= evicted
+                self.evictions += 1
+
+    def bump(self, table: str, scope: int = None) -> None:
+        with self.lock:
+            keys = [(table, None)]
+            if table in SCOPED_TABLES:
+                keys.append((table, scope) if scope is not None else (table, "epoch"))
+            for key in keys:
+                self.versions[key] = self.versions.get(key, 0) + 1
+
+    def written(self, sql: str, scope: int = None, in_transaction: bool = False) -> None:
+        match = WRITE_TABLE_PATTERN.match(sql)
+        if match is None:
+            return
+        writes = [(match.group(2), scope)]
+        if match.group(1).upper().startswith("DELETE"):
+            writes.extend((table, None) for table in CASCADE_TABLES.get(match.group(2), ()))
+        if in_transaction:
+            # Applied again once the transaction ends, so nobody caches what was read before the commit.
+            self.deferred().extend(writes)
+        for table, table_scope in writes:
+            self.bump(table, table_scope)
+
+    def deferred(self) -> List:
+        if not hasattr(self.local, "writes"):
+            self.local.writes = []
+        return self.local.writes
+
+    def transaction_ended(self) -> None:
+        writes, self.local.writes = self.deferred(), []
+        for table, scope in writes:
+            self.bump(table, scope)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"enabled": self.enabled, "entries": len(self.entries), "bytes": self.size,
+                    "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses, "stale": self.stale,
+                    "evictions": self.evictions, "hit_rate": self.hits / lookups if lookups else 0.0}
@@ -1,15 +1,32 @@
 from typing import List
 
-from matplotlib import pyplot as plt
-
 from logic.repositories import UserRepository, AccountRepository, CategoryRepository, UserHasCategoryRepository, \
-    TransactionRepository
+    TransactionRepository, CategoryMonthSummaryRepository, CategoryRuleRepository, ConflictError
 from loguru import logger
+from logic.analytics import UNCATEGORIZED_NAME, balance_history_from_rows, to_float, downsample
+from logic.datasource import DataSource
+from logic.querystats import QueryStatistics
+from logic.resultcache import ResultCache
 from logic.datavalidation import DataValidation
-from logic.entities import User, Account, Category, UserCategory, Transaction
+from logic.events import publish, TransactionCreated, TransactionUpdated, TransactionDeleted, AccountChanged, \
+    CategoryChanged, TransactionsImported, CREATED, DELETED
+from logic.entities import User, Account, Category, UserCategory, Transaction, CategoryMonthSummary, \
+    TransactionFilter, SortOrder, CategoryRule
+from logic.categorizer import RuleMatcher, get_matcher, forget_matchers, validate_pattern
+from logic.importer import IMPORT_FORMATS, StatementImporter
 
 import csv
+import datetime
 import os
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+
+RECONCILE_CHUNK_SIZE = 1000
+
+# Points handed to matplotlib per series, about one per pixel column of a full-width chart.
+MAX_PLOT_POINTS = 2000
+
+RECONCILE_WORKERS = 4
 
 
 class UserService:
@@ -96,6 +113,7 @@ class UserService:
         if not self.is_user_exists(user.login):
             return False, f"User {user.login} doesn't exist"
         self.user_repository.delete(user)
+        forget_matchers(user.id)
         return True, f"User {user.login} successfully deleted"
 
     def is_user_exists(self, login: str, case_sensitive: bool = False) -> bool:
@@ -125,23 +143,24 @@ class UserService:
             category.id = self.category_service.get_category_by_name(name).id
             if self.is_user_has_category(user, category):
                 return False, f"Category {category.name} exists"
-            return self.user_category_repository.create(
-                UserCategory(user=user, category=category)), "Successfully created category"
         else:
             success, message = self.category_service.create(category.name)
-            if success:
-                return \
-                    self.user_category_repository.create(
-                        UserCategory(user=user, category=message)), "Successfully created category"
-            return False, message
+            if not success:
+                return False, message
+            category = message
+        result = self.user_category_repository.create(UserCategory(user=user, category=category))
+        publish(CategoryChanged(category, CREATED, user))
+        return result, "Successfully created category"
 
     def delete_category_from_user(self, user: User, category: Category):
         categorydb = self.category_service.get_category_by_name(category.name)
         user_category = UserCategory(user=user, category=categorydb)
         self.user_category_repository.delete(user_category)
+        publish(CategoryChanged(categorydb, DELETED, user))
 
         if self.category_service.get_category_count(category) == 0:
             self.category_service.delete(categorydb)
+            forget_matchers()
 
 
 class AccountService:
@@ -149,18 +168,22 @@ class AccountService:
     def __init__(self):
         self.account_repository = AccountRepository()
         self.transaction_repository = TransactionRepository()
+        self.summary_repository = CategoryMonthSummaryRepository()
+        self.rule_repository = CategoryRuleRepository()
 
     def create(self, name: str, user: User, balance: str = "0", description: str = ""):
         if not name:
             return False, "Name can't be null "
-        if not DataValidation.isfloat(balance):
+        if not DataValidation.isdecimal(balance):
             return False, f"Wrong format of balance"
-        current = float(balance)
+        current = DataValidation.to_decimal(balance)
         logger.info(f"Creating account with name {name}...")
         if self.is_account_exists(name, user):
             return False, f"Account {name} exists"
-        account = Account(name=name, user=user, balance=current, description=description)
-        return True, self.account_repository.create(account)
+        account = self.account_repository.create(Account(name=name, user=user, balance=current,
+                                                         description=description))
+        publish(AccountChanged(account, CREATED))
+        return True, account
 
     def get_user_accounts(self, user: User) -> object:
         return self.account_repository.get_by_param(user)
@@ -175,33 +198,46 @@ class AccountService:
         if account.name == name and account.description == description and account.balance == balance:
             return False, "Credentials must be changed to update"
         logger.info("Updating account...")
+        # Changes go to a copy, the caller's account stays as it was read if the update conflicts.
+        changed = Account(name=account.name, user=account.user, balance=account.balance, id=account.id,
+                          description=account.description, opening_balance=account.opening_balance,
+                          version=account.version)
         if name:
             if self.is_account_exists(name, account.user):
                 return False, "Account with name {name} exist"
-            account.name = name
+            changed.name = name
             logger.info("Name updated")
         if description:
-            account.description = description
+            changed.description = description
             logger.info("Description updated")
+        correction = None
         if balance:
-            if not DataValidation.isfloat(balance):
+            if not DataValidation.isdecimal(balance):
                 return False, "Error format"
-            correction = float(balance) - account.balance
-
-            success, transaction = self.create_transaction(amount=str(correction), account=account,
-                                                           description="Correction")
-            if not success:
-                return False, "Error while correcting"
-
+            correction = DataValidation.to_decimal(balance) - account.balance
+            changed.balance = account.balance + correction
+        try:
+            # The version check makes sure the correction is relative to the balance the user saw.
+            with self.account_repository.transaction():
+                changed = self.account_repository.update(changed)
+                if correction is not None:
+                    transactiondb = self.transaction_repository.create(
+                        Transaction(amount=correction, account=changed, description="Correction"))
+        except ConflictError as error:
+            logger.warning(str(error))
+            return False, str(error)
+        if correction is not None:
             logger.info("Balance updated")
-            return True, self.account_repository.get_by_param(account.id)
-        else:
-            return True, self.account_repository.update(account)
+            publish(TransactionCreated(transactiondb))
+        publish(AccountChanged(changed))
+        return True, changed
 
     def delete(self, account: Account):
         if not self.is_account_exists(account.name, account.user):
             return False, f"Account {account.name} doesn't exist"
         self.account_repository.delete(account)
+        forget_matchers(account.user.id)
+        publish(AccountChanged(account, DELETED))
         return True, f"Account {account.name} successfully deleted"
 
     def is_account_exists(self, name: str, user: User) -> bool:
@@ -219,48 +255,100 @@ class AccountService:
         logger.info(f"Creating transaction...")
         if not amount:
             return False, f"Amount can't be null"
-        if not DataValidation.isfloat(amount):
-            return False, "Amount must be float"
-        transactiondb = self.transaction_repository.create(
-            Transaction(amount=float(amount), account=account, description=description, category=category))
-        account.balance = account.balance + transactiondb.amount
-        self.account_repository.update(account=account)
+        if not DataValidation.isdecimal(amount):
+            return False, "Amount must be a number"
+        amount = DataValidation.to_decimal(amount)
+        if category is None:
+            category = self.get_rule_matcher(account.user).match(description, amount, account.id)
+        try:
+            with self.transaction_repository.transaction():
+                transactiondb = self.transaction_repository.create(
+                    Transaction(amount=amount, account=account, description=description, category=category))
+                self.follow(account, self.account_repository.adjust_balance(account, transactiondb.amount))
+        except ConflictError as error:
+            return False, str(error)
+        publish(TransactionCreated(transactiondb))
+        publish(AccountChanged(account))
 
         return True, transactiondb
 
+    def get_rule_matcher(self, user: User) -> RuleMatcher:
+        if user is None:
+            return RuleMatcher([])
+        return get_matcher(user.id, lambda: self.rule_repository.get_by_param(user))
+
+    @staticmethod
+    def follow(account: Account, accountdb: Account) -> Account:
+        # Callers keep using the account object they passed in, so it takes the stored balance and version.
+        account.balance = accountdb.balance
+        account.version = accountdb.version
+        return accountdb
+
     def update_balance(self, account, balance):
         account.balance = balance
         return self.account_repository.update(account)
 
     def delete_transaction(self, transaction: Transaction):
-        self.transaction_repository.delete(transaction)
-        return self.update_balance(account=transaction.account,
-                                   balance=transaction.account.balance - transaction.amount)
+        account = transaction.account
+        with self.transaction_repository.transaction():
+            previous = self.transaction_repository.delete(transaction)
+            if previous is not None:
+                account = self.follow(account, self.account_repository.adjust_balance(account, -previous.amount))
+        publish(TransactionDeleted(transaction))
+        publish(AccountChanged(account))
+        return account
 
     def update_transaction(self, transaction: Transaction, amount: str = None, description: str = None,
                            category: Category = None):
         if not (amount or description or category):
             return False, f"Credentials can't be null"
-        if amount and not DataValidation.isfloat(amount):
-            return False, "Amount must be float"
-        if amount:
-            if not DataValidation.isfloat(amount):
-                return False, "Amount must be float"
-            famount = float(amount)
-            correction = famount - transaction.amount
-            transaction.amount = famount
-            transaction.account.balance = transaction.account.balance + correction
-            self.account_repository.update(transaction.account)
-        if description:
-            transaction.description = description
-        if category:
-            transaction.category = category
-
-        return True, self.transaction_repository.update(transaction)
+        if amount and not DataValidation.isdecimal(amount):
+            return False, "Amount must be a number"
+        changed = Transaction(amount=DataValidation.to_decimal(amount) if amount else transaction.amount,
+                              account=transaction.account, id=transaction.id,
+                              description=description or transaction.description, date=transaction.date,
+                              category=category or transaction.category, version=transaction.version)
+        correction = changed.amount - transaction.amount
+        try:
+            # Past the version check the stored amount is the one the caller read, so the correction holds.
+            with self.transaction_repository.transaction():
+                changed = self.transaction_repository.update(changed)
+                if correction:
+                    self.follow(transaction.account,
+                                self.account_repository.adjust_balance(transaction.account, correction))
+        except ConflictError as error:
+            logger.warning(str(error))
+            return False, str(error)
+        publish(TransactionUpdated(changed))
+        if correction:
+            publish(AccountChanged(changed.account))
+        return True, changed
 
     def get_account_transactions(self, account: Account):
         return self.transaction_repository.get_by_param(account)
 
+    def get_filtered_transactions(self, account: Account, date_from: str = "", date_to: str = "",
+                                  categories: List[Category] = None, min_amount: str = "", max_amount: str = "",
+                                  text: str = "", sort_order: SortOrder = SortOrder.DATE_DESC):
+        if not account:
+            return False, "Choose the account"
+        for date in (date_from, date_to):
+            if date and not DataValidation.isdate(date):
+                return False, "Date must be in YYYY-MM-DD format"
+        for amount in (min_amount, max_amount):
+            if amount and not DataValidation.isdecimal(amount):
+                return False, "Amount must be a number"
+        start = datetime.datetime.strptime(date_from, "%Y-%m-%d") if date_from else None
+        end = datetime.datetime.strptime(date_to, "%Y-%m-%d").replace(hour=23, minute=59, second=59) \
+            if date_to else None
+        transaction_filter = TransactionFilter(
+            account=account, date_from=start, date_to=end, categories=categories,
+            min_amount=DataValidation.to_decimal(min_amount) if min_amount else None,
+            max_amount=DataValidation.to_decimal(max_amount) if max_amount else None,
+            text=text, sort_order=sort_order)
+        logger.info(f"Filtering transactions of account {account.name}...")
+        return True, self.transaction_repository.get_by_param(transaction_filter)
+
     def create_csv_file(self, account):
         filename = f"{account.name}_transactions.csv"
         path = "exports"
@@ -268,6 +356,9 @@ class AccountService:
             os.makedirs(path)
 
         file_path = fr"{path}/{filename}"
+        self.write_transactions_csv(account, file_path)
+
+    def write_transactions_csv(self, account, file_path: str):
         with open(file_path, 'w', newline='') as file:
             writer = csv.writer(file, delimiter=',')
 
@@ -278,24 +369,146 @@ class AccountService:
                     [id, transaction.category.name if transaction.category else "None", transaction.amount,
                      transaction.date, transaction.description])
                 id += 1
-
-    def generate_average_transactions_plot(self, account):
+        return True, f"{id - 1} transactions written to {file_path}"
+
+    def write_transactions_parquet(self, account, file_path: str):
+        try:
+            import pyarrow
+            from pyarrow import parquet
+        except ImportError:
+            return False, "Parquet export needs pyarrow"
         transactions = self.get_account_transactions(account)
-        categories = {}
-        averages = []
+        table = pyarrow.table({
+            "id": pyarrow.array(range(1, len(transactions) + 1), pyarrow.int64()),
+            "category": [transaction.category.name if transaction.category else "None"
+                         for transaction in transactions],
+            "amount": pyarrow.array([transaction.amount for transaction in transactions], pyarrow.decimal128(19, 4)),
+            "date": pyarrow.array([transaction.date for transaction in transactions], pyarrow.timestamp("s")),
+            "description": [transaction.description for transaction in transactions],
+        })
+        parquet.write_table(table, file_path)
+        return True, f"{len(transactions)} transactions written to {file_path}"
+
+    def recompute_balances(self) -> int:
+        logger.info("Recomputing account balances from their transactions...")
+        return self.account_repository.recompute_balances()
+
+    def reconcile_balances(self, fix: bool = False, workers: int = RECONCILE_WORKERS,
+                           chunk_size: int = RECONCILE_CHUNK_SIZE) -> dict:
+        # Compares every stored balance with opening_balance + SUM(amount), one grouped query per range of
+        # chunk_size account ids, so memory only holds a chunk and the drifted accounts. Ranges are spread
+        # over worker threads, each on its own pooled connection.
+        first_id, last_id = self.account_repository.get_id_range()
+        report = {"accounts": 0, "transactions": 0, "drifted": [], "fixed": 0}
+        if first_id is None:
+            return report
+        ranges = [(start, min(start + chunk_size - 1, last_id)) for start in range(first_id, last_id + 1, chunk_size)]
+        workers = max(1, min(workers, DataSource.get_instance().pool.max_size, len(ranges)))
+        logger.info(f"Reconciling accounts {first_id}..{last_id} in {len(ranges)} chunk(s) on {workers} worker(s)")
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="reconcile") as executor:
+            for accounts, transactions, drifted in executor.map(lambda bounds: self.reconcile_range(*bounds, fix),
+                                                                ranges):
+                report["accounts"] += accounts
+                report["transactions"] += transactions
+                report["drifted"].extend(drifted)
+        for drift in report["drifted"]:
+            if drift["fixed"]:
+                report["fixed"] += 1
+                publish(AccountChanged(self.account_repository.get_by_param(drift["account_id"])))
+        return report
+
+    def reconcile_range(self, first_id: int, last_id: int, fix: bool) -> tuple:
+        accounts = transactions = 0
+        drifted = []
+        for account_id, balance, opening_balance, amount_sum, count in \
+                self.account_repository.get_ledger_sums(first_id, last_id):
+            accounts += 1
+            transactions += count
+            # SQLite sums DECIMAL columns as floats, the quantizing makes both sides exact again.
+            balance = DataValidation.to_decimal(balance)
+            expected = DataValidation.to_decimal(opening_balance) + DataValidation.to_decimal(amount_sum)
+            if balance == expected:
+                continue
+            logger.warning(f"Account {account_id} balance {balance} drifted from {expected}")
+            # Recomputed in the database, transactions added since the check are counted as well.
+            fixed = fix and self.account_repository.fix_balance(account_id) > 0
+            drifted.append({"account_id": account_id, "balance": balance, "expected": expected,
+                            "drift": balance - expected, "transactions": count, "fixed": fixed})
+        return accounts, transactions, drifted
+
+    def import_statement(self, account: Account, file_path: str, file_format: str = None, mapping: dict = None):
+        # CSV (our export or a column mapping), OFX or QIF; the format follows the extension unless given.
+        if not account:
+            return False, "Choose the account"
+        if not file_path or not os.path.isfile(file_path):
+            return False, f"File {file_path} doesn't exist"
+        if file_format and file_format not in IMPORT_FORMATS:
+            return False, f"Format must be one of {', '.join(IMPORT_FORMATS)}"
+        importer = StatementImporter(account, UserHasCategoryRepository().get_by_param(account.user),
+                                     self.get_rule_matcher(account.user))
+        try:
+            report = importer.import_file(file_path, file_format, mapping)
+        except (ValueError, UnicodeDecodeError, ConflictError) as error:
+            logger.warning(f"Import of {file_path} failed: {error}")
+            return False, str(error)
+        if report["imported"]:
+            self.follow(account, importer.account)
+            publish(TransactionsImported(account, report["imported"]))
+            publish(AccountChanged(account))
+        return True, report
+
+    def get_category_month_summary(self, account: Account) -> List[CategoryMonthSummary]:
+        return self.summary_repository.get_by_param(account)
+
+    def rebuild_category_month_summary(self):
+        logger.info("Rebuilding category month summary...")
+        self.summary_repository.rebuild()
+
+    def get_average_by_category(self, account: Account) -> List[tuple]:
+        # Served from the monthly rollup like the CLI report, no transaction rows are read.
+        totals = {}
+        for summary in self.get_category_month_summary(account):
+            name = summary.category.name if summary.category else UNCATEGORIZED_NAME
+            count, amount_sum = totals.get(name, (0, Decimal(0)))
+            totals[name] = (count + summary.transaction_count, amount_sum + summary.amount_sum)
+        averages = [(name, float(amount_sum / count)) for name, (count, amount_sum) in totals.items() if count > 0]
+        return sorted(averages, key=lambda item: -item[1])
+
+    def get_balance_history(self, account: Account, date_from: datetime.datetime = None,
+                            date_to: datetime.datetime = None, by_day: bool = False):
+        # (dates, balances in money units) as NumPy arrays.
+        return balance_history_from_rows(
+            self.transaction_repository.get_balance_history(account, date_from, date_to, by_day))
+
+    def generate_balance_history_plot(self, account, date_from: str = "", date_to: str = ""):
+        if not account:
+            return False, "Choose the account"
+        for date in (date_from, date_to):
+            if date and not DataValidation.isdate(date):
+                return False, "Date must be in YYYY-MM-DD format"
+        from matplotlib import pyplot as plt
+
+        start = datetime.datetime.strptime(date_from, "%Y-%m-%d") if date_from else None
+        end = datetime.datetime.strptime(date_to, "%Y-%m-%d").replace(hour=23, minute=59, second=59) \
+            if date_to else None
+        dates, balances = self.get_balance_history(account, start, end)
+        if len(dates) == 0:
+            return False, "No transactions in this period"
+        # However long the history, the chart gets a bounded number of points that keep its shape.
+        plotted_dates, plotted_balances = downsample(dates, balances, MAX_PLOT_POINTS)
 
-        for transaction in transactions:
-            category = transaction.category.name if transaction.category else "None"
-            if category in categories:
-                categories[category].append(transaction.amount)
-            else:
-                categories[category] = [transaction.amount]
+        plt.figure(figsize=(10, 6))
+        plt.step(plotted_dates, to_float(plotted_balances), where="post")
+        plt.xlabel("Date")
+        plt.ylabel("Balance")
+        plt.title(f"Balance of {account.name}")
+        plt.show()
+        return True, f"{len(plotted_dates)} of {len(dates)} point(s) plotted"
 
-        for category, amounts in categories.items():
-            average = sum(amounts) / len(amounts)
-            averages.append((category, average))
+    def generate_average_transactions_plot(self, account):
+        from matplotlib import pyplot as plt
 
-        averages.sort(key=lambda x: x[1], reverse=True)
+        averages = self.get_average_by_category(account)
         categories = [item[0] for item in averages]
         averages = [item[1] for item in averages]
 
@@ -313,6 +526,7 @@ class CategoryService:
     def __init__(self):
         self.category_repository = CategoryRepository()
         self.user_has_category_repository = UserHasCategoryRepository()
+        self.rule_repository = CategoryRuleRepository()
 
     def create(self, name):
         logger.info(f"Creating category with name {name}...")
@@ -340,12 +554,14 @@ class CategoryService:
             category.name = name
             logger.info("Name updated")
 
-        return True, self.category_repository.update(category)
+        category = self.category_repository.update(category)
+        publish(CategoryChanged(category))
+        return True, category
 
     def delete(self, category: Category):
         if not self.is_category_exist(category.name):
             return False, f"Category {category.name} doesn't exist"
-        self.delete(category)
+        self.category_repository.delete(category)
         return True, f"Category {category.name} successfully deleted"
 
     def is_category_exist(self, name: str) -> bool:
@@ -355,8 +571,72 @@ class CategoryService:
         else:
             return False
 
-    def get_category_count(self, category: Category):
-        return self.user_has_category_repository.get_by_param(category)
+    def get_category_count(self, category: Category) -> int:
+        # Number of users who have the category.
+        result = self.user_has_category_repository.get_by_param(category)
+        return result[0] if result else 0
+
+    def get_rules(self, user: User) -> List[CategoryRule]:
+        return self.rule_repository.get_by_param(user)
+
+    def add_rule(self, user: User, category: Category, pattern: str = "", is_regex: bool = False,
+                 min_amount: str = None, max_amount: str = None, account: Account = None, priority: int = 0):
+        # Transactions created or imported without a category get the one of the first rule they match.
+        success, message = self.check_rule(pattern, is_regex, min_amount, max_amount)
+        if not success:
+            return False, message
+        if not (pattern or min_amount or max_amount or account):
+            return False, "The rule needs a pattern, an amount range or an account"
+        logger.info(f"Adding rule {pattern!r} for category {category.name}...")
+        rule = self.rule_repository.create(CategoryRule(
+            user=user, category=category, pattern=pattern or "", is_regex=is_regex,
+            min_amount=DataValidation.to_decimal(min_amount) if min_amount else None,
+            max_amount=DataValidation.to_decimal(max_amount) if max_amount else None,
+            account=account, priority=priority))
+        forget_matchers(user.id)
+        return True, rule
+
+    def update_rule(self, rule: CategoryRule, category: Category = None, pattern: str = None, is_regex: bool = None,
+                    min_amount: str = None, max_amount: str = None, account: Account = None, priority: int = None):
+        # Left out arguments keep their values; an empty string clears a pattern or a bound.
+        pattern = rule.pattern if pattern is None else pattern
+        is_regex = rule.is_regex if is_regex is None else is_regex
+        min_amount = rule.min_amount if min_amount is None else min_amount
+        max_amount = rule.max_amount if max_amount is None else max_amount
+        # A bound of 0 is a bound too.
+        min_amount, max_amount = (None if bound is None or bound == "" else str(bound)
+                                  for bound in (min_amount, max_amount))
+        success, message = self.check_rule(pattern, is_regex, min_amount, max_amount)
+        if not success:
+            return False, message
+        changed = CategoryRule(
+            user=rule.user, category=category or rule.category, pattern=pattern, is_regex=is_regex,
+            min_amount=DataValidation.to_decimal(min_amount) if min_amount is not None else None,
+            max_amount=DataValidation.to_decimal(max_amount) if max_amount is not None else None,
+            account=account or rule.account, priority=rule.priority if priority is None else priority, id=rule.id)
+        changed = self.rule_repository.update(changed)
+        forget_matchers(rule.user.id)
+        return True, changed
+
+    def delete_rule(self, rule: CategoryRule):
+        self.rule_repository.delete(rule)
+        forget_matchers(rule.user.id if rule.user else None)
+        return True, "Rule deleted"
+
+    @staticmethod
+    def check_rule(pattern: str, is_regex: bool, min_amount: str = None, max_amount: str = None):
+        if pattern and len(pattern) > 255:
+            return False, "Pattern is too long"
+        if pattern:
+            error = validate_pattern(pattern, is_regex)
+            if error:
+                return False, error
+        for bound in (min_amount, max_amount):
+            if bound is not None and bound != "" and not DataValidation.isdecimal(bound):
+                return False, "Amount must be a number"
+        if min_amount and max_amount and DataValidation.to_decimal(min_amount) > DataValidation.to_decimal(max_amount):
+            return False, "Minimum amount is above the maximum"
+        return True, None
 
 
 class TransactionDetailsService:
@@ -377,3 +657,15 @@ class TransactionDetailsService:
         if transaction.category is not None:
             str += f"Category:  {transaction.category.name} \n"
         return str
+
+
+class DiagnosticsService:
+
+    def get_result_cache_stats(self) -> dict:
+        return ResultCache.get_instance().stats()
+
+    def get_statement_stats(self) -> dict:
+        return DataSource.get_statement_stats()
+
+    def get_query_report(self) -> List[dict]:
+        return QueryStatistics.get_instance().report()
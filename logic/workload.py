@@ -0,0 +1,247 @@
+import atexit
+import datetime
+import gzip
+import json
+import os
+import threading
+import time
+from decimal import Decimal
+from typing import Dict, List
+
+import numpy as np
+from loguru import logger
+
+from logic.backends import ABackend
+
+WORKLOAD_VERSION = 1
+
+TRANSACTION_MARKERS = ("BEGIN", "COMMIT", "ROLLBACK")
+
+# Recordings get shared for replays, so password hashes are written as this placeholder (as long as a
+# SHA-256 hex digest, so replayed rows keep their size).
+REDACTED_PASSWORD = "0" * 64
+
+# Positions of the password hash among the parameters; other statements naming the column have every
+# parameter redacted.
+PASSWORD_PARAMETERS = {"CREATE_USER_QUERY": (1,), "UPDATE_USER_QUERY": (1,)}
+
+
+def encode_parameter(value):
+    if isinstance(value, Decimal):
+        return {"$d": str(value)}
+    if isinstance(value, datetime.datetime):
+        return {"$t": value.isoformat()}
+    return value
+
+
+def redact_parameters(query_id: str, sql: str, params: tuple) -> tuple:
+    positions = PASSWORD_PARAMETERS.get(query_id)
+    if positions is None:
+        if "password" not in sql.lower():
+            return params
+        positions = range(len(params))
+    return tuple(REDACTED_PASSWORD if index in positions else value for index, value in enumerate(params))
+
+
+def decode_parameter(value):
+    if isinstance(value, dict):
+        if "$d" in value:
+            return Decimal(value["$d"])
+        if "$t" in value:
+            return datetime.datetime.fromisoformat(value["$t"])
+    return value
+
+
+class WorkloadRecorder:
+    # Appends every statement the repositories run to a gzipped JSON lines log: a header, one line per
+    # distinct SQL text, then [offset ms, session, statement, params, duration ms, rows] per execution
+    # and [offset ms, session, marker] for transaction boundaries. Sessions are the recording threads.
+    __instance = None
+
+    def __init__(self, path: str = None, dialect: str = None):
+        if WorkloadRecorder.__instance is not None:
+            raise Exception("Singleton class, use get_instance() to obtain an instance.")
+        self.path = path or os.environ.get("BUDGET_RECORD_WORKLOAD")
+        self.enabled = bool(self.path)
+        if not self.enabled:
+            return
+        from logic.datasource import DataSource
+
+        self.lock = threading.Lock()
+        self.statements: Dict[str, int] = {}
+        self.sessions: Dict[int, int] = {}
+        self.started = time.perf_counter()
+        self.file = gzip.open(self.path, "wt")
+        self.write({"version": WORKLOAD_VERSION, "dialect": dialect or DataSource.get_backend().dialect,
+                    "started": datetime.datetime.now().isoformat()})
+        atexit.register(self.close)
+        logger.info(f"Recording the SQL workload to {self.path}")
+
+    @staticmethod
+    def get_instance():
+        if WorkloadRecorder.__instance is None:
+            WorkloadRecorder.__instance = WorkloadRecorder()
+        return WorkloadRecorder.__instance
+
+    def write(self, entry) -> None:
+        self.file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    def offset(self, started: float) -> float:
+        return round((started - self.started) * 1000, 3)
+
+    def session(self) -> int:
+        thread = threading.get_ident()
+        if thread not in self.sessions:
+            self.sessions[thread] = len(self.sessions)
+        return self.sessions[thread]
+
+    def record(self, query_id: str, sql: str, params: tuple, started: float, seconds: float, rows: int) -> None:
+        with self.lock:
+            if self.file.closed:
+                return
+            statement = self.statements.get(sql)
+            if statement is None:
+                statement = self.statements[sql] = len(self.statements)
+                self.write({"statement": statement, "query": query_id, "sql": sql})
+            self.write([self.offset(started), self.session(), statement,
+                        [encode_parameter(value) for value in redact_parameters(query_id, sql, params)],
+                        round(seconds * 1000, 3), rows])
+
+    def mark(self, marker: str) -> None:
+        with self.lock:
+            if not self.file.closed:
+                self.write([self.offset(time.perf_counter()), self.session(), marker])
+
+    def close(self) -> None:
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+
+class WorkloadUnit:
+    # A single statement, or a whole transaction, replayed as one piece on one connection.
+    def __init__(self, offset: float, session: int) -> None:
+        self.offset = offset
+        self.session = session
+        self.in_transaction = False
+        self.events = []
+
+
+class WorkloadReplayer:
+    def __init__(self, path: str, backend: ABackend, speed: float = 1.0, concurrency: int = 4):
+        self.path = path
+        self.backend = backend
+        self.speed = speed
+        self.concurrency = concurrency
+        self.header = None
+        self.statements = {}
+        self.units: List[WorkloadUnit] = []
+        self.timings: Dict[str, list] = {}
+        self.errors: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def load(self) -> None:
+        open_units = {}
+        with gzip.open(self.path, "rt") as file:
+            for line in file:
+                entry = json.loads(line)
+                if isinstance(entry, dict):
+                    if "version" in entry:
+                        self.header = entry
+                    else:
+                        self.statements[entry["statement"]] = (entry["query"], entry["sql"])
+                    continue
+                offset, session = entry[0], entry[1]
+                unit = open_units.get(session)
+                if entry[2] == "BEGIN":
+                    unit = open_units[session] = WorkloadUnit(offset, session)
+                    unit.in_transaction = True
+                    self.units.append(unit)
+                elif entry[2] in TRANSACTION_MARKERS:
+                    if unit is not None:
+                        unit.events.append(entry[2])
+                        del open_units[session]
+                else:
+                    if unit is None:
+                        unit = WorkloadUnit(offset, session)
+                        self.units.append(unit)
+                    unit.events.append(entry)
+        if self.header is None:
+            raise ValueError(f"{self.path} is not a workload log")
+        if self.header["dialect"] != self.backend.dialect:
+            raise ValueError(f"The workload was recorded on {self.header['dialect']}, "
+                             f"it can't be replayed on {self.backend.dialect}")
+        # A transaction still open when recording stopped is dropped, its outcome is unknown.
+        for unit in open_units.values():
+            self.units.remove(unit)
+        logger.info(f"{len(self.units)} unit(s) of work loaded from {self.path}")
+
+    def run_unit(self, cursor, connection, unit: WorkloadUnit) -> None:
+        if unit.in_transaction:
+            self.backend.begin(connection)
+        failed = False
+        for event in unit.events:
+            if event == "COMMIT" and not failed:
+                self.backend.commit(connection)
+                continue
+            if event in TRANSACTION_MARKERS:
+                self.backend.rollback(connection)
+                continue
+            if failed:
+                continue
+            query_id, sql = self.statements[event[2]]
+            started = time.perf_counter()
+            try:
+                cursor.execute(sql, [decode_parameter(value) for value in event[3]])
+                if cursor.description:
+                    cursor.fetchall()
+            except Exception as error:
+                logger.warning(f"{query_id} failed on replay: {error}")
+                with self.lock:
+                    self.errors[query_id] = self.errors.get(query_id, 0) + 1
+                failed = unit.in_transaction
+                continue
+            with self.lock:
+                self.timings.setdefault(query_id, []).append((event[4], (time.perf_counter() - started) * 1000))
+
+    def run_worker(self, units: List[WorkloadUnit], started: float) -> None:
+        connection = self.backend.connect()
+        cursor = connection.cursor()
+        try:
+            for unit in units:
+                if self.speed:
+                    delay = started + unit.offset / 1000 / self.speed - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                self.run_unit(cursor, connection, unit)
+        finally:
+            cursor.close()
+
+    def replay(self) -> dict:
+        if self.header is None:
+            self.load()
+        # A session always goes to the same worker, so its statements keep their order.
+        workers = [[] for _ in range(self.concurrency)]
+        for unit in self.units:
+            workers[unit.session % self.concurrency].append(unit)
+        started = time.perf_counter()
+        threads = [threading.Thread(target=self.run_worker, args=(units, started), name=f"replay-{index}")
+                   for index, units in enumerate(workers) if units]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return {"seconds": round(time.perf_counter() - started, 3), "queries": self.report()}
+
+    def report(self) -> List[dict]:
+        summaries = []
+        for query_id in sorted(set(self.timings) | set(self.errors)):
+            timings = np.array(self.timings.get(query_id, [(0.0, 0.0)]), dtype=float)
+            recorded, replayed = timings[:, 0], timings[:, 1]
+            summaries.append({"query": query_id, "count": len(self.timings.get(query_id, [])),
+                              "errors": self.errors.get(query_id, 0),
+                              "recorded_ms": round(float(recorded.sum()), 3),
+                              "replayed_ms": round(float(replayed.sum()), 3),
+                              "recorded_p95_ms": round(float(np.percentile(recorded, 95)), 3),
+                              "replayed_p95_ms": round(float(np.percentile(replayed, 95)), 3)})
+        return sorted(summaries, key=lambda summary: summary["replayed_ms"], reverse=True)
@@ -1,39 +1,73 @@
+import asyncio
+import os
 import sys
 
 from PyQt5.QtWidgets import QApplication, QWidget, QLineEdit, QListWidget, QListWidgetItem
 from PyQt5 import QtWidgets, uic
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QObject, QThread, pyqtSignal
 
 import ui.background_rc
 
 from logic.services import *
+from logic.asyncservices import load_main_page, AsyncAccountService
+from logic.listdiff import diff_rows, INSERT, REMOVE
+from logic.querystats import is_application_record
+from logic.events import EventBus, TransactionCreated, TransactionUpdated, TransactionDeleted, AccountChanged, \
+    CategoryChanged, TransactionsImported, CREATED, DELETED
 from loguru import logger
 
+try:
+    import qasync
+except ImportError:
+    qasync = None
+
+# Category choice of a new transaction that leaves it to the categorization rules.
+NO_CATEGORY_CHOICE = "By rules"
+
+# With BUDGET_USE_DAEMON=1 the pages talk to the local service daemon instead of the database.
+USE_DAEMON = os.environ.get("BUDGET_USE_DAEMON") == "1"
+if USE_DAEMON:
+    from logic.daemon import RemoteUserService as UserService, RemoteAccountService as AccountService, \
+        RemoteCategoryService as CategoryService
+
+# The services publish their changes to the pages of this process; daemon clients don't see them.
+LOCAL_EVENTS = not USE_DAEMON
+
 
 # goto pages methods
+def leave_page(current_window):
+    # The main page is kept while other pages are shown, the change events keep it up to date.
+    widget.removeWidget(current_window)
+    if current_window is not MainPage.retained:
+        current_window.deleteLater()
+
+
 def goto_sign_up(current_window):
     createAccWindow = SignUpPage()
     widget.addWidget(createAccWindow)
 
-    widget.removeWidget(current_window)
-    current_window.deleteLater()
+    leave_page(current_window)
 
     widget.setCurrentIndex(widget.currentIndex() + 1)
 
 
 def goto_main_page(user, current_window, account=None):
-    mainWindow = MainPage(user, account)
-    widget.addWidget(mainWindow)
-    widget.removeWidget(current_window)
-    current_window.deleteLater()
-    widget.setCurrentIndex(widget.currentIndex() + 1)
+    mainWindow = MainPage.retained
+    if mainWindow is None or mainWindow.user.id != user.id:
+        mainWindow = MainPage(user, account)
+    else:
+        mainWindow.return_to(user, account)
+    if widget.indexOf(mainWindow) == -1:
+        widget.addWidget(mainWindow)
+    leave_page(current_window)
+    widget.setCurrentWidget(mainWindow)
 
 
 def goto_login_page(current_window):
+    MainPage.release()
     loginWindow = LoginPage()
     widget.addWidget(loginWindow)
-    widget.removeWidget(current_window)
-    current_window.deleteLater()
+    leave_page(current_window)
     widget.setCurrentIndex(widget.currentIndex() + 1)
 
 
@@ -46,8 +80,7 @@ def goto_user_settings(user, current_window, account=None):
 def goto_adding_new_account(user, current_window, account=None):
     addAcc = AddAccountPage(user, account)
     widget.addWidget(addAcc)
-    widget.removeWidget(current_window)
-    current_window.deleteLater()
+    leave_page(current_window)
     widget.setCurrentIndex(widget.currentIndex() + 1)
 
 
@@ -55,8 +88,7 @@ def goto_manage_account_page(current_account, user, current_window):
     if current_account:
         manageAcc = ManageAccountPage(user, current_account)
         widget.addWidget(manageAcc)
-        widget.removeWidget(current_window)
-        current_window.deleteLater()
+        leave_page(current_window)
         widget.setCurrentIndex(widget.currentIndex() + 1)
 
 
@@ -64,41 +96,79 @@ def goto_change_transaction_page(user, account, transaction, current_window):
     if transaction:
         changeTrans = ChangeTransactionPage(user, account, transaction)
         widget.addWidget(changeTrans)
-        widget.removeWidget(current_window)
-        current_window.deleteLater()
+        leave_page(current_window)
         widget.setCurrentIndex(widget.currentIndex() + 1)
 
 
 def goto_add_transaction_page(user, current_account, current_window):
     addTrans = AddTransactionPage(user, current_account)
     widget.addWidget(addTrans)
-    widget.removeWidget(current_window)
-    current_window.deleteLater()
+    leave_page(current_window)
     widget.setCurrentIndex(widget.currentIndex() + 1)
 
 
 def goto_manage_categories_page(user, current_window, account):
     manageCat = ManageCategoriesPage(user, account)
     widget.addWidget(manageCat)
-    widget.removeWidget(current_window)
-    current_window.deleteLater()
+    leave_page(current_window)
     widget.setCurrentIndex(widget.currentIndex() + 1)
 
 
 def goto_add_category_page(user, current_window, account=None):
     addCat = AddCategoryPage(user, account)
     widget.addWidget(addCat)
-    widget.removeWidget(current_window)
-    current_window.deleteLater()
+    leave_page(current_window)
     widget.setCurrentIndex(widget.currentIndex() + 1)
 
 
+def account_index(accounts, account) -> int:
+    # The account may have been deleted or renamed meanwhile; the first one is shown then.
+    return next((index for index, item in enumerate(accounts) if item.id == account.id), 0)
+
+
+class GuiDispatcher(QObject):
+    # Runs event handlers on the GUI thread whichever thread published the event.
+    call = pyqtSignal(object)
+
+    def __init__(self):
+        super(GuiDispatcher, self).__init__()
+        self.call.connect(self.run)
+
+    def run(self, function):
+        function()
+
+    def __call__(self, function):
+        if QThread.currentThread() is self.thread():
+            function()
+        else:
+            self.call.emit(function)
+
+
 class ApplicationService:
+    dispatcher = None
+
+    @staticmethod
+    def gui_dispatcher() -> GuiDispatcher:
+        if ApplicationService.dispatcher is None:
+            ApplicationService.dispatcher = GuiDispatcher()
+        return ApplicationService.dispatcher
+
     @staticmethod
     def clear_fields(list_of_lines: List[QLineEdit]):
         for elem in list_of_lines:
             elem.setText("")
 
+    @staticmethod
+    def is_async_loop_running() -> bool:
+        # The async loaders run the services on local database workers, which daemon clients don't have.
+        if qasync is None or USE_DAEMON:
+            return False
+        try:
+            asyncio.get_running_loop()
+            return True
+        except RuntimeError:
+            return False
+
 
 # Login window class
 class LoginPage(QWidget):
@@ -109,7 +179,7 @@ class LoginPage(QWidget):
         self.signInButton.clicked.connect(self.login_function)
         self.createAccButton.clicked.connect(lambda: goto_sign_up(self))
 
-        logger.add("logs/application.log", rotation="500 MB", level="INFO")
+        logger.add("logs/application.log", rotation="500 MB", level="INFO", filter=is_application_record)
         self.user_service = UserService()
 
     def login_function(self):
@@ -150,6 +220,9 @@ class SignUpPage(QWidget):
 
 
 class MainPage(QWidget):
+    # The page of the signed in user, kept between visits to the other pages.
+    retained = None
+
     def __init__(self, user, account=None):
         super(MainPage, self).__init__()
         uic.loadUi("ui/MainPage.ui", self)
@@ -173,6 +246,8 @@ class MainPage(QWidget):
                                                                                     self))
         self.generatePlotsButton.clicked.connect(lambda: self.account_service.generate_average_transactions_plot(self.current_account))
 
+        self.balanceHistoryButton.clicked.connect(self.show_balance_history)
+
         self.importToCsvButton.clicked.connect(self.import_to_csv)
 
         self.changeTransactionButton.clicked.connect(self.update_transaction)
@@ -182,19 +257,188 @@ class MainPage(QWidget):
 
         self.comboBoxAccounts.currentIndexChanged.connect(self.account_changed)
 
+        self.applyFilterButton.clicked.connect(self.apply_filter)
+        self.resetFilterButton.clicked.connect(self.reset_filter)
+
+        self.transaction_filter = None
+        self.current_transaction = None
+        self.account_transactions = []
+        self.user_accounts = []
+        self.user_categories = []
+
+        if LOCAL_EVENTS:
+            self.subscribe_to_changes()
+            MainPage.release()
+            MainPage.retained = self
+
+        if ApplicationService.is_async_loop_running():
+            asyncio.ensure_future(self.load_page(account))
+            return
+
+        self.user_categories = self.user_service.get_user_categories(self.user)
+        self.loading_filter_categories(self.user_categories)
 
         user_accounts = self.account_service.get_user_accounts(self.user)
         self.loading_user_accounts(user_accounts)
 
         if account:
-            index = user_accounts.index(account)
-            self.comboBoxAccounts.setCurrentIndex(index)
+            self.comboBoxAccounts.setCurrentIndex(account_index(user_accounts, account))
 
         if self.current_account:
             self.current_transaction = None
             self.account_transactions = self.account_service.get_account_transactions(self.current_account)
             self.current_transaction_index = -1
 
+    async def load_page(self, account):
+        # Accounts, categories and transactions are fetched concurrently on the db workers.
+        user_accounts, self.user_categories, transactions = await load_main_page(self.user, account)
+        self.loading_filter_categories(self.user_categories)
+
+        self.comboBoxAccounts.blockSignals(True)
+        self.loading_user_accounts(user_accounts)
+        if account:
+            self.comboBoxAccounts.setCurrentIndex(account_index(user_accounts, account))
+        self.comboBoxAccounts.blockSignals(False)
+
+        if not user_accounts:
+            return
+        self.current_account = user_accounts[self.comboBoxAccounts.currentIndex()]
+        if not account or account.id != self.current_account.id:
+            transactions = await AsyncAccountService().get_account_transactions(self.current_account)
+        self.show_account()
+        self.show_transactions(transactions)
+
+    def subscribe_to_changes(self):
+        bus = EventBus.get_instance()
+        dispatch = ApplicationService.gui_dispatcher()
+        subscriptions = [bus.subscribe(event_type, handler, dispatch) for event_type, handler in (
+            (TransactionCreated, self.on_transaction_created),
+            (TransactionUpdated, self.on_transaction_updated),
+            (TransactionDeleted, self.on_transaction_deleted),
+            (TransactionsImported, self.on_transactions_imported),
+            (AccountChanged, self.on_account_changed),
+            (CategoryChanged, self.on_category_changed),
+        )]
+        self.destroyed.connect(lambda *args: [subscription.cancel() for subscription in subscriptions])
+
+    @staticmethod
+    def release():
+        page = MainPage.retained
+        MainPage.retained = None
+        if page is not None:
+            widget.removeWidget(page)
+            page.deleteLater()
+
+    def return_to(self, user, account=None):
+        self.user = user
+        self.userName.setText(self.user.login)
+        if account and account in self.user_accounts and account != self.current_account:
+            self.comboBoxAccounts.setCurrentIndex(self.user_accounts.index(account))
+
+    def shows(self, account) -> bool:
+        return self.current_account is not None and account is not None and account.id == self.current_account.id
+
+    def transaction_index(self, transaction):
+        for index, shown in enumerate(self.account_transactions):
+            if shown.id == transaction.id:
+                return index
+        return None
+
+    def on_transaction_created(self, event):
+        if not self.shows(event.transaction.account):
+            return
+        if self.transaction_filter is not None:
+            # Whether and where the row shows up is decided by the filter query.
+            self.refresh_transactions()
+            return
+        self.account_transactions.append(event.transaction)
+        self.transactionsListBox.addItem(self.transaction_item(event.transaction))
+
+    def on_transaction_updated(self, event):
+        if not self.shows(event.transaction.account):
+            return
+        if self.transaction_filter is not None:
+            # The edit may move the row into or out of the filtered list, so the filter query decides.
+            self.refresh_transactions()
+            return
+        index = self.transaction_index(event.transaction)
+        if index is None:
+            return
+        self.account_transactions[index] = event.transaction
+        self.transactionsListBox.item(index).setText(TransactionDetailsService.to_string_short(event.transaction))
+        if self.current_transaction and self.current_transaction.id == event.transaction.id:
+            self.current_transaction = event.transaction
+            self.transactionDetails.setText(TransactionDetailsService.to_string_long(self.current_transaction))
+
+    def on_transaction_deleted(self, event):
+        index = self.transaction_index(event.transaction)
+        if index is None or not self.shows(event.transaction.account):
+            return
+        if self.current_transaction and self.current_transaction.id == event.transaction.id:
+            self.current_transaction = None
+            self.transactionDetails.setText("")
+        del self.account_transactions[index]
+        self.transactionsListBox.takeItem(index)
+
+    def on_transactions_imported(self, event):
+        if self.shows(event.account):
+            self.refresh_transactions()
+
+    def on_account_changed(self, event):
+        account = event.account
+        if account.user is not None and account.user.id != self.user.id:
+            return
+        if event.change == CREATED:
+            self.user_accounts.append(account)
+            self.comboBoxAccounts.addItem(account.name)
+            return
+        if account not in self.user_accounts:
+            return
+        index = self.user_accounts.index(account)
+        if event.change == DELETED:
+            del self.user_accounts[index]
+            self.comboBoxAccounts.removeItem(index)
+            return
+        self.user_accounts[index] = account
+        self.comboBoxAccounts.setItemText(index, account.name)
+        if self.shows(account):
+            self.current_account = account
+            for transaction in self.account_transactions:
+                transaction.account = account
+            self.show_account()
+
+    def on_category_changed(self, event):
+        if event.user is not None and event.user.id != self.user.id:
+            return
+        index = next((index for index, category in enumerate(self.user_categories)
+                      if category.id == event.category.id), None)
+        if event.change == CREATED:
+            if event.user is not None and index is None:
+                self.user_categories.append(event.category)
+                self.filterCategoryComboBox.addItem(event.category.name)
+            return
+        if index is None:
+            return
+        # The first entry of the filter is "All categories".
+        if event.change == DELETED:
+            del self.user_categories[index]
+            self.filterCategoryComboBox.removeItem(index + 1)
+            return
+        self.user_categories[index] = event.category
+        self.filterCategoryComboBox.setItemText(index + 1, event.category.name)
+        for row, transaction in enumerate(self.account_transactions):
+            if transaction.category and transaction.category.id == event.category.id:
+                transaction.category = event.category
+                self.transactionsListBox.item(row).setText(TransactionDetailsService.to_string_short(transaction))
+
+    def show_balance_history(self):
+        # Bounded by the dates of the filter, when they are set.
+        success, message = self.account_service.generate_balance_history_plot(
+            self.current_account, self.dateFromText.text(), self.dateToText.text())
+        if not success:
+            self.transactionDetails.setText(message)
+            logger.warning(message)
+
     def import_to_csv(self):
         self.account_service.create_csv_file(self.current_account)
 
@@ -203,32 +447,109 @@ class MainPage(QWidget):
             goto_change_transaction_page(self.user, self.current_account, self.current_transaction, self)
 
     def loading_user_accounts(self, user_accounts):
+        self.user_accounts = list(user_accounts)
         if len(user_accounts) != 0:
             for account in user_accounts:
                 self.comboBoxAccounts.addItem(account.name)
 
+    def loading_filter_categories(self, user_categories):
+        self.filterCategoryComboBox.addItem("All categories")
+        for category in user_categories:
+            self.filterCategoryComboBox.addItem(category.name)
+
+    def apply_filter(self):
+        category_index = self.filterCategoryComboBox.currentIndex()
+        self.transaction_filter = {
+            "date_from": self.dateFromText.text(),
+            "date_to": self.dateToText.text(),
+            "categories": [self.user_categories[category_index - 1]] if category_index > 0 else None,
+            "min_amount": self.minAmountText.text(),
+            "max_amount": self.maxAmountText.text(),
+            "text": self.searchText.text(),
+            "sort_order": list(SortOrder)[self.sortComboBox.currentIndex()],
+        }
+        if self.current_account:
+            self.refresh_transactions()
+
+    def reset_filter(self):
+        ApplicationService.clear_fields([self.dateFromText, self.dateToText, self.minAmountText,
+                                         self.maxAmountText, self.searchText])
+        self.filterCategoryComboBox.setCurrentIndex(0)
+        self.sortComboBox.setCurrentIndex(0)
+        self.transaction_filter = None
+        if self.current_account:
+            self.refresh_transactions()
+
+    def load_account_transactions(self):
+        if self.transaction_filter is None:
+            return self.account_service.get_account_transactions(self.current_account)
+        success, response = self.account_service.get_filtered_transactions(self.current_account,
+                                                                           **self.transaction_filter)
+        if not success:
+            self.transactionDetails.setText(response)
+            logger.warning(response)
+            return []
+        return response
+
     def refresh_transactions(self):
+        # Only rows that appeared, disappeared, moved or changed touch the list widget, so the selection
+        # and the scroll position survive the refresh.
+        transactions = self.load_account_transactions()
+        selected_id = self.current_transaction.id if self.current_transaction else None
+        self.transactionsListBox.blockSignals(True)
+        for operation, index, transaction in diff_rows(self.account_transactions, transactions):
+            if operation == REMOVE:
+                self.transactionsListBox.takeItem(index)
+            elif operation == INSERT:
+                self.transactionsListBox.insertItem(index, self.transaction_item(transaction))
+            else:
+                self.transactionsListBox.item(index).setText(TransactionDetailsService.to_string_short(transaction))
+        self.account_transactions = transactions
+        self.current_transaction = None
+        self.transactionDetails.setText("")
+        for index, transaction in enumerate(transactions):
+            if transaction.id == selected_id:
+                self.transactionsListBox.setCurrentRow(index)
+                self.current_transaction = transaction
+                self.transactionDetails.setText(TransactionDetailsService.to_string_long(transaction))
+                break
+        self.transactionsListBox.blockSignals(False)
+
+    @staticmethod
+    def transaction_item(transaction) -> QListWidgetItem:
+        item = QListWidgetItem(TransactionDetailsService.to_string_short(transaction))
+        item.setTextAlignment(Qt.AlignCenter)
+        return item
+
+    def show_transactions(self, transactions):
         self.transactionsListBox.clear()
         self.transactionDetails.setText("")
-        self.account_transactions = self.account_service.get_account_transactions(self.current_account)
+        self.account_transactions = transactions
         for transaction in self.account_transactions:
             logger.info(f"Transaction {transaction.amount} added")
-            item = QListWidgetItem(TransactionDetailsService.to_string_short(transaction))
-            item.setTextAlignment(Qt.AlignCenter)
-            self.transactionsListBox.addItem(item)
+            self.transactionsListBox.addItem(self.transaction_item(transaction))
         self.current_transaction = None
 
     def account_changed(self):
         logger.info(f"Changed account to {self.comboBoxAccounts.currentText()}")
 
-        user_accounts = self.account_service.get_user_accounts(self.user)
+        self.user_accounts = self.account_service.get_user_accounts(self.user)
+        if self.comboBoxAccounts.currentIndex() < 0:
+            self.current_account = None
+            self.accountDescription.setText("")
+            self.accountBalanceLabel.setText("")
+            self.show_transactions([])
+            return
 
-        self.current_account = user_accounts[self.comboBoxAccounts.currentIndex()]
-        self.accountDescription.setText(self.current_account.description)
-        self.accountBalanceLabel.setText("Your account balance: " + str(self.current_account.balance))
+        self.current_account = self.user_accounts[self.comboBoxAccounts.currentIndex()]
+        self.show_account()
 
         self.refresh_transactions()
 
+    def show_account(self):
+        self.accountDescription.setText(self.current_account.description)
+        self.accountBalanceLabel.setText("Your account balance: " + str(self.current_account.balance))
+
     def transaction_chosen(self):
         selected_items = self.transactionsListBox.selectedItems()
         if not selected_items:
@@ -241,9 +562,11 @@ class MainPage(QWidget):
 
     def delete_transaction(self):
         if self.current_transaction:
-            self.current_account = self.account_service.delete_transaction(self.current_transaction)
-            self.accountBalanceLabel.setText("Your account balance: " + str(self.current_account.balance))
-            self.refresh_transactions()
+            account = self.account_service.delete_transaction(self.current_transaction)
+            if not LOCAL_EVENTS:
+                self.current_account = account
+                self.show_account()
+                self.refresh_transactions()
 
 
 class UserSettingsPage(QWidget):
@@ -377,8 +700,11 @@ class ManageCategoriesPage(QWidget):
         self.addCatButton.clicked.connect(lambda: goto_add_category_page(self.user, self, self.account))
         self.deleteCategoryButton.clicked.connect(self.delete_category)
         self.submitButton.clicked.connect(self.update_category)
+        self.addRuleButton.clicked.connect(self.add_rule)
+        self.deleteRuleButton.clicked.connect(self.delete_rule)
 
         self.categoriesListBox.itemSelectionChanged.connect(self.category_chose)
+        self.category_rules = []
 
         self.CategoryNameText.setPlaceholderText("")
         self.communicateTextLabel.setText("")
@@ -395,6 +721,44 @@ class ManageCategoriesPage(QWidget):
 
         self.CategoryNameText.setPlaceholderText(self.current_category.name)
         self.communicateTextLabel.setText("")
+        self.refresh_rules()
+
+    def refresh_rules(self):
+        # The chosen category's rules; amount ranges and accounts are set with python -m logic.cli add-rule.
+        self.rulesListBox.clear()
+        self.category_rules = [rule for rule in self.category_service.get_rules(self.user)
+                               if self.current_category and rule.category.id == self.current_category.id]
+        for rule in self.category_rules:
+            text = f"/{rule.pattern}/" if rule.is_regex else rule.pattern or "Any description"
+            if rule.min_amount is not None or rule.max_amount is not None:
+                text += f" {rule.min_amount if rule.min_amount is not None else ''}..." \
+                        f"{rule.max_amount if rule.max_amount is not None else ''}"
+            item = QListWidgetItem(text)
+            item.setTextAlignment(Qt.AlignCenter)
+            self.rulesListBox.addItem(item)
+
+    def add_rule(self):
+        if not self.current_category:
+            self.communicateTextLabel.setText("Choose the category")
+            return
+        success, message = self.category_service.add_rule(self.user, self.current_category,
+                                                          self.rulePatternText.text(),
+                                                          self.ruleRegexCheckBox.isChecked())
+        if success:
+            self.refresh_rules()
+            self.communicateTextLabel.setText("")
+        else:
+            self.communicateTextLabel.setText(message)
+            logger.warning(message)
+        ApplicationService.clear_fields([self.rulePatternText])
+
+    def delete_rule(self):
+        row = self.rulesListBox.currentRow()
+        if row < 0:
+            self.communicateTextLabel.setText("Choose the rule")
+            return
+        self.category_service.delete_rule(self.category_rules[row])
+        self.refresh_rules()
 
     def refresh_categories(self):
         self.categoriesListBox.clear()
@@ -404,6 +768,7 @@ class ManageCategoriesPage(QWidget):
             item.setTextAlignment(Qt.AlignCenter)
             self.categoriesListBox.addItem(item)
         self.current_category = None
+        self.refresh_rules()
 
     def delete_category(self):
         if self.current_category:
@@ -471,18 +836,23 @@ class AddTransactionPage(QWidget):
 
         self.categoriesComboBox.currentTextChanged.connect(self.category_changed)
 
+        self.user_categories = []
         self.update_categories(self.user_service.get_user_categories(self.user))
 
     def update_categories(self, user_categories):
-        if len(user_categories) != 0:
-            for category in user_categories:
-                self.categoriesComboBox.addItem(category.name)
-            self.category_changed()
+        # The first choice leaves the category to the user's rules.
+        self.user_categories = user_categories
+        self.categoriesComboBox.blockSignals(True)
+        self.categoriesComboBox.addItem(NO_CATEGORY_CHOICE)
+        for category in user_categories:
+            self.categoriesComboBox.addItem(category.name)
+        self.categoriesComboBox.blockSignals(False)
+        self.category_changed()
 
     def category_changed(self):
         logger.info(f"Changed category to {self.categoriesComboBox.currentText()}")
-
-        self.current_category = self.user_service.get_user_categories(self.user)[self.categoriesComboBox.currentIndex()]
+        index = self.categoriesComboBox.currentIndex()
+        self.current_category = self.user_categories[index - 1] if index > 0 else None
 
     def add_transaction(self):
         success, message = self.account_service.create_transaction(self.AmountText.text(), self.TransDescrText.text(),
@@ -549,4 +919,10 @@ if __name__ == '__main__':
     widget.addWidget(startWindow)
     widget.setFixedSize(1325, 789)
     widget.show()
-    app.exec_()
+    if qasync is not None:
+        loop = qasync.QEventLoop(app)
+        asyncio.set_event_loop(loop)
+        with loop:
+            loop.run_forever()
+    else:
+        app.exec_()
@@ -0,0 +1,14 @@
+import sys
+
+from loguru import logger
+
+from logic.migrations import MigrationRunner, QueryPlanChecker
+
+if __name__ == '__main__':
+    MigrationRunner().migrate()
+    if "--check" in sys.argv:
+        unindexed = QueryPlanChecker().check()
+        if unindexed:
+            logger.error(f"Queries without index: {', '.join(unindexed)}")
+            sys.exit(1)
+        logger.success("Every repository query uses an index")
@@ -0,0 +1,7 @@
+from loguru import logger
+
+from logic.services import AccountService
+
+if __name__ == '__main__':
+    AccountService().rebuild_category_month_summary()
+    logger.success("Category month summary rebuilt")
@@ -0,0 +1,30 @@
+import argparse
+import json
+import sys
+
+from loguru import logger
+
+from logic.backends import create_backend
+from logic.workload import WorkloadReplayer
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay a workload recorded with BUDGET_RECORD_WORKLOAD against "
+                                                 "the database configured in the environment.")
+    parser.add_argument("workload", help="the recorded .jsonl.gz log")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="1 keeps the original pace, 10 runs ten times faster, 0 runs without pauses")
+    parser.add_argument("--concurrency", type=int, default=4, help="number of connections replaying in parallel")
+    parser.add_argument("--output", help="write the JSON report here")
+    args = parser.parse_args()
+
+    replayer = WorkloadReplayer(args.workload, create_backend(), speed=args.speed, concurrency=args.concurrency)
+    report = replayer.replay()
+    logger.info(f"Replayed in {report['seconds']} s")
+    for summary in report["queries"]:
+        logger.info(f"{summary['query']}: {summary['count']} run(s), {summary['errors']} error(s), "
+                    f"{summary['recorded_ms']:.1f} ms recorded, {summary['replayed_ms']:.1f} ms replayed, "
+                    f"p95 {summary['recorded_p95_ms']:.3f} -> {summary['replayed_p95_ms']:.3f} ms")
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    sys.exit(1 if any(summary["errors"] for summary in report["queries"]) else 0)
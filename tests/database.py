@@ -0,0 +1,31 @@
+import itertools
+import os
+import tempfile
+
+from logic.backends import SqliteBackend
+from logic.datasource import DataSource
+
+# The DataSource is a process-wide singleton, so every test module shares one SQLite file.
+configured = False
+
+logins = itertools.count()
+
+
+def use_test_database() -> None:
+    global configured
+    if not configured:
+        directory = tempfile.mkdtemp(prefix="budget-tests-")
+        DataSource.configure(SqliteBackend(os.path.join(directory, "tests.sqlite3")))
+        configured = True
+
+
+def create_user(prefix: str = "test"):
+    # A fresh user with the default categories and one empty account.
+    from logic.services import UserService, AccountService
+
+    user_service = UserService()
+    login = f"{prefix}_{os.getpid()}_{next(logins)}"
+    user_service.register(login, "password", "password")
+    user = user_service.get_user_by_login(login)
+    _, account = AccountService().create("Main", user, "0")
+    return user, account
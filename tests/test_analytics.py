@@ -0,0 +1,62 @@
+import unittest
+
+import numpy as np
+
+from logic.analytics import DOWNSAMPLING_MIN_POINTS, lttb_indices, minmax_indices, downsample
+
+
+class DownsamplingTest(unittest.TestCase):
+    def setUp(self):
+        generator = np.random.default_rng(3)
+        self.x = np.arange(1000, dtype=np.float64)
+        self.y = np.cumsum(generator.normal(size=1000))
+
+    def check_indices(self, selected, count, max_points):
+        self.assertEqual(selected[0], 0)
+        self.assertEqual(selected[-1], count - 1)
+        self.assertLessEqual(len(selected), max_points)
+        self.assertTrue(np.all(np.diff(selected) > 0))
+
+    def test_lttb_keeps_endpoints_in_order(self):
+        for threshold in (3, 4, 10, 99, 500):
+            self.check_indices(lttb_indices(self.x, self.y, threshold), len(self.x), threshold)
+
+    def test_lttb_keeps_short_series(self):
+        self.assertEqual(list(lttb_indices(self.x[:5], self.y[:5], 10)), [0, 1, 2, 3, 4])
+
+    def test_minmax_keeps_the_extremes_of_each_bucket(self):
+        for buckets in (1, 7, 50, 200):
+            selected = minmax_indices(self.y, buckets)
+            self.check_indices(selected, len(self.y), buckets * 2 + 2)
+            bucket = np.arange(len(self.y)) * buckets // len(self.y)
+            for number in range(buckets):
+                members = np.flatnonzero(bucket == number)
+                kept = selected[bucket[selected] == number]
+                self.assertIn(members[np.argmin(self.y[members])], kept)
+                self.assertIn(members[np.argmax(self.y[members])], kept)
+
+    def test_downsample_bounds_the_points(self):
+        dates = np.datetime64("2024-01-01") + np.arange(1000).astype("timedelta64[D]")
+        for method in DOWNSAMPLING_MIN_POINTS:
+            for max_points in (DOWNSAMPLING_MIN_POINTS[method], 25, 300):
+                x, y = downsample(dates, self.y, max_points, method)
+                self.assertLessEqual(len(x), max_points)
+                self.assertEqual((x[0], x[-1]), (dates[0], dates[-1]))
+                self.assertTrue(np.all(np.diff(x) > np.timedelta64(0, "D")))
+                self.assertEqual(len(x), len(y))
+
+    def test_downsample_leaves_short_series_alone(self):
+        x, y = downsample(self.x[:10], self.y[:10], 50)
+        self.assertEqual(list(x), list(self.x[:10]))
+        self.assertEqual(list(y), list(self.y[:10]))
+
+    def test_downsample_rejects_too_few_points(self):
+        for method, minimum in DOWNSAMPLING_MIN_POINTS.items():
+            with self.assertRaises(ValueError):
+                downsample(self.x, self.y, minimum - 1, method)
+        with self.assertRaises(ValueError):
+            downsample(self.x, self.y, 100, "average")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import re
+import unittest
+from decimal import Decimal
+
+from logic.categorizer import RuleMatcher, trie_pattern
+from logic.entities import Category, CategoryRule, Account
+
+
+def rule(name: str, pattern: str, is_regex: bool = False, priority: int = 0, id: int = None, **bounds) -> CategoryRule:
+    return CategoryRule(None, Category(name), pattern, is_regex, priority=priority, id=id, **bounds)
+
+
+def category(matcher: RuleMatcher, description: str, amount: str = "-10", account_id: int = None) -> str | None:
+    found = matcher.match(description, Decimal(amount), account_id)
+    return found.name if found else None
+
+
+class TriePatternTest(unittest.TestCase):
+    def test_shares_prefixes(self):
+        self.assertEqual(trie_pattern(["car", "card", "cards", "carwash"]), "car(?:(?:d(?:s)?|wash))?")
+
+    def test_matches_exactly_the_literals(self):
+        literals = ["car", "card", "carwash", "bus", "b.s"]
+        pattern = re.compile(trie_pattern(literals))
+        for literal in literals:
+            self.assertTrue(pattern.fullmatch(literal), literal)
+        for text in ("ca", "cars", "bas", "b"):
+            self.assertFalse(pattern.fullmatch(text), text)
+
+
+class RuleMatcherTest(unittest.TestCase):
+    def test_literals_match_anywhere_ignoring_case(self):
+        matcher = RuleMatcher([rule("Transport", "car"), rule("Cleaning", "carwash", priority=-1)])
+        self.assertEqual(category(matcher, "SHELL CARWASH 12"), "Cleaning")
+        self.assertEqual(category(matcher, "car rental"), "Transport")
+        self.assertIsNone(category(matcher, "bus ticket"))
+
+    def test_lower_priority_number_wins(self):
+        matcher = RuleMatcher([rule("Other", "", priority=9),
+                               rule("Shopping", "market", priority=5),
+                               rule("Food", r"super\s*market", True, priority=1),
+                               rule("Drinks", r"(\w)\1", True, priority=3)])
+        self.assertEqual(category(matcher, "Supermarket"), "Food")
+        self.assertEqual(category(matcher, "flea market"), "Shopping")
+        self.assertEqual(category(matcher, "coffee"), "Drinks")
+        self.assertEqual(category(matcher, "bank fee"), "Drinks")
+        self.assertEqual(category(matcher, "rent"), "Other")
+
+    def test_equal_priorities_go_by_id(self):
+        matcher = RuleMatcher([rule("Second", "shop", True, id=2), rule("First", "sho", True, id=1)])
+        self.assertEqual(category(matcher, "shop"), "First")
+
+    def test_rules_matching_at_the_same_position_all_count(self):
+        # The first regex rule matches where the second does, but not for this amount.
+        matcher = RuleMatcher([rule("Big", r"pay\w*", True, priority=1, max_amount=Decimal("-100")),
+                               rule("Small", r"pay", True, priority=2)])
+        self.assertEqual(category(matcher, "paypal", "-500"), "Big")
+        self.assertEqual(category(matcher, "paypal", "-5"), "Small")
+
+    def test_groups_inside_a_pattern_name_the_right_rule(self):
+        matcher = RuleMatcher([rule("First", r"(ta)(xi)", True, priority=1), rule("Second", r"t(a)", True, priority=2)])
+        self.assertEqual(category(matcher, "city taxi"), "First")
+        self.assertEqual(category(matcher, "tab"), "Second")
+
+    def test_amount_bounds_are_inclusive(self):
+        matcher = RuleMatcher([rule("Rent", "transfer", min_amount=Decimal("-1000"), max_amount=Decimal("-500")),
+                               rule("Income", "transfer", min_amount=Decimal("0")),
+                               rule("Zero", "fee", True, min_amount=Decimal("0"), max_amount=Decimal("0"))])
+        self.assertEqual(category(matcher, "transfer", "-1000"), "Rent")
+        self.assertEqual(category(matcher, "transfer", "-500"), "Rent")
+        self.assertIsNone(category(matcher, "transfer", "-499.99"))
+        self.assertEqual(category(matcher, "transfer", "0"), "Income")
+        self.assertEqual(category(matcher, "fee", "0"), "Zero")
+        self.assertIsNone(category(matcher, "fee", "-1"))
+
+    def test_account_restriction(self):
+        account = Account("Card", None, id=7)
+        matcher = RuleMatcher([rule("Card", "shop", account=account), rule("Any", "shop", priority=1)])
+        self.assertEqual(category(matcher, "shop", account_id=7), "Card")
+        self.assertEqual(category(matcher, "shop", account_id=8), "Any")
+
+    def test_named_groups_are_searched_separately(self):
+        matcher = RuleMatcher([rule("Ref", r"ref (?P<number>\d+)", True), rule("Shop", "shop", True, priority=1)])
+        self.assertEqual(category(matcher, "shop ref 12"), "Ref")
+        self.assertEqual(category(matcher, "shop"), "Shop")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+
+from tests.database import use_test_database, create_user
+
+
+class CategoryDeleteSummaryTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        use_test_database()
+
+    def test_deleting_a_category_drops_its_summary_rows_and_amounts(self):
+        from logic.services import UserService, AccountService
+
+        user_service, account_service = UserService(), AccountService()
+        user, account = create_user("summary")
+        user_service.add_category_user(user, f"Doomed {user.id}")
+        categories = {category.name: category for category in user_service.get_user_categories(user)}
+        doomed, food = categories[f"Doomed {user.id}"], categories["Food"]
+        account_service.create_transaction("-10", "gone", account, doomed)
+        account_service.create_transaction("-4", "kept", account, food)
+
+        user_service.delete_category_from_user(user, doomed)
+
+        self.assertEqual(account_service.get_average_by_category(account), [("Food", -4.0)])
+        names = {summary.category.name if summary.category else None
+                 for summary in account_service.get_category_month_summary(account)}
+        self.assertEqual(names, {"Food"})
+        self.assertEqual(account_service.get_account_by_id(account.id).balance, -4)
+
+
+if __name__ == '__main__':
+    unittest.main()
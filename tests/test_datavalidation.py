@@ -0,0 +1,36 @@
+import unittest
+from decimal import Decimal
+
+from logic.datavalidation import DataValidation
+
+
+class AmountValidationTest(unittest.TestCase):
+    def test_exponents_that_fit_are_amounts(self):
+        self.assertTrue(DataValidation.isdecimal("1e3"))
+        self.assertEqual(DataValidation.to_decimal("1e3"), Decimal("1000.0000"))
+        self.assertTrue(DataValidation.isdecimal("1e-9"))
+
+    def test_amounts_beyond_decimal_19_4_are_rejected(self):
+        for text in ("1e30", "1e20", "1000000000000000", "-1e15", "1e999999999"):
+            self.assertFalse(DataValidation.isdecimal(text), text)
+        self.assertTrue(DataValidation.isdecimal("999999999999999.9999"))
+
+    def test_non_numbers_are_rejected(self):
+        for text in ("abc", "", "nan", "inf", None):
+            self.assertFalse(DataValidation.isdecimal(text), text)
+
+    def test_parse_amounts_uses_the_same_bound(self):
+        self.assertEqual(DataValidation.parse_amounts(["1e30", "1,234.50", "(3.5)", "1234567890123456"]),
+                         [None, Decimal("1234.5000"), Decimal("-3.5000"), None])
+
+    def test_parse_amounts_takes_commas_only_as_thousands_separators(self):
+        self.assertEqual(DataValidation.parse_amounts(["12,50", "1,2,3,4", "1,234,567", "-1,000.5", "(2,500)"]),
+                         [None, None, Decimal("1234567.0000"), Decimal("-1000.5000"), Decimal("-2500.0000")])
+
+    def test_parse_amounts_with_decimal_comma(self):
+        self.assertEqual(DataValidation.parse_amounts(["12,50", "1.234,5", "1.2.3", "12.50"], decimal_comma=True),
+                         [Decimal("12.5000"), Decimal("1234.5000"), None, None])
+
+
+if __name__ == '__main__':
+    unittest.main()
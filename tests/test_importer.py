@@ -0,0 +1,54 @@
+import os
+import tempfile
+import unittest
+
+from tests.database import use_test_database, create_user
+
+COFFEE = "2024-03-01,-3.50,Coffee shop"
+
+
+class OccurrenceImportTest(unittest.TestCase):
+    # Identical lines of one statement are numbered, so they all go in once and only once.
+    @classmethod
+    def setUpClass(cls):
+        use_test_database()
+
+    def import_lines(self, account, *lines):
+        from logic.services import AccountService
+
+        descriptor, path = tempfile.mkstemp(suffix=".csv")
+        self.addCleanup(os.remove, path)
+        with os.fdopen(descriptor, "w") as statement:
+            statement.write("date,amount,description\n" + "\n".join(lines) + "\n")
+        ok, report = AccountService().import_statement(account, path)
+        self.assertTrue(ok, report)
+        return report
+
+    def count(self, account):
+        from logic.services import AccountService
+
+        return len(AccountService().get_account_transactions(account))
+
+    def test_identical_lines_of_one_file_all_import(self):
+        user, account = create_user("import")
+        report = self.import_lines(account, COFFEE, COFFEE)
+        self.assertEqual(report["imported"], 2)
+        self.assertEqual(self.count(account), 2)
+
+    def test_reimporting_a_file_adds_nothing(self):
+        user, account = create_user("import")
+        self.import_lines(account, COFFEE, COFFEE, "2024-03-02,-20,Groceries")
+        report = self.import_lines(account, COFFEE, COFFEE, "2024-03-02,-20,Groceries")
+        self.assertEqual(report["imported"], 0)
+        self.assertEqual(self.count(account), 3)
+
+    def test_one_more_identical_line_adds_one_row(self):
+        user, account = create_user("import")
+        self.import_lines(account, COFFEE, COFFEE)
+        report = self.import_lines(account, COFFEE, COFFEE, COFFEE)
+        self.assertEqual(report["imported"], 1)
+        self.assertEqual(self.count(account), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
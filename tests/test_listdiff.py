@@ -0,0 +1,68 @@
+import random
+import unittest
+
+from logic.listdiff import diff_rows, INSERT, REMOVE, CHANGE
+
+
+def key(row):
+    return row[0]
+
+
+def version(row):
+    return row[1]
+
+
+def apply(old, operations):
+    # Plays the edit script on a copy, the way the transactions page plays it on its list widget.
+    rows = list(old)
+    for operation, index, row in operations:
+        if operation == REMOVE:
+            del rows[index]
+        elif operation == INSERT:
+            rows.insert(index, row)
+        else:
+            rows[index] = row
+    return rows
+
+
+class DiffRowsTest(unittest.TestCase):
+    def check(self, old, new):
+        operations = diff_rows(old, new, key, version)
+        self.assertEqual(apply(old, operations), list(new))
+        return operations
+
+    def test_unchanged_rows_need_no_operations(self):
+        rows = [(1, 0), (2, 0), (3, 0)]
+        self.assertEqual(self.check(rows, list(rows)), [])
+
+    def test_insert(self):
+        operations = self.check([(1, 0), (3, 0)], [(1, 0), (2, 0), (3, 0), (4, 0)])
+        self.assertEqual(operations, [(INSERT, 1, (2, 0)), (INSERT, 3, (4, 0))])
+
+    def test_remove(self):
+        operations = self.check([(1, 0), (2, 0), (3, 0), (4, 0)], [(2, 0), (4, 0)])
+        self.assertEqual(operations, [(REMOVE, 2, None), (REMOVE, 0, None)])
+
+    def test_move_touches_only_the_moved_row(self):
+        operations = self.check([(1, 0), (2, 0), (3, 0), (4, 0)], [(2, 0), (3, 0), (4, 0), (1, 0)])
+        self.assertEqual(operations, [(REMOVE, 0, None), (INSERT, 3, (1, 0))])
+
+    def test_change(self):
+        operations = self.check([(1, 0), (2, 0), (3, 0)], [(1, 0), (2, 1), (3, 0)])
+        self.assertEqual(operations, [(CHANGE, 1, (2, 1))])
+
+    def test_random_edits_match_a_rebuild(self):
+        generator = random.Random(7)
+        for _ in range(300):
+            old = [(row_id, generator.randrange(2)) for row_id in generator.sample(range(30), generator.randrange(15))]
+            new = [row for row in old if generator.random() > 0.3]
+            new = [(row_id, row_version + (generator.random() < 0.2)) for row_id, row_version in new]
+            for row_id in generator.sample(range(30, 40), generator.randrange(4)):
+                new.insert(generator.randrange(len(new) + 1), (row_id, 0))
+            if len(new) > 1 and generator.random() < 0.5:
+                new.insert(generator.randrange(len(new)), new.pop(generator.randrange(len(new))))
+            self.check(old, new)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import unittest
+from unittest import mock
+
+from logic.resultcache import ResultCache
+from tests.database import use_test_database, create_user
+
+
+class ResultCacheTest(unittest.TestCase):
+    # The cache is a process-wide singleton (off for the SQLite test file), so each test swaps in its own.
+    @classmethod
+    def setUpClass(cls):
+        use_test_database()
+
+    def use_cache(self, max_bytes: int = None) -> ResultCache:
+        swap = mock.patch.object(ResultCache, "_ResultCache__instance", None)
+        swap.start()
+        self.addCleanup(swap.stop)
+        cache = ResultCache(max_bytes)
+        ResultCache._ResultCache__instance = cache
+        return cache
+
+    def test_a_write_bumps_the_version_and_evicts_stale_reads(self):
+        from logic.services import AccountService
+
+        cache = self.use_cache(1024 * 1024)
+        account_service = AccountService()
+        user, account = create_user("cache")
+        account_service.create_transaction("-10", "first", account, None)
+
+        self.assertEqual(len(account_service.get_account_transactions(account)), 1)
+        self.assertEqual(len(account_service.get_account_transactions(account)), 1)
+        self.assertGreater(cache.hits, 0)
+        version = cache.versions.get(("transaction", account.id), 0)
+
+        account_service.create_transaction("-5", "second", account, None)
+
+        self.assertGreater(cache.versions[("transaction", account.id)], version)
+        stale = cache.stale
+        self.assertEqual(len(account_service.get_account_transactions(account)), 2)
+        self.assertGreater(cache.stale, stale)
+
+    def test_a_zero_megabyte_cache_stores_nothing(self):
+        from logic.services import AccountService
+
+        with mock.patch.dict(os.environ, {"BUDGET_RESULT_CACHE_MB": "0"}):
+            cache = self.use_cache()
+        self.assertFalse(cache.enabled)
+        account_service = AccountService()
+        user, account = create_user("nocache")
+        account_service.create_transaction("-10", "only", account, None)
+
+        account_service.get_account_transactions(account)
+        account_service.get_account_transactions(account)
+
+        self.assertEqual(cache.stats()["entries"], 0)
+        self.assertEqual(cache.hits + cache.misses, 0)
+        cache.put(("SELECT 1", ()), [], ())
+        self.assertEqual(cache.stats()["entries"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
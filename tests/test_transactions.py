@@ -0,0 +1,27 @@
+import unittest
+
+from tests.database import use_test_database, create_user
+
+
+class TransactionUpdateTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        use_test_database()
+
+    def test_updating_a_deleted_transaction_is_a_conflict(self):
+        from logic.services import AccountService
+
+        account_service = AccountService()
+        user, account = create_user("update")
+        _, transaction = account_service.create_transaction("-10", "gone", account)
+        account_service.delete_transaction(transaction)
+
+        ok, message = account_service.update_transaction(transaction, amount="-20")
+
+        self.assertFalse(ok)
+        self.assertIn("deleted", message)
+        self.assertEqual(account_service.get_account_by_id(account.id).balance, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()